@@ -0,0 +1,125 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 24 * 3600))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+
+
+def _fold(question):
+    text = unicodedata.normalize("NFKD", question.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def normalize_question(question):
+    return " ".join(re.findall(r"\w+", _fold(question)))
+
+
+def numbered_terms(question):
+    # Codes, model numbers and quantities ("M12", "6205-2RS", "10"), separators
+    # dropped. Questions that differ in them ask about different things, however
+    # close their embeddings are.
+    terms = re.findall(r"\w+(?:[-./]\w+)*", _fold(question))
+    return frozenset(
+        re.sub(r"[-./]", "", term) for term in terms if any(c.isdigit() for c in term)
+    )
+
+
+# Cache of manual answers in front of answer_question. Lookups first try an exact
+# match on the normalized question, then the most similar previously answered
+# question naming the same codes and numbers, by cosine similarity of the question
+# embeddings. Entries expire after a TTL, the least recently used ones are evicted
+# past max_size, and everything is dropped when the manual index version changes.
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        max_size=ANSWER_CACHE_SIZE,
+        ttl=ANSWER_CACHE_TTL,
+        threshold=ANSWER_CACHE_THRESHOLD,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self._matrix = None
+        self._matrix_keys = None
+
+    def set_version(self, version):
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self._matrix = None
+                self.version = version
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [k for k, e in self.entries.items() if now - e["created"] > self.ttl]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            self._matrix = None
+
+    def get(self, question):
+        key = normalize_question(question)
+        with self.lock:
+            self._expire()
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def get_similar(self, question, embedding):
+        terms = numbered_terms(question)
+        with self.lock:
+            self._expire()
+            if not self.entries:
+                return None
+            if self._matrix is None:
+                # Answers found without embedding the question only match exactly
+                self._matrix_keys = [
+                    k for k, e in self.entries.items() if e["embedding"] is not None
+                ]
+                if not self._matrix_keys:
+                    return None
+                self._matrix = np.stack(
+                    [self.entries[k]["embedding"] for k in self._matrix_keys]
+                )
+            query = embedding / (np.linalg.norm(embedding) or 1.0)
+            scores = self._matrix @ query
+            for best in np.argsort(-scores):
+                if scores[best] < self.threshold:
+                    return None
+                key = self._matrix_keys[best]
+                if self.entries[key]["terms"] == terms:
+                    self.entries.move_to_end(key)
+                    return self.entries[key]
+            return None
+
+    def put(self, question, embedding, answer, pages, created=None):
+        # created: when an alias of a cached answer is stored, the original's time,
+        # so paraphrases hitting it do not keep a stale answer alive past the TTL
+        key = normalize_question(question)
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype="float32")
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        with self.lock:
+            self.entries[key] = {
+                "answer": answer,
+                "pages": pages,
+                "embedding": embedding,
+                "terms": numbered_terms(question),
+                "created": time.monotonic() if created is None else created,
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self._matrix = None
@@ -1,17 +1,22 @@
 import os
-import json
-import re
-from flask import Flask, request, jsonify
-import psycopg2
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from openai import OpenAI
 from dotenv import load_dotenv
-from datetime import date, datetime, timedelta
-from collections import defaultdict
-import dateparser
-import numpy as np
-import faiss
-import PyPDF2
-import traceback
+
+from answer_cache import SemanticAnswerCache
+from availability import AvailabilityEngine
+from catalog_index import PieceCatalog
+from conversation_store import create_conversation_store
+from db import db_pool, notifications
+from embedding_cache import EmbeddingCache
+from intent_router import IntentRouter
+from llm_cache import LLMResponseCache
+from manual_corpus import MANUALS_WATCH_INTERVAL, ManualCorpus
+from manual_index import ManualIndex
+from metrics import metrics
+from model_cascade import ModelCascade, route_models
+from pipeline import EMBEDDING_MODEL, Pipeline, main_request
+from streaming import SSE_HEADERS
 
 load_dotenv()
 
@@ -20,294 +25,142 @@ app = Flask(__name__)
 # Configure OpenAI API client
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-# Conversation store to maintain conversation history
-conversation_store = defaultdict(list)
+# Persistent embedding cache so restarts only embed new or changed chunks
+embedding_cache = EmbeddingCache(
+    os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache"), EMBEDDING_MODEL
+)
+
+# Cache of answered manual questions, reset whenever the manual index changes
+answer_cache = SemanticAnswerCache()
+
+# Persistent cache of extraction replies, shared by the workers on a host
+llm_cache = LLMResponseCache()
+
+# Local classifier choosing between the manual, the parts availability or both
+intent_router = IntentRouter()
 
+# Chat models per route, cheapest first (EXTRACT_MODELS, ANSWER_MODELS)
+model_cascade = ModelCascade(
+    {
+        "extract": route_models("extract", "gpt-4o-mini,gpt-4-turbo"),
+        "answer": route_models("answer", "gpt-4o-mini,gpt-4-turbo"),
+    }
+)
 
-# Database connection setup
+
+# Database connection pool
 def get_db_connection():
-    conn = psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-        dbname=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
+    # Pooled connection, returned to the pool when the with-block exits
+    return db_pool.connection()
+
+
+# In-process copy of the pieces catalog, refreshed when the table changes
+piece_catalog = PieceCatalog(get_db_connection, notifications)
+# Free-hour bitmasks per tool and date, dropped when availability changes
+availability_engine = AvailabilityEngine(get_db_connection, notifications)
+# Conversation history, per process or shared by all workers (CONVERSATION_STORE)
+conversation_store = create_conversation_store(get_db_connection)
+notifications.start()
+
+
+@app.before_request
+def start_timing():
+    g.request_started = metrics.start_request()
+
+
+@app.after_request
+def add_server_timing(response):
+    # Streamed responses only carry the stages that ran before their first byte
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    timing = metrics.finish_request(
+        route, str(response.status_code), g.request_started
     )
-    return conn
+    if timing:
+        response.headers["Server-Timing"] = timing
+    return response
 
 
 @app.route("/main", methods=["POST"])
 def consulta_or_manual():
-    data = request.get_json()
-    prompt = data.get("prompt", "")
-    conversation_id = data.get("conversation_id", None)
-    if not prompt:
-        return jsonify({"error": "Prompt não fornecido."}), 400
-    if not conversation_id:
-        return jsonify({"error": "conversation_id não fornecido."}), 400
-
-    # Determine if the request is a manual-related query or a parts-related query
-    if is_manual_query(prompt):
-        return consulta_manual(prompt, conversation_id)
-    else:
-        return consulta(prompt, conversation_id)
-
-
-def is_manual_query(prompt):
-    # Basic keyword check to see if the prompt is related to the manual
-    manual_keywords = ["manual", "guide", "instruction"]
-    return any(keyword in prompt.lower() for keyword in manual_keywords)
-
-
-def consulta(prompt, conversation_id):
-    try:
-        conversation_history = conversation_store[conversation_id]
-
-        piece_descriptions, date_str, conversation_history = extract_pieces(
-            prompt, conversation_history
-        )
-
-        conversation_store[conversation_id] = conversation_history
-
-        if not piece_descriptions and not date_str:
-            return (
-                jsonify({"message": "Nenhuma peça ou data identificada no prompt."}),
-                200,
-            )
-
-        if not piece_descriptions:
-            for message in reversed(conversation_history):
-                if message["role"] == "assistant":
-                    match = re.search(r"\{.*\}", message["content"], re.DOTALL)
-                    if match:
-                        json_obj_str = re.sub(r"\s+", " ", match.group(0))
-                        data = json.loads(json_obj_str)
-                        piece_descriptions = data.get("pieces", [])
-                        break
-
-        pieces_info, matched_descriptions = get_pieces_info(piece_descriptions)
-        unmatched_pieces = list(set(piece_descriptions) - set(matched_descriptions))
-
-        saps = [piece["sap"] for piece in pieces_info]
-
-        # Parse the date string into a datetime.date object, defaulting to today if none provided
-        if date_str:
-            parsed_date = dateparser.parse(
-                date_str, settings={"PREFER_DATES_FROM": "future"}
-            )
-            if parsed_date:
-                parsed_date = parsed_date.date()
-            else:
-                parsed_date = date.today()
-        else:
-            parsed_date = date.today()
-
-        common_hours = get_common_availability(saps, target_date=parsed_date)
-
-        response = {
-            "found_pieces": pieces_info,
-            "unmatched_pieces": unmatched_pieces,
-            "common_hours": common_hours,
-            "date": parsed_date.isoformat(),
-        }
-        return jsonify(response), 200
-
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({"error": f"Erro ao processar a consulta: {str(e)}"}), 500
-
-
-def consulta_manual(prompt, conversation_id):
-    try:
-        conversation_history = conversation_store[conversation_id]
-
-        answer = answer_question(prompt, index, embeddings)
-
-        # Save the prompt and answer to conversation history
-        conversation_store[conversation_id].append({"role": "user", "content": prompt})
-        conversation_store[conversation_id].append(
-            {"role": "assistant", "content": answer}
-        )
-
-        return jsonify({"answer": answer}), 200
-
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({"error": f"Erro ao processar a consulta: {str(e)}"}), 500
-
-
-def extract_pieces(prompt, conversation_history):
-    try:
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                    "Você é um assistente que ajuda a identificar peças e datas mencionadas em um texto. "
-                    "Mantenha o contexto da conversa ao interpretar o pedido do usuário. "
-                    "Retorne apenas um JSON válido com as peças e a data em formato ISO (AAAA-MM-DD), resolvendo datas relativas como 'hoje' ou 'amanhã' para datas absolutas, sem texto adicional. "
-                    'Exemplo: {"pieces": ["peça1", "peça2"], "date": "2024-10-29"}'
-                ),
-            },
-            *conversation_history,
-            {"role": "user", "content": prompt},
-        ]
-
-        response = client.chat.completions.create(
-            model="gpt-4-turbo",
-            messages=messages,
-            temperature=0,
-        )
-
-        assistant_message = response.choices[0].message.content
-
-        conversation_history.append({"role": "user", "content": prompt})
-        conversation_history.append({"role": "assistant", "content": assistant_message})
-
-        match = re.search(r"\{.*\}", assistant_message, re.DOTALL)
-        if match:
-            json_obj_str = re.sub(r"\s+", " ", match.group(0))
-            data = json.loads(json_obj_str)
-            pieces_list = data.get("pieces", [])
-            date_str = data.get("date", None)
-            return pieces_list, date_str, conversation_history
-        else:
-            return [], None, conversation_history
-
-    except Exception as e:
-        traceback.print_exc()
-        return [], None, conversation_history
-
-
-def get_pieces_info(descriptions):
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        similarity_threshold = 0.75
-
-        pieces, matched_descriptions = [], []
-
-        for desc in descriptions:
-            sql = """
-                SELECT sap, categoria, descricao,
-                       similarity(unaccent(UPPER(descricao)), unaccent(%s)) AS sim_score
-                FROM pieces
-                WHERE similarity(unaccent(UPPER(descricao)), unaccent(%s)) >= %s
-                ORDER BY sim_score DESC
-                LIMIT 1;
-            """
-            cur.execute(sql, (desc.upper(), desc.upper(), similarity_threshold))
-            row = cur.fetchone()
-            if row:
-                pieces.append({"sap": row[0], "categoria": row[1], "descricao": row[2]})
-                matched_descriptions.append(desc)
-
-        cur.close()
-        conn.close()
-        return pieces, matched_descriptions
-
-    except Exception as e:
-        traceback.print_exc()
-        return [], []
-
-
-def get_common_availability(saps, target_date=None):
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        if target_date is None:
-            target_date = date.today()
-
-        placeholders = ", ".join(["%s"] * len(saps))
-        sql = f"""
-            SELECT hora
-            FROM availability
-            WHERE sap IN ({placeholders}) AND data = %s AND ocupado = FALSE
-            GROUP BY hora
-            HAVING COUNT(DISTINCT sap) = %s
-            ORDER BY hora;
-        """
-        values = saps + [target_date, len(saps)]
-
-        cur.execute(sql, values)
-        hours = [row[0] for row in cur.fetchall()]
-
-        cur.close()
-        conn.close()
-        return hours
-
-    except Exception as e:
-        traceback.print_exc()
-        return []
-
-
-def extract_text_from_pdf(pdf_path):
-    chunks = []
-    with open(pdf_path, "rb") as file:
-        reader = PyPDF2.PdfReader(file)
-        for page_num, page in enumerate(reader.pages):
-            text = page.extract_text()
-            if text:
-                chunks.append({"text": text, "page": page_num + 1})
-    return chunks
-
-
-def create_embeddings(chunks):
-    embeddings = []
-    for chunk in chunks:
-        response = client.embeddings.create(
-            input=chunk["text"], model="text-embedding-ada-002"
-        )
-        embedding = response.data[0].embedding
-        embeddings.append(
-            {"embedding": embedding, "text": chunk["text"], "page": chunk["page"]}
-        )
-    return embeddings
-
-
-def store_embeddings(embeddings):
-    dimension = len(embeddings[0]["embedding"])
-    index = faiss.IndexFlatL2(dimension)
-    vectors = np.array([e["embedding"] for e in embeddings]).astype("float32")
-    index.add(vectors)
-    return index
-
-
-def answer_question(question, index, embeddings, k=3):
-    response = client.embeddings.create(input=question, model="text-embedding-ada-002")
-    question_embedding = np.array(response.data[0].embedding).astype("float32")
-
-    distances, indices = index.search(np.array([question_embedding]), k)
-    relevant_chunks = [embeddings[i] for i in indices[0]]
-
-    context = "\n\n".join(
-        [f"Página {chunk['page']}: {chunk['text']}" for chunk in relevant_chunks]
-    )
-
-    messages = [
-        {
-            "role": "system",
-            "content": "Você é um assistente que responde perguntas com base no seguinte manual.",
-        },
-        {"role": "system", "content": context},
-        {"role": "user", "content": question},
-    ]
-
-    response = client.chat.completions.create(
-        model="gpt-4-turbo", messages=messages, temperature=0
+    prompt, conversation_id, error = main_request(request.get_json())
+    if error:
+        return jsonify(error), 400
+    payload, status, headers = pipeline.main(prompt, conversation_id)
+    return jsonify(payload), status, headers
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify(pipeline.health()), 200
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    payload, status = pipeline.readiness()
+    return jsonify(payload), status
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/main/stream", methods=["POST"])
+def consulta_or_manual_stream():
+    # Same as /main, but as Server-Sent Events
+    prompt, conversation_id, error = main_request(request.get_json())
+    if error:
+        return jsonify(error), 400
+    stream, unavailable = pipeline.stream(prompt)
+    if unavailable:
+        payload, status, headers = unavailable
+        return jsonify(payload), status, headers
+    return Response(
+        stream_with_context(stream(prompt, conversation_id)),
+        mimetype="text/event-stream",
+        headers=SSE_HEADERS,
     )
 
-    answer = response.choices[0].message.content.strip()
-    pages = [str(chunk["page"]) for chunk in relevant_chunks]
-    answer += f"\n\nReferências: Páginas {', '.join(pages)} do manual."
-    return answer
 
+@app.route("/janelas", methods=["POST"])
+def janelas():
+    # Earliest windows where all requested tools are free for `duration` hours
+    payload, status = pipeline.janelas(request.get_json())
+    return jsonify(payload), status
+
+
+# Load and process the manuals (every PDF in MANUALS_DIR, plus the legacy manual.pdf)
+corpus = ManualCorpus(extra_files=["manual.pdf"])
+manual_index = ManualIndex(
+    client, corpus, embedding_cache, answer_cache, EMBEDDING_MODEL
+)
+# Indexed on a background thread so the server starts right away; until then manual
+# questions get an "indexing" status and /ready reports the progress
+manual_index.start(MANUALS_WATCH_INTERVAL)
+
+pipeline = Pipeline(
+    client,
+    get_db_connection,
+    answer_cache=answer_cache,
+    llm_cache=llm_cache,
+    intent_router=intent_router,
+    model_cascade=model_cascade,
+    piece_catalog=piece_catalog,
+    availability_engine=availability_engine,
+    conversation_store=conversation_store,
+    manual_index=manual_index,
+)
+
+
+def start_worker():
+    # Called in every worker gunicorn forks from the preloaded app (gunicorn.conf.py):
+    # the master keeps building the index, workers memory-map what it publishes.
+    # The OpenAI client's connection pool may be mid-request in the master, so
+    # every worker gets its own.
+    pipeline.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    notifications.start()
+    manual_index.follow()
 
-# Load and process the manual PDF
-pdf_path = "manual.pdf"
-chunks = extract_text_from_pdf(pdf_path)
-embeddings = create_embeddings(chunks)
-index = store_embeddings(embeddings)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5001)), debug=True)
@@ -0,0 +1,160 @@
+# Async serving mode: same API as app2.py, but handlers are coroutines, OpenAI calls
+# go through AsyncOpenAI and Postgres through asyncpg, so a request waiting on the
+# LLM or the database does not hold an OS thread. Serve it with an ASGI server:
+#   hypercorn app_async:app --bind 0.0.0.0:5001
+import os
+from quart import Quart, Response, g, request, jsonify, stream_with_context
+from openai import AsyncOpenAI, OpenAI
+from dotenv import load_dotenv
+
+from answer_cache import SemanticAnswerCache
+from availability import AvailabilityEngine
+from catalog_index import PieceCatalog
+from conversation_store import create_conversation_store
+from db import AsyncConnectionPool, notifications
+from embedding_cache import EmbeddingCache
+from intent_router import IntentRouter
+from llm_cache import LLMResponseCache
+from manual_corpus import MANUALS_WATCH_INTERVAL, ManualCorpus
+from manual_index import ManualIndex
+from metrics import metrics
+from model_cascade import ModelCascade, route_models
+from pipeline import EMBEDDING_MODEL, AsyncPipeline, main_request
+from streaming import SSE_HEADERS
+
+load_dotenv()
+
+app = Quart(__name__)
+
+# Async client for requests; the sync client only embeds the corpus while indexing
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+ingest_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+# Persistent embedding cache so restarts only embed new or changed chunks
+embedding_cache = EmbeddingCache(
+    os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache"), EMBEDDING_MODEL
+)
+
+# Cache of answered manual questions, reset whenever the manual index changes
+answer_cache = SemanticAnswerCache()
+
+# Persistent cache of extraction replies, shared by the workers on a host
+llm_cache = LLMResponseCache()
+
+# Local classifier choosing between the manual, the parts availability or both
+intent_router = IntentRouter()
+
+# Chat models per route, cheapest first (EXTRACT_MODELS, ANSWER_MODELS)
+model_cascade = ModelCascade(
+    {
+        "extract": route_models("extract", "gpt-4o-mini,gpt-4-turbo"),
+        "answer": route_models("answer", "gpt-4o-mini,gpt-4-turbo"),
+    }
+)
+
+# The catalog and availability caches only use the async loaders here
+piece_catalog = PieceCatalog(None, notifications)
+availability_engine = AvailabilityEngine(None, notifications)
+# Conversations are read and written through the asyncpg pool when shared
+conversation_store = create_conversation_store()
+
+corpus = ManualCorpus(extra_files=["manual.pdf"])
+manual_index = ManualIndex(
+    ingest_client, corpus, embedding_cache, answer_cache, EMBEDDING_MODEL
+)
+
+pipeline = AsyncPipeline(
+    client,
+    # Connects on the first query, so the server starts while Postgres is down
+    AsyncConnectionPool(),
+    answer_cache=answer_cache,
+    llm_cache=llm_cache,
+    intent_router=intent_router,
+    model_cascade=model_cascade,
+    piece_catalog=piece_catalog,
+    availability_engine=availability_engine,
+    conversation_store=conversation_store,
+    manual_index=manual_index,
+)
+
+
+@app.before_serving
+async def startup():
+    notifications.start()
+
+    # The manuals are indexed on a background thread; until then manual questions
+    # get an "indexing" status and /ready reports the progress
+    manual_index.start(MANUALS_WATCH_INTERVAL)
+
+
+@app.after_serving
+async def shutdown():
+    await pipeline.pg_pool.close()
+
+
+@app.before_request
+async def start_timing():
+    g.request_started = metrics.start_request()
+
+
+@app.after_request
+async def add_server_timing(response):
+    # Streamed responses only carry the stages that ran before their first byte
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    timing = metrics.finish_request(
+        route, str(response.status_code), g.request_started
+    )
+    if timing:
+        response.headers["Server-Timing"] = timing
+    return response
+
+
+@app.route("/main", methods=["POST"])
+async def consulta_or_manual():
+    prompt, conversation_id, error = main_request(await request.get_json())
+    if error:
+        return jsonify(error), 400
+    payload, status, headers = await pipeline.main(prompt, conversation_id)
+    return jsonify(payload), status, headers
+
+
+@app.route("/health", methods=["GET"])
+async def health():
+    return jsonify(pipeline.health()), 200
+
+
+@app.route("/ready", methods=["GET"])
+async def ready():
+    payload, status = pipeline.readiness()
+    return jsonify(payload), status
+
+
+@app.route("/metrics", methods=["GET"])
+async def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/main/stream", methods=["POST"])
+async def consulta_or_manual_stream():
+    # Same as /main, but as Server-Sent Events
+    prompt, conversation_id, error = main_request(await request.get_json())
+    if error:
+        return jsonify(error), 400
+    stream, unavailable = pipeline.stream(prompt)
+    if unavailable:
+        payload, status, headers = unavailable
+        return jsonify(payload), status, headers
+    # The generator outlives this handler, so it carries the request context along
+    events = stream_with_context(stream)(prompt, conversation_id)
+    return Response(events, mimetype="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.route("/janelas", methods=["POST"])
+async def janelas():
+    # Earliest windows where all requested tools are free for `duration` hours
+    payload, status = await pipeline.janelas(await request.get_json())
+    return jsonify(payload), status
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5001)))
@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from metrics import metrics
+
+AVAILABILITY_CACHE_DATES = int(os.getenv("AVAILABILITY_CACHE_DATES", 64))
+# Upper bound on staleness if a change notification is ever missed
+AVAILABILITY_CACHE_TTL = float(os.getenv("AVAILABILITY_CACHE_TTL", 300))
+WINDOW_HORIZON_DAYS = int(os.getenv("WINDOW_HORIZON_DAYS", 14))
+WINDOW_LIMIT = int(os.getenv("WINDOW_LIMIT", 5))
+
+# One row per SAP with its free hours folded into a bitmask (bit h = hour h free)
+FREE_MASKS_SQL = """
+    SELECT data, sap, bit_or(1::bigint << hora)
+    FROM availability
+    WHERE data = ANY(%s) AND ocupado = FALSE
+    GROUP BY data, sap;
+"""
+FREE_MASKS_ASYNC_SQL = FREE_MASKS_SQL.replace("%s", "$1::date[]")
+
+
+def mask_hours(mask):
+    hours = []
+    hour = 0
+    while mask:
+        if mask & 1:
+            hours.append(hour)
+        mask >>= 1
+        hour += 1
+    return hours
+
+
+def common_mask(masks, saps):
+    if not saps:
+        return 0
+    mask = -1
+    for sap in saps:
+        mask &= masks.get(sap, 0)
+        if not mask:
+            break
+    return mask
+
+
+def window_starts(mask, duration):
+    # Bit h stays set only if hours h .. h + duration - 1 are all free
+    starts = mask
+    for offset in range(1, duration):
+        starts &= mask >> offset
+    return mask_hours(starts)
+
+
+def bookable_mask(mask, day, now):
+    # Hours that have already started cannot be booked any more
+    if day < now.date():
+        return 0
+    if day == now.date():
+        mask &= -1 << (now.hour + 1)
+    return mask
+
+
+# Free-hour bitmasks per (sap, date), cached per date. Intersecting the tools of a
+# request is a bitwise AND per SAP, independent of the size of the availability
+# table. Cached dates are dropped on availability_changed notifications.
+class AvailabilityEngine:
+    def __init__(
+        self,
+        get_connection,
+        listener=None,
+        max_dates=AVAILABILITY_CACHE_DATES,
+        ttl=AVAILABILITY_CACHE_TTL,
+    ):
+        self.get_connection = get_connection
+        self.max_dates = max_dates
+        self.ttl = ttl
+        self.dates = OrderedDict()
+        # Bumped by every invalidation; masks read before one are not cached
+        self.generation = 0
+        self.lock = threading.Lock()
+        if listener is not None:
+            listener.subscribe("availability_changed", self.on_change, self.invalidate)
+
+    def invalidate(self):
+        with self.lock:
+            self.dates.clear()
+            self.generation += 1
+
+    def on_change(self, payload):
+        self.invalidate()
+
+    def _cached(self, day):
+        entry = self.dates.get(day)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        self.dates.move_to_end(day)
+        return entry[1]
+
+    def _lookup(self, days):
+        result = {}
+        with self.lock:
+            generation = self.generation
+            for day in days:
+                masks = self._cached(day)
+                if masks is not None:
+                    result[day] = masks
+        missing = [day for day in days if day not in result]
+        metrics.cache("availability", "hit", len(result))
+        metrics.cache("availability", "miss", len(missing))
+        return result, missing, generation
+
+    def _store(self, missing, rows, generation):
+        loaded = {day: {} for day in missing}
+        for day, sap, mask in rows:
+            loaded[day][sap] = mask
+        now = time.monotonic()
+        with self.lock:
+            if generation != self.generation:
+                # Availability changed while these were read: serve, do not keep
+                return loaded
+            for day, masks in loaded.items():
+                self.dates[day] = (now, masks)
+                self.dates.move_to_end(day)
+            while len(self.dates) > self.max_dates:
+                self.dates.popitem(last=False)
+        return loaded
+
+    def masks_for_dates(self, days):
+        # Returns {date: {sap: mask}}, loading every uncached date in one query
+        result, missing, generation = self._lookup(days)
+        if missing:
+            with metrics.stage("postgres"):
+                with self.get_connection() as conn, conn.cursor() as cur:
+                    cur.execute(FREE_MASKS_SQL, (missing,))
+                    rows = cur.fetchall()
+            result.update(self._store(missing, rows, generation))
+        return result
+
+    async def masks_for_dates_async(self, days, pg_pool):
+        # Same as masks_for_dates, over an asyncpg pool
+        result, missing, generation = self._lookup(days)
+        if missing:
+            with metrics.stage("postgres"):
+                rows = await pg_pool.fetch(FREE_MASKS_ASYNC_SQL, missing)
+            rows = [tuple(row) for row in rows]
+            result.update(self._store(missing, rows, generation))
+        return result
+
+    def common_hours(self, saps, day):
+        masks = self.masks_for_dates([day])[day]
+        return mask_hours(common_mask(masks, saps))
+
+    async def common_hours_async(self, saps, day, pg_pool):
+        masks = (await self.masks_for_dates_async([day], pg_pool))[day]
+        return mask_hours(common_mask(masks, saps))
+
+    def _windows(self, saps, duration, days, masks_by_date, limit, per_day, now):
+        windows = []
+        if limit < 1:
+            return windows
+        now = now or datetime.now()
+        for day in days:
+            mask = bookable_mask(common_mask(masks_by_date[day], saps), day, now)
+            starts = window_starts(mask, duration)
+            for start in starts[:1] if per_day else starts:
+                windows.append(
+                    {"date": day.isoformat(), "start": start, "end": start + duration}
+                )
+                if len(windows) >= limit:
+                    return windows
+        return windows
+
+    def earliest_windows(
+        self,
+        saps,
+        duration,
+        start_date,
+        horizon_days=WINDOW_HORIZON_DAYS,
+        limit=WINDOW_LIMIT,
+        per_day=False,
+        now=None,
+    ):
+        # Earliest `limit` windows of `duration` contiguous hours in which every SAP
+        # is free, scanning start_date .. start_date + horizon_days - 1 from the hour
+        # after `now` (the current time by default); per_day keeps only the first
+        # window of each day
+        if not saps or duration < 1:
+            return []
+        days = [start_date + timedelta(days=i) for i in range(horizon_days)]
+        masks_by_date = self.masks_for_dates(days)
+        return self._windows(saps, duration, days, masks_by_date, limit, per_day, now)
+
+    async def earliest_windows_async(
+        self,
+        saps,
+        duration,
+        start_date,
+        pg_pool,
+        horizon_days=WINDOW_HORIZON_DAYS,
+        limit=WINDOW_LIMIT,
+        per_day=False,
+        now=None,
+    ):
+        if not saps or duration < 1:
+            return []
+        days = [start_date + timedelta(days=i) for i in range(horizon_days)]
+        masks_by_date = await self.masks_for_dates_async(days, pg_pool)
+        return self._windows(saps, duration, days, masks_by_date, limit, per_day, now)
@@ -0,0 +1,369 @@
+# Bulk loader for availability exports from the ERP:
+#   python availability_loader.py export.csv [export2.jsonl.gz ...] [--replace]
+# Rows are read, validated and streamed into COPY a chunk at a time, so memory does
+# not grow with the size of the export. They land in a temporary staging table and
+# are merged into availability by one statement in the same transaction: readers
+# see the old calendar or the new one, never a mix, and a failed load changes
+# nothing. The availability_changed trigger then tells the backends to refresh.
+import argparse
+import csv
+import functools
+import gzip
+import io
+import json
+import sys
+import time
+from datetime import date, datetime
+
+import psycopg2
+from dotenv import load_dotenv
+
+# db reads its pool and timeout settings when imported
+load_dotenv()
+
+from db import db_pool  # noqa: E402
+
+COLUMNS = ("sap", "data", "hora", "ocupado")
+BUSY = {
+    **dict.fromkeys(("1", "t", "true", "s", "sim", "y", "yes", "ocupado"), "t"),
+    **dict.fromkeys(("0", "f", "false", "n", "nao", "não", "no", "livre"), "f"),
+}
+# Rows between progress lines on stderr
+PROGRESS_EVERY = 1_000_000
+
+STAGING_SQL = """
+    CREATE TEMP TABLE availability_raw (
+      line BIGINT NOT NULL,
+      sap VARCHAR NOT NULL,
+      data DATE NOT NULL,
+      hora INT NOT NULL,
+      ocupado BOOLEAN NOT NULL
+    ) ON COMMIT DROP;
+"""
+# The last row of the export wins when it repeats a (sap, data, hora)
+DEDUPE_SQL = """
+    CREATE TEMP TABLE availability_staging ON COMMIT DROP AS
+    SELECT DISTINCT ON (sap, data, hora) sap, data, hora, ocupado
+    FROM availability_raw
+    ORDER BY sap, data, hora, line DESC;
+    ALTER TABLE availability_staging ADD PRIMARY KEY (sap, data, hora);
+    ANALYZE availability_staging;
+"""
+# Rows whose value does not change are left alone, so they are not rewritten
+UPSERT_SQL = """
+    WITH upserted AS (
+      INSERT INTO availability (sap, data, hora, ocupado)
+      SELECT sap, data, hora, ocupado FROM availability_staging
+      ON CONFLICT (sap, data, hora) DO UPDATE SET ocupado = EXCLUDED.ocupado
+      WHERE availability.ocupado IS DISTINCT FROM EXCLUDED.ocupado
+      RETURNING xmax = 0 AS inserted
+    )
+    SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+    FROM upserted;
+"""
+# With --replace the export is the whole calendar of its tools over its dates:
+# their hours missing from it are dropped
+REPLACE_SQL = """
+    DELETE FROM availability a
+    USING (SELECT DISTINCT sap FROM availability_staging) s
+    WHERE a.sap = s.sap
+      AND a.data BETWEEN (SELECT min(data) FROM availability_staging)
+                     AND (SELECT max(data) FROM availability_staging)
+      AND NOT EXISTS (
+        SELECT 1 FROM availability_staging n
+        WHERE n.sap = a.sap AND n.data = a.data AND n.hora = a.hora
+      );
+"""
+
+
+# The parsers return the COPY text of a field. An export repeats a few dozen dates
+# and 24 hours millions of times, so each distinct value is parsed once.
+@functools.lru_cache(maxsize=4096)
+def copy_date(value):
+    value = value.strip()
+    if "/" in value:
+        # DD/MM/YYYY, as the ERP writes dates in pt-BR exports
+        return datetime.strptime(value, "%d/%m/%Y").date().isoformat()
+    return date.fromisoformat(value[:10]).isoformat()
+
+
+@functools.lru_cache(maxsize=256)
+def copy_hour(value):
+    hour = int(value)
+    if not 0 <= hour <= 23:
+        raise ValueError(f"hora out of range: {hour}")
+    return str(hour)
+
+
+def copy_busy(value):
+    busy = BUSY.get(str(value).strip().lower())
+    if busy is None:
+        raise ValueError(f"ocupado is not a boolean: {value!r}")
+    return busy
+
+
+def open_text(path):
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, "r", encoding="utf-8-sig", newline="")
+
+
+def export_format(path, default=None):
+    name = path[:-3] if path.endswith(".gz") else path
+    if default:
+        return default
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return "csv"
+
+
+def read_records(path, fmt, delimiter=None):
+    # Yields (line number, record dict or None, raw text) lazily from one export
+    with open_text(path) as file:
+        if fmt == "jsonl":
+            for number, text in enumerate(file, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    record = json.loads(text)
+                except ValueError:
+                    record = None
+                yield number, record if isinstance(record, dict) else None, text
+            return
+
+        if delimiter is None:
+            sample = file.readline()
+            delimiter = ";" if sample.count(";") > sample.count(",") else ","
+            file = _prepend(sample, file)
+        reader = csv.reader(file, delimiter=delimiter)
+        try:
+            header = [name.strip().lower() for name in next(reader, [])]
+        except csv.Error as e:
+            raise ValueError(f"{path}: unreadable header: {e}") from None
+        missing = [column for column in COLUMNS if column not in header]
+        if missing:
+            raise ValueError(f"{path}: missing columns {', '.join(missing)}")
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                # A line the CSV parser cannot read (a NUL byte, an oversized
+                # field) is rejected like any other malformed row
+                yield reader.line_num, None, str(e)
+                continue
+            if not any(row):
+                continue
+            yield reader.line_num, dict(zip(header, row)), delimiter.join(row)
+
+
+def _prepend(line, file):
+    yield line
+    yield from file
+
+
+# Validates export records into COPY rows, counting and optionally writing the
+# rejected ones; aborts (and so rolls the load back) past max_errors rejections
+class Validator:
+    def __init__(self, saps, rejects=None, max_errors=None):
+        self.saps = saps
+        self.rejects = rejects
+        self.max_errors = max_errors
+        self.read = 0
+        self.rejected = 0
+        self.reasons = {}
+        self.started = time.monotonic()
+
+    def _reject(self, path, number, reason, raw):
+        self.rejected += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        if self.rejects is not None:
+            self.rejects.writerow([path, number, reason, raw.rstrip("\r\n")])
+        if self.max_errors is not None and self.rejected > self.max_errors:
+            raise ValueError(f"More than {self.max_errors} rejected rows, aborting")
+
+    def rows(self, path, records):
+        for number, record, raw in records:
+            self.read += 1
+            if self.read % PROGRESS_EVERY == 0:
+                elapsed = time.monotonic() - self.started
+                print(
+                    f"{self.read} rows read, {self.rejected} rejected "
+                    f"({self.read / elapsed:.0f} rows/s)",
+                    file=sys.stderr,
+                )
+            if record is None:
+                self._reject(path, number, "malformed", raw)
+                continue
+            sap = str(record.get("sap") or "").strip()
+            if sap not in self.saps:
+                self._reject(path, number, "unknown sap", raw)
+                continue
+            try:
+                day = copy_date(str(record.get("data")))
+                hour = copy_hour(str(record.get("hora")).strip())
+                busy = copy_busy(record.get("ocupado"))
+            except ValueError:
+                self._reject(path, number, "invalid value", raw)
+                continue
+            yield sap, day, hour, busy
+
+
+# File-like view of validated rows as COPY text, for cursor.copy_expert: each read()
+# pulls just enough rows from the iterator to fill the requested size
+class CopyStream:
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.line = 0
+        self.pending = ""
+        self.error = None
+
+    def read(self, size=-1):
+        parts, length = [self.pending], len(self.pending)
+        while size < 0 or length < size:
+            try:
+                row = next(self.rows, None)
+            except ValueError as e:
+                # psycopg2 reports it as a cancelled COPY; keep the reason
+                self.error = e
+                raise
+            if row is None:
+                break
+            self.line += 1
+            text = "\t".join((str(self.line), *row)) + "\n"
+            parts.append(text)
+            length += len(text)
+        data = "".join(parts)
+        if size < 0:
+            size = len(data)
+        self.pending = data[size:]
+        return data[:size]
+
+
+def load(
+    paths,
+    fmt=None,
+    delimiter=None,
+    replace=False,
+    rejects=None,
+    max_errors=None,
+    dry_run=False,
+):
+    # Loads the exports in one transaction and returns a summary of the load
+    started = time.monotonic()
+    with db_pool.connection() as conn, conn.cursor() as cur:
+        # Bulk loads outlast the pool's per-statement timeout
+        cur.execute("SET LOCAL statement_timeout = 0;")
+        # One load at a time: concurrent merges of overlapping calendars would race
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('availability_loader'));")
+        cur.execute("SELECT sap FROM pieces;")
+        validator = Validator({row[0] for row in cur.fetchall()}, rejects, max_errors)
+
+        def rows():
+            for path in paths:
+                records = read_records(path, export_format(path, fmt), delimiter)
+                yield from validator.rows(path, records)
+
+        summary = {"inserted": 0, "updated": 0, "deleted": 0}
+        if dry_run:
+            for _ in rows():
+                pass
+        else:
+            cur.execute(STAGING_SQL)
+            stream = CopyStream(rows())
+            try:
+                cur.copy_expert(
+                    f"COPY availability_raw (line, {', '.join(COLUMNS)}) FROM STDIN",
+                    stream,
+                    size=64 * 1024,
+                )
+            except psycopg2.Error:
+                if stream.error:
+                    raise stream.error from None
+                raise
+            cur.execute(DEDUPE_SQL)
+            if replace:
+                cur.execute(REPLACE_SQL)
+                summary["deleted"] = cur.rowcount
+            cur.execute(UPSERT_SQL)
+            summary["inserted"], summary["updated"] = cur.fetchone()
+            cur.execute("ANALYZE availability;")
+
+    return dict(
+        summary,
+        read=validator.read,
+        rejected=validator.rejected,
+        reasons=validator.reasons,
+        seconds=round(time.monotonic() - started, 1),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load availability exports (CSV or JSONL with sap, data, hora, "
+        "ocupado) through COPY and merge them into the availability table"
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="export files (.gz allowed), - for stdin"
+    )
+    parser.add_argument(
+        "--format", choices=("csv", "jsonl"), help="default: by file extension"
+    )
+    parser.add_argument("--delimiter", help="CSV delimiter (default: , or ; detected)")
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="drop the hours of the exported tools and dates missing from the export",
+    )
+    parser.add_argument("--rejects", help="write rejected rows to this CSV")
+    parser.add_argument(
+        "--max-errors",
+        type=int,
+        help="abort, loading nothing, past this many rejections",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only validate")
+    args = parser.parse_args()
+
+    rejects_file = rejects = None
+    if args.rejects:
+        rejects_file = open(args.rejects, "w", newline="", encoding="utf-8")
+        rejects = csv.writer(rejects_file)
+        rejects.writerow(["file", "line", "reason", "row"])
+    try:
+        summary = load(
+            args.paths,
+            args.format,
+            args.delimiter,
+            args.replace,
+            rejects,
+            args.max_errors,
+            args.dry_run,
+        )
+    except ValueError as e:
+        print("Load aborted, nothing was changed:", e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if rejects_file:
+            rejects_file.close()
+
+    loaded = summary["read"] - summary["rejected"]
+    print(
+        f"{summary['read']} rows read, {loaded} valid, {summary['rejected']} rejected "
+        f"in {summary['seconds']}s"
+    )
+    for reason, count in sorted(summary["reasons"].items()):
+        print(f"  {reason}: {count}")
+    if args.dry_run:
+        print("Dry run: nothing loaded")
+    else:
+        print(
+            f"availability: {summary['inserted']} inserted, {summary['updated']} updated, "
+            f"{summary['deleted']} deleted"
+        )
+
+
+if __name__ == "__main__":
+    main()
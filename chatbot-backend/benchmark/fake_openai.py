@@ -0,0 +1,312 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from catalog_index import fold
+from tokens import estimate_tokens
+
+EMBEDDING_DIMENSION = 1536
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+RELATIVE_DATES = {"hoje": 0, "amanha": 1, "depois de amanha": 2}
+ANSWER_WORDS = (
+    "verifique o componente antes de iniciar a manutencao e siga o procedimento "
+    "descrito na secao correspondente do manual respeitando o torque indicado"
+).split()
+
+
+def embed(text):
+    # Hashed bag of words: similar texts get similar vectors, the same text always
+    # the same one
+    vector = np.zeros(EMBEDDING_DIMENSION, dtype="float32")
+    for word in re.findall(r"\w+", fold(text)):
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        vector[int.from_bytes(digest[:4], "little") % EMBEDDING_DIMENSION] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+# Deterministic stand-in for the chat completions and embeddings endpoints, with
+# configurable latency. Extraction requests are answered with the catalog pieces
+# named in the prompt and its date; manual questions with a fixed-length answer
+# derived from the question. Latencies get a jitter seeded by the request body, so
+# the same request always takes the same time.
+class FakeOpenAI:
+    def __init__(
+        self,
+        pieces=(),
+        chat_latency=0.5,
+        token_latency=0.01,
+        embedding_latency=0.05,
+        jitter=0.0,
+        answer_tokens=120,
+    ):
+        self.pieces = [(fold(piece), piece) for piece in pieces]
+        self.chat_latency = chat_latency
+        self.token_latency = token_latency
+        self.embedding_latency = embedding_latency
+        self.jitter = jitter
+        self.answer_tokens = answer_tokens
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.server = None
+
+    def _delay(self, seconds, body):
+        if self.jitter:
+            rng = random.Random(hashlib.sha256(body).digest())
+            seconds *= 1 + rng.uniform(-self.jitter, self.jitter)
+        time.sleep(max(seconds, 0.0))
+
+    def _record(self, endpoint, seconds, prompt_tokens, completion_tokens=0):
+        with self.lock:
+            entry = self.stats.setdefault(
+                endpoint,
+                {
+                    "requests": 0,
+                    "seconds": 0.0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                },
+            )
+            entry["requests"] += 1
+            entry["seconds"] += seconds
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+    def extract(self, prompt):
+        folded = fold(prompt)
+        pieces = [piece for key, piece in self.pieces if key in folded]
+        found = ISO_DATE.search(prompt)
+        if found:
+            day = found.group(0)
+        else:
+            # The longest phrase wins: "depois de amanha" also contains "amanha"
+            offsets = [days for word, days in RELATIVE_DATES.items() if word in folded]
+            day = None
+            if offsets:
+                day = (date.today() + timedelta(days=max(offsets))).isoformat()
+        return json.dumps({"pieces": pieces, "date": day}, ensure_ascii=False)
+
+    def answer(self, question):
+        rng = random.Random(hashlib.sha256(question.encode("utf-8")).digest())
+        words = [rng.choice(ANSWER_WORDS) for _ in range(self.answer_tokens)]
+        return " ".join(words).capitalize() + "."
+
+    def chat(self, body):
+        messages = body["messages"]
+        prompt = messages[-1]["content"]
+        if "identificar peças" in messages[0]["content"]:
+            return self.extract(prompt)
+        return self.answer(prompt)
+
+    def start(self, host="127.0.0.1", port=0):
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        thread = threading.Thread(
+            target=self.server.serve_forever, name="fake-openai", daemon=True
+        )
+        thread.start()
+        return f"http://{host}:{self.server.server_port}/v1"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+
+def _handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send_json(fake.snapshot())
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            started = time.perf_counter()
+            raw = self.rfile.read(int(self.headers["Content-Length"]))
+            body = json.loads(raw)
+            if self.path.endswith("/embeddings"):
+                inputs = body["input"]
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                tokens = sum(estimate_tokens(text) for text in inputs)
+                fake._delay(fake.embedding_latency, raw)
+                self._send_json(
+                    {
+                        "object": "list",
+                        "model": body["model"],
+                        "data": [
+                            {"object": "embedding", "index": i, "embedding": embed(t)}
+                            for i, t in enumerate(inputs)
+                        ],
+                        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                    }
+                )
+                fake._record("embeddings", time.perf_counter() - started, tokens)
+                return
+            if not self.path.endswith("/chat/completions"):
+                self.send_error(404)
+                return
+
+            content = fake.chat(body)
+            prompt_tokens = sum(
+                estimate_tokens(message["content"]) for message in body["messages"]
+            )
+            words = content.split(" ")
+            if body.get("stream"):
+                # Time to first token, then one chunk per word
+                fake._delay(fake.chat_latency, raw)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, word in enumerate(words):
+                    chunk = {
+                        "id": "fake",
+                        "object": "chat.completion.chunk",
+                        "created": 0,
+                        "model": body["model"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "delta": {"content": word if i == 0 else " " + word},
+                                "finish_reason": None,
+                            }
+                        ],
+                    }
+                    self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(fake.token_latency)
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    usage = {
+                        "id": "fake",
+                        "object": "chat.completion.chunk",
+                        "created": 0,
+                        "model": body["model"],
+                        "choices": [],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": len(words),
+                            "total_tokens": prompt_tokens + len(words),
+                        },
+                    }
+                    self._send_chunk(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+                self._send_chunk(b"data: [DONE]\n\n")
+                self._send_chunk(b"")
+            else:
+                fake._delay(fake.chat_latency + fake.token_latency * len(words), raw)
+                self._send_json(
+                    {
+                        "id": "fake",
+                        "object": "chat.completion",
+                        "created": 0,
+                        "model": body["model"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": content},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": len(words),
+                            "total_tokens": prompt_tokens + len(words),
+                        },
+                    }
+                )
+            fake._record(
+                "chat", time.perf_counter() - started, prompt_tokens, len(words)
+            )
+
+    return Handler
+
+
+def add_latency_arguments(parser):
+    parser.add_argument(
+        "--chat-latency",
+        type=float,
+        default=0.5,
+        help="seconds before the first token of a chat completion",
+    )
+    parser.add_argument(
+        "--token-latency", type=float, default=0.01, help="seconds per generated word"
+    )
+    parser.add_argument(
+        "--embedding-latency",
+        type=float,
+        default=0.05,
+        help="seconds per embeddings request",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.1,
+        help="latency varies by up to this fraction, seeded per request",
+    )
+    parser.add_argument(
+        "--answer-tokens", type=int, default=120, help="words in each manual answer"
+    )
+
+
+def load_catalog():
+    # Piece descriptions, so extraction replies name real catalog pieces
+    from db import db_pool
+
+    with db_pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT descricao FROM pieces;")
+        return [row[0] for row in cur.fetchall()]
+
+
+def main():
+    # Standalone server, for benchmarking a backend started separately (gunicorn,
+    # app_async): point its OPENAI_BASE_URL at the printed URL
+    parser = argparse.ArgumentParser(description="Deterministic fake OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(
+        load_catalog(),
+        chat_latency=args.chat_latency,
+        token_latency=args.token_latency,
+        embedding_latency=args.embedding_latency,
+        jitter=args.jitter,
+        answer_tokens=args.answer_tokens,
+    )
+    print("Fake OpenAI listening on", fake.start(args.host, args.port), flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
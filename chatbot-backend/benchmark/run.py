@@ -0,0 +1,331 @@
+import argparse
+import functools
+import http.client
+import importlib
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from benchmark.fake_openai import FakeOpenAI, add_latency_arguments, load_catalog
+from benchmark.seed import add_seed_arguments, seed, write_manual_pdf
+from benchmark.workload import Workload
+
+# Backend functions timed per call when the app runs in-process (inclusive times:
+# answer_question contains prepare_answer)
+STAGES = (
+    "extract_pieces",
+    "get_pieces_info",
+    "get_common_availability",
+    "get_common_windows",
+    "prepare_answer",
+    "answer_question",
+)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = math.ceil(p / 100 * len(ordered))
+    return ordered[min(len(ordered) - 1, max(rank - 1, 0))]
+
+
+def summarize(seconds):
+    milliseconds = [s * 1000 for s in seconds]
+    return {
+        "count": len(milliseconds),
+        "p50": percentile(milliseconds, 50),
+        "p95": percentile(milliseconds, 95),
+        "p99": percentile(milliseconds, 99),
+        "max": max(milliseconds, default=None),
+        "total_s": sum(seconds),
+    }
+
+
+# Durations per stage, from every request thread
+class StageTimer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+
+    def wrap(self, name, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - started)
+
+        return timed
+
+
+def instrument(module, timer):
+    # The pipeline looks these methods up on itself on every call, so wrapping them
+    # on the instance times the calls the routes make
+    pipeline = module.pipeline
+    for name in STAGES:
+        setattr(pipeline, name, timer.wrap(name, getattr(pipeline, name)))
+    router = pipeline.intent_router
+    router.classify = timer.wrap("intent_router", router.classify)
+
+
+def start_backend(app_name, fake_url, workdir, timer):
+    # Runs the Flask app in this process, with every cache and index in workdir so
+    # each run starts cold, and its request logging sent to workdir/backend.log
+    os.environ.update(
+        {
+            "OPENAI_API_KEY": "benchmark",
+            "OPENAI_BASE_URL": fake_url,
+            "MANUALS_DIR": os.path.join(workdir, "manuals"),
+            "MANUALS_CACHE_DIR": os.path.join(workdir, "corpus_cache"),
+            "MANUALS_WATCH_INTERVAL": "0",
+            "EMBEDDING_CACHE_DIR": os.path.join(workdir, "embedding_cache"),
+            "MANUAL_INDEX_DIR": os.path.join(workdir, "index_cache"),
+            "LLM_CACHE_PATH": os.path.join(workdir, "llm_cache.sqlite3"),
+            "CONVERSATION_SQLITE_PATH": os.path.join(workdir, "conversations.sqlite3"),
+        }
+    )
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    module = importlib.import_module(app_name)
+    instrument(module, timer)
+    server = make_server("127.0.0.1", 0, module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="backend", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def wait_ready(base_url, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(base_url + "/ready", timeout=5) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Backend not ready after {timeout}s")
+        time.sleep(0.5)
+
+
+def run_conversation(base_url, path, conversation_id, prompts):
+    # One virtual user: a keep-alive connection and the turns of one conversation
+    url = urlsplit(base_url)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=300)
+    results = []
+    try:
+        for intent, prompt in prompts:
+            body = json.dumps({"prompt": prompt, "conversation_id": conversation_id})
+            started = time.perf_counter()
+            try:
+                conn.request("POST", path, body, {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                status = None
+            results.append((intent, status, time.perf_counter() - started))
+    finally:
+        conn.close()
+    return results
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        intent, _, weight = part.partition("=")
+        if intent not in ("manual", "parts", "mixed"):
+            raise argparse.ArgumentTypeError(f"Unknown intent in --mix: {intent}")
+        mix[intent] = float(weight)
+    return mix
+
+
+def fetch_stats(fake, fake_url):
+    if fake is not None:
+        return fake.snapshot()
+    if fake_url:
+        stats_url = fake_url.rstrip("/") + "/stats"
+        with urllib.request.urlopen(stats_url, timeout=5) as response:
+            return json.load(response)
+    return {}
+
+
+def openai_delta(before, after):
+    delta = {}
+    for endpoint, totals in after.items():
+        previous = before.get(endpoint, {})
+        delta[endpoint] = {
+            key: value - previous.get(key, 0) for key, value in totals.items()
+        }
+    return delta
+
+
+def format_report(report):
+    lines = [
+        f"Requests: {report['requests']} in {report['elapsed_s']:.1f}s "
+        f"({report['throughput_rps']:.1f} req/s) at concurrency {report['concurrency']}, "
+        f"{report['errors']} errors",
+        "",
+        f"{'latency (ms)':<26}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}",
+    ]
+    for name, stats in report["latency"].items():
+        lines.append(
+            f"{name:<26}{stats['count']:>7}{stats['p50']:>9.1f}{stats['p95']:>9.1f}"
+            f"{stats['p99']:>9.1f}{stats['max']:>9.1f}"
+        )
+    if report["stages"]:
+        lines += [
+            "",
+            f"{'stage (ms)':<26}{'calls':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'total s':>9}",
+        ]
+        for name, stats in report["stages"].items():
+            lines.append(
+                f"{name:<26}{stats['count']:>7}{stats['p50']:>9.2f}{stats['p95']:>9.2f}"
+                f"{stats['p99']:>9.2f}{stats['total_s']:>9.2f}"
+            )
+    if report["openai"]:
+        lines += [
+            "",
+            f"{'fake OpenAI':<26}{'calls':>7}{'total s':>9}{'in tok':>9}{'out tok':>9}",
+        ]
+        for name, stats in report["openai"].items():
+            lines.append(
+                f"{name:<26}{stats['requests']:>7}{stats['seconds']:>9.2f}"
+                f"{stats['prompt_tokens']:>9}{stats['completion_tokens']:>9}"
+            )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load benchmark of /main against a fake OpenAI and a seeded Postgres. "
+        "Run from chatbot-backend with DB_* pointing at a scratch database."
+    )
+    parser.add_argument("--app", default="app", help="Flask module to run in-process")
+    parser.add_argument("--url", help="benchmark an already running backend instead")
+    parser.add_argument(
+        "--fake-url", help="stats of a standalone fake OpenAI (with --url)"
+    )
+    parser.add_argument("--path", default="/main", help="/main or /main/stream")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=3, help="requests per conversation")
+    parser.add_argument(
+        "--warmup", type=int, default=10, help="conversations before timing"
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix("manual=0.3,parts=0.6,mixed=0.1"),
+        help="share of conversations per intent",
+    )
+    parser.add_argument("--seed-db", action="store_true", help="seed the database first")
+    parser.add_argument("--manual-pages", type=int, default=40)
+    parser.add_argument("--workdir", help="caches and logs (default: a new temp dir)")
+    parser.add_argument("--ready-timeout", type=float, default=300)
+    parser.add_argument("--json", help="also write the report as JSON here")
+    add_seed_arguments(parser)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    if args.seed_db:
+        rows = seed(args.pieces, args.days, args.busy, args.seed, not args.no_schema)
+        print(f"Seeded {len(rows)} pieces", file=sys.stderr)
+    pieces = load_catalog()
+
+    timer = StageTimer()
+    fake = None
+    stdout = sys.stdout
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        workdir = args.workdir or tempfile.mkdtemp(prefix="tracbot-bench-")
+        write_manual_pdf(
+            os.path.join(workdir, "manuals", "manual.pdf"), args.manual_pages, args.seed
+        )
+        fake = FakeOpenAI(
+            pieces,
+            chat_latency=args.chat_latency,
+            token_latency=args.token_latency,
+            embedding_latency=args.embedding_latency,
+            jitter=args.jitter,
+            answer_tokens=args.answer_tokens,
+        )
+        fake_url = fake.start()
+        print(f"Backend log: {os.path.join(workdir, 'backend.log')}", file=sys.stderr)
+        sys.stdout = open(os.path.join(workdir, "backend.log"), "w", encoding="utf-8")
+        base_url = start_backend(args.app, fake_url, workdir, timer)
+
+    try:
+        wait_ready(base_url, args.ready_timeout)
+        workload = Workload(pieces, args.mix, args.days, args.manual_pages, args.seed)
+        users = math.ceil(args.requests / args.turns)
+        conversations = [
+            (f"bench-{args.seed}-{user}", workload.conversation(user, args.turns))
+            for user in range(args.warmup + users)
+        ]
+
+        def run(batch):
+            with ThreadPoolExecutor(args.concurrency) as executor:
+                futures = [
+                    executor.submit(run_conversation, base_url, args.path, cid, prompts)
+                    for cid, prompts in batch
+                ]
+                return [result for future in futures for result in future.result()]
+
+        run(conversations[: args.warmup])
+        timer.reset()
+        before = fetch_stats(fake, args.fake_url)
+        started = time.perf_counter()
+        results = run(conversations[args.warmup :])[: args.requests]
+        elapsed = time.perf_counter() - started
+        after = fetch_stats(fake, args.fake_url)
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    latency = {"all": summarize([seconds for _, _, seconds in results])}
+    for intent in ("manual", "parts", "follow-up", "mixed"):
+        seconds = [s for name, _, s in results if name == intent]
+        if seconds:
+            latency[intent] = summarize(seconds)
+    report = {
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "errors": sum(1 for _, status, _ in results if status != 200),
+        "latency": latency,
+        "stages": {
+            name: summarize(samples) for name, samples in sorted(timer.samples.items())
+        },
+        "openai": openai_delta(before, after),
+    }
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
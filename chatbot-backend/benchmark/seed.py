@@ -0,0 +1,212 @@
+import argparse
+import io
+import os
+import random
+from datetime import date, timedelta
+
+from db import db_pool
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "db.sql")
+# Synthetic rows are told apart from the ones in db.sql by this SAP prefix
+SAP_PREFIX = "BEN"
+
+CATEGORIES = {
+    "Ferramentas Manuais": [
+        "Chave Combinada",
+        "Alicate Universal",
+        "Martelo de Bola",
+        "Chave Torx",
+        "Saca Polia",
+    ],
+    "Ferramentas Elétricas": [
+        "Furadeira de Impacto",
+        "Parafusadeira",
+        "Esmerilhadeira Angular",
+        "Soprador Térmico",
+        "Serra Tico-Tico",
+    ],
+    "Instrumentos de Medição": [
+        "Paquímetro Digital",
+        "Micrômetro Externo",
+        "Multímetro",
+        "Alicate Amperímetro",
+        "Termômetro Infravermelho",
+    ],
+    "Equipamentos Hidráulicos": [
+        "Macaco Hidráulico",
+        "Prensa Hidráulica",
+        "Bomba Manual",
+        "Cilindro Hidráulico",
+        "Extrator Hidráulico",
+    ],
+    "Equipamentos de Solda": [
+        "Máquina de Solda MIG",
+        "Máquina de Solda TIG",
+        "Inversora de Solda",
+        "Maçarico",
+        "Tocha de Corte",
+    ],
+}
+VARIANTS = (
+    "Compacto Industrial Profissional Reforçado Portátil Isolado Leve Pesado"
+).split()
+SIZES = '6mm 8mm 10mm 12mm 13mm 17mm 19mm 1/2" 3/4" 220V 380V 5HP'.split()
+
+MANUAL_COMPONENTS = (
+    "motor redutor rolamento acoplamento bomba compressor filtro correia valvula painel"
+).split()
+MANUAL_TASKS = (
+    "lubrificacao inspecao troca limpeza calibracao alinhamento montagem desmontagem"
+).split()
+
+
+def synthetic_pieces(count, rng):
+    # Unique descriptions combining a tool, a variant and a size; past the number of
+    # combinations they repeat as further model series ("Série 2", ...)
+    combinations = [
+        (categoria, f"{tool} {variant} {size}")
+        for categoria, tools in CATEGORIES.items()
+        for tool in tools
+        for variant in VARIANTS
+        for size in SIZES
+    ]
+    rng.shuffle(combinations)
+    rows = []
+    for i in range(count):
+        categoria, descricao = combinations[i % len(combinations)]
+        series = i // len(combinations)
+        if series:
+            descricao = f"{descricao} Série {series + 1}"
+        rows.append((f"{SAP_PREFIX}{i:06d}", categoria, descricao))
+    return rows
+
+
+def _copy(cur, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(str(value) for value in row) + "\n")
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def seed(pieces=2000, days=14, busy=0.3, seed_value=0, schema=True):
+    # Loads db.sql, then replaces the synthetic rows: `pieces` extra tools with an
+    # hourly availability grid for `days` days from today, each hour busy with
+    # probability `busy`
+    rng = random.Random(seed_value)
+    rows = synthetic_pieces(pieces, rng)
+    with db_pool.connection() as conn, conn.cursor() as cur:
+        # Bulk loads outlast the pool's per-statement timeout
+        cur.execute("SET LOCAL statement_timeout = 0;")
+        if schema:
+            with open(SCHEMA_PATH, "r", encoding="utf-8") as file:
+                cur.execute(file.read())
+        cur.execute("DELETE FROM availability WHERE sap LIKE %s;", (SAP_PREFIX + "%",))
+        cur.execute("DELETE FROM pieces WHERE sap LIKE %s;", (SAP_PREFIX + "%",))
+        _copy(cur, "pieces", ("sap", "categoria", "descricao"), rows)
+
+        today = date.today()
+        grid = (
+            (sap, today + timedelta(days=day), hour, "t" if rng.random() < busy else "f")
+            for sap, _, _ in rows
+            for day in range(days)
+            for hour in range(24)
+        )
+        _copy(cur, "availability", ("sap", "data", "hora", "ocupado"), grid)
+        cur.execute("ANALYZE pieces; ANALYZE availability;")
+    return rows
+
+
+def manual_pages(pages, rng):
+    # Text of a synthetic maintenance manual, one section per page, mentioning the
+    # components, tasks and bolt sizes the workload asks about
+    texts = []
+    for page in range(1, pages + 1):
+        component = MANUAL_COMPONENTS[page % len(MANUAL_COMPONENTS)]
+        bolt = 8 + page % 20
+        lines = [f"{page}. {component.upper()} - SECAO {page}"]
+        for task in rng.sample(MANUAL_TASKS, 3):
+            hours = rng.randint(1, 20) * 50
+            code = f"E{page:02d}{rng.randint(0, 9)}"
+            lines += [
+                f"A {task} do {component} deve ser feita a cada {hours} horas.",
+                f"O torque do parafuso M{bolt} do {component} e de {bolt * 5} Nm.",
+                f"Codigo de falha {code} indica problema no {component}.",
+            ]
+        texts.append(lines)
+    return texts
+
+
+def write_manual_pdf(path, pages, seed_value=0):
+    # Minimal uncompressed PDF with one text page per section, readable by PyPDF2
+    texts = manual_pages(pages, random.Random(seed_value))
+    objects = [None, None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in texts:
+        commands = ["BT", "/F1 10 Tf", "12 TL", "50 800 Td"]
+        for line in lines:
+            escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            commands.append(f"({escaped}) Tj T*")
+        commands.append("ET")
+        stream = "\n".join(commands)
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content = len(objects)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[0] = "<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii")
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode("ascii")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n".encode("ascii")
+    output += f"startxref\n{xref}\n%%EOF\n".encode("ascii")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(output)
+
+
+def add_seed_arguments(parser):
+    parser.add_argument(
+        "--pieces", type=int, default=2000, help="synthetic tools to add"
+    )
+    parser.add_argument(
+        "--days", type=int, default=14, help="days of availability from today"
+    )
+    parser.add_argument("--busy", type=float, default=0.3, help="share of busy hours")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--no-schema",
+        action="store_true",
+        help="skip loading db.sql (already loaded, e.g. by docker-compose)",
+    )
+
+
+def main():
+    # Seeds the database named by DB_HOST/DB_PORT/DB_NAME/DB_USER/DB_PASSWORD. Never
+    # point it at production: it deletes and rewrites the synthetic rows
+    parser = argparse.ArgumentParser(description="Seed Postgres for the load benchmark")
+    add_seed_arguments(parser)
+    parser.add_argument("--manual", help="also write a synthetic manual PDF here")
+    parser.add_argument("--manual-pages", type=int, default=40)
+    args = parser.parse_args()
+
+    rows = seed(args.pieces, args.days, args.busy, args.seed, not args.no_schema)
+    hours = len(rows) * args.days * 24
+    print(f"Seeded {len(rows)} pieces with {hours} availability rows")
+    if args.manual:
+        write_manual_pdf(args.manual, args.manual_pages, args.seed)
+        print(f"Wrote a {args.manual_pages}-page manual to {args.manual}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import random
+from datetime import date, timedelta
+
+from benchmark.seed import MANUAL_COMPONENTS, MANUAL_TASKS
+
+WEEKDAYS = ["segunda", "terça", "quarta", "quinta", "sexta"]
+
+# Direct requests the local extractor parses by itself
+SHORT_PARTS = [
+    "Preciso de {pieces} para {date}",
+    "{pieces} para {date}",
+    "Quero reservar {pieces} {date}",
+]
+# Chattier requests with words the local extractor does not know, left to the LLM
+CHATTY_PARTS = [
+    "Bom dia! Para a parada programada da linha {line} vou precisar de {pieces} "
+    "{date}, consegue verificar?",
+    "Oi, a equipe do turno B vai trocar o acoplamento e precisa de {pieces} {date}. "
+    "Tem horário?",
+    "Consegue ver se {pieces} ficam livres {date}? É para a preventiva do setor {line}.",
+]
+MANUAL_QUESTIONS = [
+    "Como faço a {task} do {component}?",
+    "Com que frequência devo fazer a {task} do {component}?",
+    "Qual o torque do parafuso M{bolt} do {component}?",
+    "O que indica o código de falha E{code}?",
+    "Segundo o manual, quais cuidados tomar na {task} do {component}?",
+]
+FOLLOW_UPS = ["e {date}?", "E para {date}?", "E se for {date}?"]
+
+
+# Seeded generator of /main prompts. Each virtual user holds a conversation for a
+# few turns; parts conversations continue with follow-ups like "e amanhã?" that only
+# make sense with the conversation history.
+class Workload:
+    def __init__(self, pieces, mix, days=14, manual_pages=40, seed=0):
+        self.pieces = list(pieces)
+        self.intents = list(mix)
+        self.weights = [mix[intent] for intent in self.intents]
+        self.days = days
+        self.manual_pages = manual_pages
+        self.seed = seed
+
+    def _date(self, rng):
+        choice = rng.randrange(4)
+        if choice == 0:
+            return rng.choice(["hoje", "amanhã", "depois de amanhã"])
+        if choice == 1:
+            return f"na próxima {rng.choice(WEEKDAYS)}"
+        day = date.today() + timedelta(days=rng.randrange(max(self.days, 1)))
+        if choice == 2:
+            return day.isoformat()
+        return f"dia {day.day}"
+
+    def _pieces(self, rng):
+        names = rng.sample(self.pieces, rng.randint(1, 3))
+        if len(names) == 1:
+            return names[0]
+        return ", ".join(names[:-1]) + " e " + names[-1]
+
+    def parts(self, rng):
+        templates = SHORT_PARTS if rng.random() < 0.5 else CHATTY_PARTS
+        return rng.choice(templates).format(
+            pieces=self._pieces(rng), date=self._date(rng), line=rng.randint(1, 9)
+        )
+
+    def manual(self, rng):
+        page = rng.randint(1, self.manual_pages)
+        return rng.choice(MANUAL_QUESTIONS).format(
+            task=rng.choice(MANUAL_TASKS),
+            component=rng.choice(MANUAL_COMPONENTS),
+            bolt=8 + page % 20,
+            code=f"{page:02d}{rng.randint(0, 9)}",
+        )
+
+    def mixed(self, rng):
+        question = self.manual(rng)
+        request = self.parts(rng)
+        return f"{question} E {request[0].lower()}{request[1:]}"
+
+    def conversation(self, user, turns):
+        # The prompts of one conversation: (intent, prompt) pairs
+        rng = random.Random(f"{self.seed}:{user}")
+        intent = rng.choices(self.intents, self.weights)[0]
+        prompts = []
+        for turn in range(turns):
+            if turn and intent == "parts" and rng.random() < 0.5:
+                follow_up = rng.choice(FOLLOW_UPS).format(date=self._date(rng))
+                prompts.append(("follow-up", follow_up))
+            else:
+                prompts.append((intent, getattr(self, intent)(rng)))
+        return prompts
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from schema import ensure_schema, ensure_schema_async
+
+# How often to compare the catalog version when LISTEN/NOTIFY is not connected
+CATALOG_VERSION_CHECK_INTERVAL = float(os.getenv("CATALOG_VERSION_CHECK_INTERVAL", 30))
+
+VERSION_SQL = "SELECT version FROM catalog_versions WHERE name = 'pieces';"
+CATALOG_SQL = "SELECT sap, categoria, descricao FROM pieces;"
+
+
+def fold(text):
+    # Same normalization as unaccent(UPPER(...)) followed by pg_trgm's lowercasing
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def trigrams(text):
+    # pg_trgm: split into alphanumeric words, pad each with two leading spaces and
+    # one trailing space, and take the set of all 3-character substrings
+    grams = set()
+    for word in re.findall(r"[^\W_]+", fold(text)):
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    a, b = trigrams(a), trigrams(b)
+    common = len(a & b)
+    union = len(a) + len(b) - common
+    return common / union if union else 0.0
+
+
+# In-memory trigram index over the pieces catalog, scoring like pg_trgm similarity()
+class CatalogIndex:
+    def __init__(self, rows):
+        self.pieces = []
+        self.sizes = []
+        self.postings = {}
+        # Longest description in words, which bounds the spans worth matching
+        self.max_words = 0
+        for sap, categoria, descricao in rows:
+            grams = trigrams(descricao)
+            idx = len(self.pieces)
+            self.pieces.append({"sap": sap, "categoria": categoria, "descricao": descricao})
+            self.sizes.append(len(grams))
+            self.max_words = max(self.max_words, len(re.findall(r"[^\W_]+", descricao)))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(idx)
+
+    def __len__(self):
+        return len(self.pieces)
+
+    def search(self, text, limit=3):
+        grams = trigrams(text)
+        counts = {}
+        for gram in grams:
+            for idx in self.postings.get(gram, ()):
+                counts[idx] = counts.get(idx, 0) + 1
+
+        scored = []
+        for idx, common in counts.items():
+            score = common / (len(grams) + self.sizes[idx] - common)
+            scored.append((-score, self.pieces[idx]["sap"], idx))
+        scored.sort()
+        return [(self.pieces[idx], -score) for score, _, idx in scored[:limit]]
+
+    def resolve(self, descriptions, threshold, candidates=3):
+        # Same result shape as piece_resolver.resolve_pieces
+        results = []
+        for desc in descriptions:
+            result = {"input": desc, "match": None, "score": 0.0, "candidates": []}
+            for piece, score in self.search(desc, candidates):
+                result["candidates"].append(dict(piece, score=score))
+                if result["match"] is None and score >= threshold:
+                    result["match"] = piece
+                    result["score"] = score
+            results.append(result)
+        return results
+
+
+# Keeps a CatalogIndex in sync with the pieces table: it is marked stale by the
+# pieces_changed notification and, while the listener is down, by comparing the
+# catalog_versions counter every CATALOG_VERSION_CHECK_INTERVAL seconds
+class PieceCatalog:
+    def __init__(self, get_connection, listener=None):
+        self.get_connection = get_connection
+        self.listener = listener
+        self.index = None
+        self.version = None
+        self.stale = True
+        self.last_check = 0.0
+        self.lock = threading.Lock()
+        self.async_lock = asyncio.Lock()
+        if listener is not None:
+            listener.subscribe("pieces_changed", self.on_change, self.mark_stale)
+
+    def mark_stale(self):
+        self.stale = True
+
+    def on_change(self, payload):
+        self.mark_stale()
+
+    def _current_version(self, cur):
+        cur.execute(VERSION_SQL)
+        row = cur.fetchone()
+        return row[0] if row else None
+
+    def _install(self, rows, version):
+        index = CatalogIndex(rows)
+        self.index, self.version = index, version
+        self.last_check = time.monotonic()
+        print(f"Piece catalog loaded: {len(index)} pieces (version {version})")
+
+    def refresh(self):
+        with self.lock:
+            # Another request may have reloaded it while this one waited
+            if not self.stale and self.index is not None:
+                return
+            # Cleared before reading, so a change notified meanwhile reloads again
+            self.stale = False
+            self.last_check = time.monotonic()
+            try:
+                ensure_schema(self.get_connection)
+                with self.get_connection() as conn, conn.cursor() as cur:
+                    version = self._current_version(cur)
+                    cur.execute(CATALOG_SQL)
+                    self._install(cur.fetchall(), version)
+            except Exception:
+                self.stale = True
+                raise
+
+    def _check_version(self):
+        self.last_check = time.monotonic()
+        ensure_schema(self.get_connection)
+        with self.get_connection() as conn, conn.cursor() as cur:
+            if self._current_version(cur) != self.version:
+                self.stale = True
+
+    def _needs_version_check(self):
+        listening = self.listener is not None and self.listener.connected
+        return (
+            not self.stale
+            and self.index is not None
+            and not listening
+            and time.monotonic() - self.last_check > CATALOG_VERSION_CHECK_INTERVAL
+        )
+
+    def _keep_loaded(self, error):
+        # A failed check or reload keeps serving the loaded catalog, if there is one
+        if self.index is None:
+            raise error
+        print("Could not refresh the piece catalog, serving the loaded one:", error)
+        return self.index
+
+    def get_index(self):
+        try:
+            if self._needs_version_check():
+                self._check_version()
+            if self.stale or self.index is None:
+                self.refresh()
+        except Exception as e:
+            return self._keep_loaded(e)
+        return self.index
+
+    async def _refresh_async(self, pg_pool):
+        async with self.async_lock:
+            if not self.stale and self.index is not None:
+                return
+            self.stale = False
+            self.last_check = time.monotonic()
+            try:
+                await ensure_schema_async(pg_pool)
+                async with pg_pool.acquire() as conn:
+                    version = await conn.fetchval(VERSION_SQL)
+                    rows = await conn.fetch(CATALOG_SQL)
+            except Exception:
+                self.stale = True
+                raise
+            # Indexing a large catalog would stall every other request on the loop
+            await asyncio.to_thread(
+                self._install, [tuple(row) for row in rows], version
+            )
+
+    async def get_index_async(self, pg_pool):
+        # Same as get_index, over an asyncpg pool
+        try:
+            if self._needs_version_check():
+                self.last_check = time.monotonic()
+                await ensure_schema_async(pg_pool)
+                if await pg_pool.fetchval(VERSION_SQL) != self.version:
+                    self.stale = True
+            if self.stale or self.index is None:
+                await self._refresh_async(pg_pool)
+        except Exception as e:
+            return self._keep_loaded(e)
+        return self.index
@@ -0,0 +1,105 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+from files import atomic_write
+from vector_index import MANUAL_INDEX_DIR
+
+CHUNK_FIELDS = [
+    ("text_start", "int64"),
+    ("text_end", "int64"),
+    ("page", "int32"),
+    ("page_end", "int32"),
+    ("start", "int64"),
+    ("end", "int64"),
+    ("doc", "int32"),
+    ("section", "int32"),
+]
+
+
+# Passages stored as columns instead of one dict per passage: a UTF-8 blob with all
+# the texts, a structured array of offsets/pages and small tables of document and
+# section names. Loaded from disk the arrays are memory-mapped, so every worker on
+# the node shares the same pages. Indexing returns the usual passage dict.
+class ChunkStore:
+    def __init__(self, rows, text, docs, sections):
+        self.rows = rows
+        self.text = text
+        self.docs = docs
+        self.sections = sections
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        row = self.rows[i]
+        return {
+            "text": bytes(self.text[row["text_start"] : row["text_end"]]).decode("utf-8"),
+            "page": int(row["page"]),
+            "page_end": int(row["page_end"]),
+            "section": self.sections[row["section"]] if row["section"] >= 0 else None,
+            "start": int(row["start"]),
+            "end": int(row["end"]),
+            "doc": self.docs[row["doc"]] if row["doc"] >= 0 else None,
+        }
+
+    @classmethod
+    def from_passages(cls, passages):
+        docs, sections = {}, {}
+        rows = np.zeros(len(passages), dtype=CHUNK_FIELDS)
+        blob = bytearray()
+        for i, passage in enumerate(passages):
+            encoded = passage["text"].encode("utf-8")
+            doc, section = passage.get("doc"), passage.get("section")
+            rows[i] = (
+                len(blob),
+                len(blob) + len(encoded),
+                passage["page"],
+                passage["page_end"],
+                passage["start"],
+                passage["end"],
+                docs.setdefault(doc, len(docs)) if doc is not None else -1,
+                sections.setdefault(section, len(sections)) if section is not None else -1,
+            )
+            blob += encoded
+        return cls(rows, np.frombuffer(bytes(blob), dtype="uint8"), list(docs), list(sections))
+
+    def save(self, prefix):
+        os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+        atomic_write(prefix + ".bin", lambda file: file.write(self.text.tobytes()))
+        atomic_write(prefix + ".npy", lambda file: np.save(file, self.rows))
+        # Written last: a prefix without its .json is an incomplete save
+        names = json.dumps({"docs": self.docs, "sections": self.sections}).encode("utf-8")
+        atomic_write(prefix + ".json", lambda file: file.write(names))
+
+    @classmethod
+    def load(cls, prefix):
+        with open(prefix + ".json", "r", encoding="utf-8") as file:
+            names = json.load(file)
+        rows = np.load(prefix + ".npy", mmap_mode="r")
+        if os.path.getsize(prefix + ".bin"):
+            text = np.memmap(prefix + ".bin", dtype="uint8", mode="r")
+        else:
+            text = np.empty(0, dtype="uint8")
+        return cls(rows, text, names["docs"], names["sections"])
+
+
+def chunks_path(version):
+    return os.path.join(MANUAL_INDEX_DIR, f"manual-chunks-{version[:16]}")
+
+
+def load_or_build_chunks(version, passages):
+    # Persist the passages of this corpus version once and memory-map them
+    prefix = chunks_path(version)
+    try:
+        if not os.path.exists(prefix + ".json"):
+            ChunkStore.from_passages(passages).save(prefix)
+            for stale in glob.glob(os.path.join(MANUAL_INDEX_DIR, "manual-chunks-*")):
+                if not stale.startswith(prefix + "."):
+                    os.remove(stale)
+        return ChunkStore.load(prefix)
+    except OSError as e:
+        print("Could not persist passages, keeping them in memory:", e)
+        return ChunkStore.from_passages(passages)
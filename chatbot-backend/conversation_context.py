@@ -0,0 +1,100 @@
+import json
+import os
+
+from tokens import estimate_tokens
+
+# Token budget for the conversation turns sent along with each extraction prompt
+CONVERSATION_CONTEXT_TOKENS = int(os.getenv("CONVERSATION_CONTEXT_TOKENS", 1000))
+# At most this many of the latest exchanges are sent verbatim
+CONVERSATION_RECENT_TURNS = int(os.getenv("CONVERSATION_RECENT_TURNS", 4))
+
+# Approximate per-message overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+# History of one conversation as seen by extract_pieces. The latest exchanges are
+# kept verbatim within a token budget; older ones are collapsed into the pieces and
+# date they established, so every turn costs about the same however long the
+# conversation gets.
+class ConversationContext:
+    def __init__(
+        self,
+        budget_tokens=CONVERSATION_CONTEXT_TOKENS,
+        max_turns=CONVERSATION_RECENT_TURNS,
+    ):
+        self.budget_tokens = budget_tokens
+        self.max_turns = max_turns
+        self.turns = []
+        self.pieces = []
+        self.date = None
+        self.collapsed = 0
+
+    def remember(self, pieces, date):
+        # State established by an extraction; empty values keep the previous state
+        if pieces:
+            self.pieces = list(pieces)
+        if date:
+            self.date = date
+
+    def record(self, prompt, reply):
+        messages = [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": reply},
+        ]
+        tokens = sum(
+            estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages
+        )
+        self.turns.append({"messages": messages, "tokens": tokens})
+        self._compact()
+
+    def drop_oldest(self):
+        # Collapses the oldest verbatim exchange into the state
+        if self.turns:
+            del self.turns[0]
+            self.collapsed += 1
+
+    def _compact(self):
+        kept = 0
+        used = 0
+        for turn in reversed(self.turns):
+            if kept == self.max_turns or used + turn["tokens"] > self.budget_tokens:
+                break
+            kept += 1
+            used += turn["tokens"]
+        dropped = len(self.turns) - kept
+        if dropped:
+            self.collapsed += dropped
+            del self.turns[:dropped]
+
+    def state_message(self):
+        if not self.collapsed or not (self.pieces or self.date):
+            return None
+        state = json.dumps({"pieces": self.pieces, "date": self.date}, ensure_ascii=False)
+        return {
+            "role": "system",
+            "content": f"Estado da conversa até aqui (turnos anteriores resumidos): {state}",
+        }
+
+    def messages(self):
+        state = self.state_message()
+        messages = [state] if state else []
+        for turn in self.turns:
+            messages.extend(turn["messages"])
+        return messages
+
+    def to_dict(self):
+        return {
+            "turns": self.turns,
+            "pieces": self.pieces,
+            "date": self.date,
+            "collapsed": self.collapsed,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        conversation = cls()
+        conversation.turns = data.get("turns", [])
+        conversation.pieces = data.get("pieces", [])
+        conversation.date = data.get("date")
+        conversation.collapsed = data.get("collapsed", 0)
+        return conversation
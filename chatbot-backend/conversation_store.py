@@ -0,0 +1,231 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from conversation_context import ConversationContext
+from schema import ensure_schema, ensure_schema_async
+
+# memory: per-process LRU, postgres/sqlite: shared by every worker
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "memory")
+CONVERSATION_SQLITE_PATH = os.getenv("CONVERSATION_SQLITE_PATH", "conversations.sqlite3")
+# Conversations idle for longer than this are forgotten
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", 24 * 3600))
+# In-process store caps: number of conversations and their total serialized size
+CONVERSATION_STORE_SIZE = int(os.getenv("CONVERSATION_STORE_SIZE", 10000))
+CONVERSATION_STORE_MAX_BYTES = int(os.getenv("CONVERSATION_STORE_MAX_BYTES", 64 * 1024 * 1024))
+# Largest serialized conversation; older turns are collapsed until it fits
+CONVERSATION_MAX_BYTES = int(os.getenv("CONVERSATION_MAX_BYTES", 32 * 1024))
+# How often the shared stores delete expired conversations
+CONVERSATION_CLEANUP_INTERVAL = float(os.getenv("CONVERSATION_CLEANUP_INTERVAL", 600))
+
+
+def serialize(conversation, max_bytes=CONVERSATION_MAX_BYTES):
+    payload = json.dumps(conversation.to_dict(), ensure_ascii=False)
+    while len(payload.encode("utf-8")) > max_bytes and conversation.turns:
+        conversation.drop_oldest()
+        payload = json.dumps(conversation.to_dict(), ensure_ascii=False)
+    return payload
+
+
+# Where consulta, consulta_manual and extract_pieces keep conversations between
+# requests: get() returns the conversation (a new one if unknown or expired) and
+# save() stores it back after the request changed it.
+class ConversationStore(ABC):
+    @abstractmethod
+    def get(self, conversation_id):
+        ...
+
+    @abstractmethod
+    def save(self, conversation_id, conversation):
+        ...
+
+    async def get_async(self, conversation_id, pg_pool=None):
+        return await asyncio.to_thread(self.get, conversation_id)
+
+    async def save_async(self, conversation_id, conversation, pg_pool=None):
+        await asyncio.to_thread(self.save, conversation_id, conversation)
+
+    def _cleanup_due(self):
+        # Shared stores delete expired conversations every CONVERSATION_CLEANUP_INTERVAL
+        if time.monotonic() - self.last_cleanup < CONVERSATION_CLEANUP_INTERVAL:
+            return False
+        self.last_cleanup = time.monotonic()
+        return True
+
+
+# Per-process store. The least recently used conversations are evicted past
+# max_conversations or max_bytes of serialized state, and idle ones after the TTL.
+class MemoryConversationStore(ConversationStore):
+    def __init__(
+        self,
+        max_conversations=CONVERSATION_STORE_SIZE,
+        max_bytes=CONVERSATION_STORE_MAX_BYTES,
+        ttl=CONVERSATION_TTL,
+    ):
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remove(self, conversation_id):
+        _, size, _ = self.entries.pop(conversation_id)
+        self.total_bytes -= size
+
+    def get(self, conversation_id):
+        with self.lock:
+            entry = self.entries.get(conversation_id)
+            if entry is None:
+                return ConversationContext()
+            if time.monotonic() - entry[2] > self.ttl:
+                self._remove(conversation_id)
+                return ConversationContext()
+            self.entries.move_to_end(conversation_id)
+            return entry[0]
+
+    def save(self, conversation_id, conversation):
+        size = len(serialize(conversation))
+        with self.lock:
+            if conversation_id in self.entries:
+                self._remove(conversation_id)
+            self.entries[conversation_id] = (conversation, size, time.monotonic())
+            self.total_bytes += size
+            while self.entries and (
+                len(self.entries) > self.max_conversations
+                or self.total_bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self.entries)))
+
+    async def get_async(self, conversation_id, pg_pool=None):
+        return self.get(conversation_id)
+
+    async def save_async(self, conversation_id, conversation, pg_pool=None):
+        self.save(conversation_id, conversation)
+
+
+GET_SQL = "SELECT state FROM conversations WHERE id = %s AND updated_at > %s;"
+SAVE_SQL = """
+INSERT INTO conversations (id, state, updated_at) VALUES (%s, %s, %s)
+ON CONFLICT (id) DO UPDATE SET state = EXCLUDED.state, updated_at = EXCLUDED.updated_at;
+"""
+CLEANUP_SQL = "DELETE FROM conversations WHERE updated_at <= %s;"
+
+# Same statements with asyncpg placeholders
+GET_ASYNC_SQL = "SELECT state FROM conversations WHERE id = $1 AND updated_at > $2;"
+SAVE_ASYNC_SQL = """
+INSERT INTO conversations (id, state, updated_at) VALUES ($1, $2, $3)
+ON CONFLICT (id) DO UPDATE SET state = EXCLUDED.state, updated_at = EXCLUDED.updated_at;
+"""
+CLEANUP_ASYNC_SQL = "DELETE FROM conversations WHERE updated_at <= $1;"
+
+
+def _load(state):
+    return ConversationContext.from_dict(json.loads(state)) if state else ConversationContext()
+
+
+# Shared store backed by the conversations table (see db.sql, created on first use
+# in older databases), so every worker and host sees the same conversations
+class PostgresConversationStore(ConversationStore):
+    def __init__(self, get_connection, ttl=CONVERSATION_TTL):
+        self.get_connection = get_connection
+        self.ttl = ttl
+        self.last_cleanup = 0.0
+
+    def get(self, conversation_id):
+        ensure_schema(self.get_connection)
+        with self.get_connection() as conn, conn.cursor() as cur:
+            cur.execute(GET_SQL, (conversation_id, time.time() - self.ttl))
+            row = cur.fetchone()
+        return _load(row[0] if row else None)
+
+    def save(self, conversation_id, conversation):
+        payload = serialize(conversation)
+        now = time.time()
+        ensure_schema(self.get_connection)
+        with self.get_connection() as conn, conn.cursor() as cur:
+            cur.execute(SAVE_SQL, (conversation_id, payload, now))
+            if self._cleanup_due():
+                cur.execute(CLEANUP_SQL, (now - self.ttl,))
+
+    async def get_async(self, conversation_id, pg_pool=None):
+        await ensure_schema_async(pg_pool)
+        state = await pg_pool.fetchval(
+            GET_ASYNC_SQL, conversation_id, time.time() - self.ttl
+        )
+        return _load(state)
+
+    async def save_async(self, conversation_id, conversation, pg_pool=None):
+        payload = serialize(conversation)
+        now = time.time()
+        await ensure_schema_async(pg_pool)
+        async with pg_pool.acquire() as conn:
+            await conn.execute(SAVE_ASYNC_SQL, conversation_id, payload, now)
+            if self._cleanup_due():
+                await conn.execute(CLEANUP_ASYNC_SQL, now - self.ttl)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+  id TEXT PRIMARY KEY,
+  state TEXT NOT NULL,
+  updated_at REAL NOT NULL
+);
+"""
+SQLITE_GET_SQL = GET_SQL.replace("%s", "?")
+SQLITE_SAVE_SQL = SAVE_SQL.replace("%s", "?")
+SQLITE_CLEANUP_SQL = CLEANUP_SQL.replace("%s", "?")
+
+
+# Shared store in a SQLite file, for several workers on one host without Postgres
+class SqliteConversationStore(ConversationStore):
+    def __init__(self, path=CONVERSATION_SQLITE_PATH, ttl=CONVERSATION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.last_cleanup = 0.0
+        self.local = threading.local()
+
+    def _connection(self):
+        # One connection per thread; WAL lets readers and a writer work concurrently
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(SQLITE_SCHEMA)
+            self.local.conn = conn
+        return conn
+
+    def get(self, conversation_id):
+        row = (
+            self._connection()
+            .execute(SQLITE_GET_SQL, (conversation_id, time.time() - self.ttl))
+            .fetchone()
+        )
+        return _load(row[0] if row else None)
+
+    def save(self, conversation_id, conversation):
+        payload = serialize(conversation)
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(SQLITE_SAVE_SQL, (conversation_id, payload, now))
+            if self._cleanup_due():
+                conn.execute(SQLITE_CLEANUP_SQL, (now - self.ttl,))
+
+
+def create_conversation_store(get_connection=None, kind=CONVERSATION_STORE):
+    if kind == "memory":
+        return MemoryConversationStore()
+    if kind == "postgres":
+        return PostgresConversationStore(get_connection)
+    if kind == "sqlite":
+        return SqliteConversationStore()
+    raise ValueError(f"Unknown CONVERSATION_STORE: {kind}")
@@ -0,0 +1,226 @@
+import asyncio
+import os
+import select
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+# Seconds a request waits for a free connection before giving up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# Idle connections older than this are checked with SELECT 1 before reuse
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", 30))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 5000))
+
+
+def connect_kwargs():
+    return {
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+        "dbname": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+    }
+
+
+# Thread-safe PostgreSQL connection pool. Callers block (up to DB_POOL_TIMEOUT)
+# instead of failing when every connection is busy, stale connections are checked
+# before reuse, and connections that broke during a request are discarded.
+class ConnectionPool:
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+
+    def _get_pool(self):
+        # Created lazily so the app can start while the database is still coming up
+        with self._lock:
+            if self._pool is None:
+                self._pool = pool.ThreadedConnectionPool(
+                    self.minconn, self.maxconn, **connect_kwargs()
+                )
+            return self._pool
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0) < DB_HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise pool.PoolError("Timed out waiting for a database connection")
+        try:
+            connection_pool = self._get_pool()
+            conn = connection_pool.getconn()
+            if not self._healthy(conn):
+                self._last_used.pop(id(conn), None)
+                connection_pool.putconn(conn, close=True)
+                conn = connection_pool.getconn()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        try:
+            if close or conn.closed:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            self._get_pool().putconn(conn, close=close or bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        # Commits on success, rolls back on error, and always returns the connection
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def closeall(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+
+
+async def create_async_pool(minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX):
+    # asyncpg pool for the async serving mode, with the same settings as db_pool
+    import asyncpg
+
+    return await asyncpg.create_pool(
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT") or 5432),
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        min_size=minconn,
+        max_size=maxconn,
+        timeout=DB_POOL_TIMEOUT,
+        server_settings={"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)},
+    )
+
+
+# The asyncpg pool behind the same calls the async loaders make (acquire, fetch,
+# fetchval, execute), created on first use like db_pool. Requests made while the
+# database is down fail and the next one tries again.
+class AsyncConnectionPool:
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = None
+        self._lock = asyncio.Lock()
+
+    async def _get_pool(self):
+        async with self._lock:
+            if self._pool is None:
+                self._pool = await create_async_pool(self.minconn, self.maxconn)
+            return self._pool
+
+    @asynccontextmanager
+    async def acquire(self):
+        connection_pool = await self._get_pool()
+        async with connection_pool.acquire() as conn:
+            yield conn
+
+    async def fetch(self, query, *args):
+        return await (await self._get_pool()).fetch(query, *args)
+
+    async def fetchval(self, query, *args):
+        return await (await self._get_pool()).fetchval(query, *args)
+
+    async def execute(self, query, *args):
+        return await (await self._get_pool()).execute(query, *args)
+
+    async def close(self):
+        async with self._lock:
+            if self._pool is not None:
+                await self._pool.close()
+                self._pool = None
+
+
+# Background LISTEN loop on a dedicated connection (outside the pool). Callbacks run
+# on the listener thread; on_reconnect callbacks run after every (re)connect, since
+# notifications sent while disconnected are lost.
+class NotificationListener:
+    def __init__(self, retry_interval=5):
+        self.retry_interval = retry_interval
+        self.callbacks = {}
+        self.reconnect_callbacks = []
+        self.connected = False
+        self.thread = None
+
+    def subscribe(self, channel, callback, on_reconnect=None):
+        self.callbacks.setdefault(channel, []).append(callback)
+        if on_reconnect:
+            self.reconnect_callbacks.append(on_reconnect)
+
+    def start(self):
+        # Also called in forked workers, where the parent's thread no longer runs
+        if self.thread is None or not self.thread.is_alive():
+            self.connected = False
+            self.thread = threading.Thread(
+                target=self._run, name="db-notifications", daemon=True
+            )
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**connect_kwargs())
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    for channel in self.callbacks:
+                        cur.execute(f'LISTEN "{channel}"')
+                self.connected = True
+                for callback in self.reconnect_callbacks:
+                    callback()
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        for callback in self.callbacks.get(notify.channel, []):
+                            callback(notify.payload)
+            except Exception as e:
+                print("Database notification listener error:", e)
+            finally:
+                self.connected = False
+                if conn is not None:
+                    conn.close()
+            time.sleep(self.retry_interval)
+
+
+db_pool = ConnectionPool()
+notifications = NotificationListener()
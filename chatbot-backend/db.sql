@@ -18,6 +18,48 @@ CREATE TABLE IF NOT EXISTS availability (
   PRIMARY KEY (sap, data, hora)
 );
 
+-- Conversation state shared by every backend worker (CONVERSATION_STORE=postgres);
+-- updated_at is a Unix timestamp used for the TTL
+CREATE TABLE IF NOT EXISTS conversations (
+  id VARCHAR PRIMARY KEY,
+  state TEXT NOT NULL,
+  updated_at DOUBLE PRECISION NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at);
+
+-- Version counters bumped on every change to a table, with a notification on the
+-- "<table>_changed" channel so backends can refresh their in-memory copies
+CREATE TABLE IF NOT EXISTS catalog_versions (
+  name VARCHAR PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalog_versions (name, version) VALUES ('pieces', 0), ('availability', 0)
+ON CONFLICT (name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION notify_table_change() RETURNS trigger AS $$
+DECLARE
+  new_version BIGINT;
+BEGIN
+  UPDATE catalog_versions SET version = version + 1
+  WHERE name = TG_TABLE_NAME
+  RETURNING version INTO new_version;
+  PERFORM pg_notify(TG_TABLE_NAME || '_changed', COALESCE(new_version, 0)::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS pieces_changed ON pieces;
+CREATE TRIGGER pieces_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON pieces
+FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change();
+
+DROP TRIGGER IF EXISTS availability_changed ON availability;
+CREATE TRIGGER availability_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON availability
+FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change();
+
 -- Insert all items into the pieces table
 INSERT INTO pieces (sap, categoria, descricao) VALUES
 ('MAT001', 'Ferramentas de Corte', 'Serra Circular'),
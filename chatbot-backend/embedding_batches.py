@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from tokens import estimate_tokens
+
+# Request limits for the embeddings endpoint, overridable per deployment
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", 50000))
+EMBEDDING_BATCH_INPUTS = int(os.getenv("EMBEDDING_BATCH_INPUTS", 256))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", 4))
+
+
+def make_batches(texts, max_tokens=EMBEDDING_BATCH_TOKENS, max_inputs=EMBEDDING_BATCH_INPUTS):
+    # Pack consecutive texts into (start, end) ranges that stay under both limits.
+    # A single text larger than max_tokens still gets a batch of its own.
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if i > start and (batch_tokens + tokens > max_tokens or i - start >= max_inputs):
+            batches.append((start, i))
+            start = i
+            batch_tokens = 0
+        batch_tokens += tokens
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+def embed_texts(client, texts, model, max_workers=EMBEDDING_WORKERS, on_progress=None):
+    # Embed texts in token-bounded batches on a bounded thread pool, writing each
+    # batch straight into a preallocated float32 matrix aligned with texts.
+    # on_progress(done, total) is called after every batch.
+    vectors = None
+    done = 0
+    if not texts:
+        return vectors
+
+    def embed_batch(batch):
+        start, end = batch
+        response = client.embeddings.create(input=texts[start:end], model=model)
+        data = sorted(response.data, key=lambda item: item.index)
+        return start, [item.embedding for item in data]
+
+    batches = make_batches(texts)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(embed_batch, batch) for batch in batches]
+        try:
+            for future in as_completed(futures):
+                start, embeddings = future.result()
+                if vectors is None:
+                    vectors = np.empty((len(texts), len(embeddings[0])), dtype="float32")
+                vectors[start : start + len(embeddings)] = embeddings
+                done += len(embeddings)
+                if on_progress:
+                    on_progress(done, len(texts))
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    print(f"Embedded {len(texts)} chunks in {len(batches)} batches")
+    return vectors
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+
+# On-disk embedding cache keyed by a hash of the embedding model and the chunk text.
+# Vectors live in an append-only float32 file that is memory-mapped on load, and a
+# JSON sidecar records which row belongs to which key (plus page and text offsets).
+class EmbeddingCache:
+    def __init__(self, cache_dir, model):
+        self.cache_dir = cache_dir
+        self.model = model
+        slug = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        self.vectors_path = os.path.join(cache_dir, f"{slug}.f32")
+        self.metadata_path = os.path.join(cache_dir, f"{slug}.json")
+        self.lock = threading.Lock()
+        self.entries = []
+        self.rows = {}
+        self.dimension = None
+        self.vectors = None
+        self._load()
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model}\n{text}".encode("utf-8")).hexdigest()
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _load(self):
+        if not os.path.exists(self.metadata_path):
+            return
+        try:
+            with open(self.metadata_path, "r", encoding="utf-8") as file:
+                metadata = json.load(file)
+            if metadata.get("model") != self.model:
+                return
+            entries = metadata["entries"]
+            dimension = metadata["dimension"]
+            vectors = None
+            if entries:
+                vectors = np.memmap(
+                    self.vectors_path,
+                    dtype="float32",
+                    mode="r",
+                    shape=(len(entries), dimension),
+                )
+        except (OSError, ValueError, KeyError) as e:
+            print("Ignoring unreadable embedding cache:", e)
+            return
+
+        self.entries = entries
+        self.rows = {entry["key"]: row for row, entry in enumerate(entries)}
+        self.dimension = dimension
+        self.vectors = vectors
+
+    def get(self, keys):
+        rows = [self.rows[key] for key in keys]
+        return np.asarray(self.vectors[rows], dtype="float32")
+
+    def add(self, keys, chunks, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self.lock:
+            new_entries = []
+            new_rows = []
+            seen = set(self.rows)
+            for i, (key, chunk) in enumerate(zip(keys, chunks)):
+                if key in seen:
+                    continue
+                seen.add(key)
+                new_entries.append(
+                    {
+                        "key": key,
+                        "page": chunk.get("page"),
+                        "start": chunk.get("start", 0),
+                        "end": chunk.get("end", len(chunk["text"])),
+                    }
+                )
+                new_rows.append(i)
+            if not new_entries:
+                return
+
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+            elif vectors.shape[1] != self.dimension:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match cache dimension {self.dimension}"
+                )
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Drop any rows appended by a write that never reached the sidecar
+            expected_size = len(self.entries) * self.dimension * 4
+            if os.path.exists(self.vectors_path):
+                os.truncate(self.vectors_path, expected_size)
+            with open(self.vectors_path, "ab") as file:
+                file.write(vectors[new_rows].tobytes())
+
+            entries = self.entries + new_entries
+            tmp_path = self.metadata_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(
+                    {"model": self.model, "dimension": self.dimension, "entries": entries},
+                    file,
+                )
+            os.replace(tmp_path, self.metadata_path)
+
+            self.entries = entries
+            self.rows = {entry["key"]: row for row, entry in enumerate(entries)}
+            self.vectors = np.memmap(
+                self.vectors_path,
+                dtype="float32",
+                mode="r",
+                shape=(len(entries), self.dimension),
+            )
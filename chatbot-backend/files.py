@@ -0,0 +1,9 @@
+import os
+
+
+def atomic_write(path, write):
+    # Readers see the old file or the new one, never a partial write
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        write(file)
+    os.replace(tmp_path, path)
@@ -0,0 +1,51 @@
+# Production serving: gunicorn -c gunicorn.conf.py
+# The app is imported once in the master, which also builds the manual index and
+# publishes it on disk; forked workers memory-map the published index and passages,
+# so memory per node does not grow with the number of workers.
+import gc
+import importlib
+import multiprocessing
+import os
+
+wsgi_app = os.getenv("WSGI_APP", "app:app")
+bind = f"0.0.0.0:{os.getenv('PORT', 5001)}"
+workers = int(os.getenv("WEB_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# Threads per worker; requests mostly wait on OpenAI and Postgres
+threads = int(os.getenv("WEB_THREADS", 8))
+worker_class = "gthread"
+preload_app = True
+# Streamed answers can take a while
+timeout = int(os.getenv("WEB_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Workers write their metrics here, so a scrape of /metrics adds up the whole host
+os.environ.setdefault("METRICS_DIR", "metrics")
+
+
+def on_starting(server):
+    # Numbers from a previous run would add up with this one's
+    from metrics import clear_metrics_dir
+
+    clear_metrics_dir(os.environ["METRICS_DIR"])
+
+    # Each worker would keep its own conversations, and a follow-up served by
+    # another worker would lose the pieces and date of the earlier turns
+    from conversation_store import CONVERSATION_STORE
+
+    if CONVERSATION_STORE == "memory" and server.cfg.workers > 1:
+        server.log.warning(
+            "CONVERSATION_STORE=memory with %s workers: conversations are not "
+            "shared between workers; use postgres or sqlite",
+            server.cfg.workers,
+        )
+
+
+def pre_fork(server, worker):
+    # Keep the objects imported by the master out of the garbage collector, so
+    # collections in the workers do not write to (and copy) the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    importlib.import_module(wsgi_app.split(":")[0]).start_worker()
@@ -0,0 +1,203 @@
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import date
+
+import numpy as np
+
+from local_extractor import find_dates, tokenize
+
+# Below this confidence a prompt takes the likelier of the manual and the parts
+# routes, usually the manual: "mixed" would pay for an extraction, an embedding and
+# an answer for prompts that rarely need both
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", 0.5))
+# Optional JSON file {"manual": [...], "parts": [...], "mixed": [...]} of extra examples
+INTENT_EXAMPLES_PATH = os.getenv("INTENT_EXAMPLES_PATH")
+
+INTENTS = ("manual", "parts", "mixed")
+
+# Size of the hashed feature space the prompts are embedded in
+FEATURE_DIMENSION = 4096
+# Weight of the keyword cues relative to the similarity to the examples
+CUE_WEIGHT = 0.35
+# Softmax temperature turning the scores into a confidence
+TEMPERATURE = 0.1
+# Prompts scoring below this for every intent resemble nothing we know; they keep
+# the parts route, like bare tool names do
+MIN_SCORE = 0.1
+
+# Words (accents folded) that point at a question about the manuals
+MANUAL_CUES = set(
+    """
+    manual manuais guia guide instrucao instrucoes instruction instructions
+    procedimento procedimentos passo passos etapa etapas como porque funciona
+    funcionamento significa significado explique explica explicar descreva
+    seguranca especificacao especificacoes calibrar calibracao configurar
+    configuracao instalar instalacao montar montagem desmontar limpar limpeza
+    lubrificar lubrificacao inspecionar inspecao substituir recomendado
+    recomendada recomenda norma normas cuidado cuidados risco riscos falha
+    """.split()
+)
+
+# Words that point at a tool availability request
+PARTS_CUES = set(
+    """
+    disponivel disponiveis disponibilidade livre livres horario horarios reservar
+    reserva agendar agenda agendamento ocupado ocupada ocupados emprestar
+    emprestimo alugar preciso precisamos hoje amanha semana
+    """.split()
+)
+
+EXAMPLES = {
+    "manual": [
+        "No manual, como faço a calibração do sensor?",
+        "Qual o torque recomendado para os parafusos da tampa?",
+        "Como trocar o rolamento do motor?",
+        "O que diz o manual sobre a lubrificação da bomba?",
+        "Quais são os cuidados de segurança antes da manutenção?",
+        "Qual o procedimento para instalar o equipamento?",
+        "Explique o funcionamento do painel de controle",
+        "O que significa o código de erro E04?",
+        "Como faço a limpeza do filtro?",
+        "Quais os passos para desmontar a caixa de engrenagens?",
+        "Com que frequência devo inspecionar as correias?",
+        "Qual a especificação do óleo recomendado?",
+        "Segundo o guia, como configurar o alarme de vibração?",
+        "Por que o motor aquece durante a operação?",
+        "How do I follow the maintenance instructions in the guide?",
+    ],
+    "parts": [
+        "Preciso de uma chave de fenda 5mm para hoje",
+        "A furadeira está disponível amanhã?",
+        "Quero reservar uma máquina de solda para sexta-feira",
+        "Quais horários a serra elétrica está livre no dia 15?",
+        "Preciso de um multímetro e um alicate amperímetro para segunda",
+        "Tem torquímetro disponível na próxima quarta?",
+        "Disponibilidade do esmerilhadeira para 2024-10-29",
+        "Chave inglesa e martelo para amanhã de manhã",
+        "Quando o compressor de ar fica livre esta semana?",
+        "e amanhã?",
+        "E para quinta?",
+        "Preciso da lixadeira e do soprador térmico depois de amanhã",
+        "Agendar uma parafusadeira para 10/11",
+        "O paquímetro digital está ocupado hoje?",
+        "Quero usar o analisador de vibração na terça",
+    ],
+    "mixed": [
+        "Como calibrar o sensor e o torquímetro está disponível amanhã?",
+        "Segundo o manual, que ferramentas preciso para trocar o rolamento e estão livres hoje?",
+        "Quais ferramentas o manual recomenda para a limpeza e quando estão disponíveis?",
+        "Como faço a troca do filtro? Preciso reservar a chave de filtro para sexta",
+        "Qual o procedimento de lubrificação e a bomba de graxa está livre amanhã?",
+        "Me explique a montagem e veja se a furadeira está disponível na segunda",
+    ],
+}
+
+
+def _bucket(feature):
+    return zlib.crc32(feature.encode("utf-8")) % FEATURE_DIMENSION
+
+
+def featurize(tokens):
+    # Hashed words, word pairs and character trigrams of the words (which tolerate
+    # inflections and typos); returns (buckets, weights) normalized to length 1
+    counts = {}
+    words = [t for t in tokens if not t[0].isdigit()]
+    for word in words:
+        bucket = _bucket("w:" + word)
+        counts[bucket] = counts.get(bucket, 0.0) + 1.0
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            bucket = _bucket("c:" + padded[i : i + 3])
+            counts[bucket] = counts.get(bucket, 0.0) + 0.25
+    for a, b in zip(words, words[1:]):
+        bucket = _bucket(f"b:{a} {b}")
+        counts[bucket] = counts.get(bucket, 0.0) + 0.5
+    if not counts:
+        return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+    buckets = np.fromiter(counts, dtype="int64", count=len(counts))
+    weights = np.fromiter(counts.values(), dtype="float32", count=len(counts))
+    weights /= np.linalg.norm(weights)
+    return buckets, weights
+
+
+def load_examples(path=INTENT_EXAMPLES_PATH):
+    examples = {intent: list(prompts) for intent, prompts in EXAMPLES.items()}
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                for intent, prompts in json.load(file).items():
+                    if intent in examples:
+                        examples[intent].extend(prompts)
+        except (OSError, ValueError) as e:
+            print("Ignoring unreadable intent examples:", e)
+    return examples
+
+
+# Routes a prompt to the manual, the parts availability or both, without any model
+# call: the prompt is embedded locally (hashed words and character trigrams) and
+# compared with the centroid of each intent's example prompts, computed once at
+# startup, and keyword cues and dates add their weight. Each decision is logged with
+# its confidence, the softmax probability of the winning intent.
+class IntentRouter:
+    def __init__(self, examples=None, min_confidence=INTENT_MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        examples = examples or load_examples()
+        self.centroids = np.zeros((len(INTENTS), FEATURE_DIMENSION), dtype="float32")
+        for row, intent in enumerate(INTENTS):
+            for prompt in examples[intent]:
+                buckets, weights = featurize(tokenize(prompt))
+                np.add.at(self.centroids[row], buckets, weights)
+            norm = np.linalg.norm(self.centroids[row])
+            if norm:
+                self.centroids[row] /= norm
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(INTENTS, 0)
+        self.total_ms = 0.0
+
+    def classify(self, prompt, today=None):
+        started = time.perf_counter()
+        tokens = tokenize(prompt)
+        buckets, weights = featurize(tokens)
+        similarities = self.centroids[:, buckets] @ weights
+
+        words = set(tokens)
+        manual_cue = min(len(words & MANUAL_CUES), 2) / 2
+        dated = bool(find_dates(tokens, today or date.today()))
+        parts_cue = min(len(words & PARTS_CUES) + dated, 2) / 2
+        cues = np.array(
+            [manual_cue, parts_cue, min(manual_cue, parts_cue)], dtype="float32"
+        )
+
+        scores = similarities + CUE_WEIGHT * cues
+        probabilities = np.exp((scores - scores.max()) / TEMPERATURE)
+        probabilities /= probabilities.sum()
+        best = int(probabilities.argmax())
+        confidence = float(probabilities[best])
+        if scores[best] < MIN_SCORE:
+            intent = "parts"
+        elif confidence < self.min_confidence:
+            intent = "parts" if scores[1] > scores[0] else "manual"
+        else:
+            intent = INTENTS[best]
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        decision = {
+            "intent": intent,
+            "confidence": round(confidence, 3),
+            "scores": {name: round(float(s), 3) for name, s in zip(INTENTS, scores)},
+            "elapsed_ms": round(elapsed_ms, 3),
+        }
+        with self.lock:
+            self.counts[intent] += 1
+            self.total_ms += elapsed_ms
+        return decision
+
+    def stats(self):
+        routed = sum(self.counts.values())
+        return dict(
+            self.counts,
+            mean_ms=round(self.total_ms / routed, 3) if routed else None,
+        )
@@ -0,0 +1,213 @@
+import glob
+import json
+import math
+import os
+import re
+
+import numpy as np
+
+from catalog_index import fold
+from files import atomic_write
+from vector_index import MANUAL_INDEX_DIR
+
+# Skip the query embedding when the keyword index alone is decisive (0 disables)
+LEXICAL_FAST_PATH = os.getenv("LEXICAL_FAST_PATH", "1") == "1"
+# A code in the question must be this rare in the manuals to be decisive
+LEXICAL_DECISIVE_MAX_DF = int(os.getenv("LEXICAL_DECISIVE_MAX_DF", 3))
+# Share of the question's terms (weighted by IDF) the best passage must contain
+LEXICAL_DECISIVE_COVERAGE = float(os.getenv("LEXICAL_DECISIVE_COVERAGE", 0.6))
+# Reciprocal rank fusion constant: larger values flatten the weight of the top ranks
+RRF_K = 60
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = set(
+    """
+    a as o os um uma uns umas de do da dos das no na nos nas em e ou com para pra
+    por pelo pela que se me eu ao aos qual quais como onde quando sobre ser esta
+    este isso isto diz the of to and in is how what
+    """.split()
+)
+
+# Words, and codes such as "E-04", "6205-2RS" or "XJ.200" kept together
+TERM_RE = re.compile(r"[0-9a-z]+(?:[-./][0-9a-z]+)*")
+
+
+def analyze(text):
+    # A compound code is indexed joined ("e04") and by its longer parts, so "E04",
+    # "E-04" and "e 04" all meet in the same term
+    terms = []
+    for match in TERM_RE.findall(fold(text)):
+        parts = re.split(r"[-./]", match)
+        if len(parts) > 1:
+            terms.append("".join(parts))
+        terms.extend(
+            part
+            for part in parts
+            if part not in STOPWORDS and (len(part) > 1 or part.isdigit())
+        )
+    return terms
+
+
+# A number followed by a unit ("5mm", "220v") is a measure, not a code
+MEASURE_RE = re.compile(
+    r"\d+(?:mm|cm|m|kg|g|nm|n|psi|bar|v|kv|w|kw|hz|rpm|a|ma|l|ml|h|s|min)"
+)
+
+
+def is_code(term):
+    # Part codes, error codes and model numbers ("e04", "62052rs", "xj200") rather
+    # than words or plain numbers: a letter and a digit, and not a measure
+    return (
+        len(term) >= 3
+        and any(c.isdigit() for c in term)
+        and any(c.isalpha() for c in term)
+        and not MEASURE_RE.fullmatch(term)
+    )
+
+
+def fuse(rankings, k):
+    # Reciprocal rank fusion of [(passage, score)] lists best first
+    fused = {}
+    for ranking in rankings:
+        for rank, (i, _) in enumerate(ranking):
+            fused[i] = fused.get(i, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(fused.items(), key=lambda item: -item[1])[:k]
+
+
+# BM25 inverted index over the manual passages, kept next to the FAISS index. The
+# postings are flat arrays (passage ids and precomputed BM25 weights, grouped by
+# term), so a saved index is memory-mapped and shared like the passages are.
+class LexicalIndex:
+    def __init__(self, terms, offsets, docs, weights, idf, size):
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.idf = idf
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_passages(cls, passages):
+        postings = {}
+        lengths = []
+        for i in range(len(passages)):
+            counts = {}
+            terms = analyze(passages[i]["text"])
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((i, tf))
+            lengths.append(len(terms))
+
+        size = len(lengths)
+        average = sum(lengths) / size if size else 1.0
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype="int64")
+        docs, weights = [], []
+        idf = np.zeros(len(terms), dtype="float32")
+        for t, term in enumerate(terms):
+            df = len(postings[term])
+            idf[t] = math.log(1 + (size - df + 0.5) / (df + 0.5))
+            for i, tf in postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[i] / (average or 1.0))
+                docs.append(i)
+                weights.append(idf[t] * tf * (BM25_K1 + 1) / (tf + norm))
+            offsets[t + 1] = len(docs)
+        return cls(
+            terms,
+            offsets,
+            np.array(docs, dtype="int32"),
+            np.array(weights, dtype="float32"),
+            idf,
+            size,
+        )
+
+    def save(self, prefix):
+        os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+        arrays = {
+            "offsets": self.offsets,
+            "docs": self.docs,
+            "weights": self.weights,
+            "idf": self.idf,
+        }
+        for name, array in arrays.items():
+            atomic_write(
+                f"{prefix}.{name}.npy", lambda file, array=array: np.save(file, array)
+            )
+        # Written last: a prefix without its .json is an incomplete save
+        names = json.dumps({"terms": self.terms, "size": self.size}).encode("utf-8")
+        atomic_write(prefix + ".json", lambda file: file.write(names))
+
+    @classmethod
+    def load(cls, prefix):
+        with open(prefix + ".json", "r", encoding="utf-8") as file:
+            names = json.load(file)
+        arrays = [
+            np.load(f"{prefix}.{name}.npy", mmap_mode="r")
+            for name in ("offsets", "docs", "weights", "idf")
+        ]
+        return cls(names["terms"], *arrays, names["size"])
+
+    def _postings(self, term_id):
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.docs[start:end], self.weights[start:end]
+
+    def search(self, query, k):
+        # Returns the top k [(passage, score)] and whether the best hit is decisive:
+        # it contains a rare code from the question and most of the question's terms
+        terms = set(analyze(query))
+        ids = [self.term_ids[term] for term in terms if term in self.term_ids]
+        if not ids or not self.size:
+            return [], False
+
+        scores = np.zeros(self.size, dtype="float32")
+        for term_id in ids:
+            docs, weights = self._postings(term_id)
+            scores[docs] += weights
+        top = np.argsort(-scores, kind="stable")[:k]
+        hits = [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+        if not hits or not LEXICAL_FAST_PATH:
+            return hits, False
+
+        best = hits[0][0]
+        # Terms the manuals never mention weigh like one found in a single passage
+        unseen = math.log(1 + (self.size - 0.5) / 1.5)
+        total = unseen * (len(terms) - len(ids))
+        covered = 0.0
+        code = False
+        for term_id in ids:
+            docs, _ = self._postings(term_id)
+            total += float(self.idf[term_id])
+            # Postings are in passage order
+            position = int(np.searchsorted(docs, best))
+            if position < len(docs) and docs[position] == best:
+                covered += float(self.idf[term_id])
+                rare = len(docs) <= LEXICAL_DECISIVE_MAX_DF
+                code = code or (rare and is_code(self.terms[term_id]))
+        decisive = code and covered / total >= LEXICAL_DECISIVE_COVERAGE
+        return hits, decisive
+
+
+def lexical_path(version):
+    return os.path.join(MANUAL_INDEX_DIR, f"manual-lexical-{version[:16]}")
+
+
+def load_or_build_lexical(version, passages):
+    # Persist the keyword index of this corpus version once and memory-map it
+    prefix = lexical_path(version)
+    try:
+        if not os.path.exists(prefix + ".json"):
+            LexicalIndex.from_passages(passages).save(prefix)
+            for stale in glob.glob(os.path.join(MANUAL_INDEX_DIR, "manual-lexical-*")):
+                if not stale.startswith(prefix + "."):
+                    os.remove(stale)
+        return LexicalIndex.load(prefix)
+    except OSError as e:
+        print("Could not persist the keyword index, keeping it in memory:", e)
+        return LexicalIndex.from_passages(passages)
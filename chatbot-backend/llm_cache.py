@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", 100000))
+# Expired and excess entries are removed once every this many writes
+EVICT_EVERY = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL,
+  created_at REAL NOT NULL,
+  used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_cache_used_at ON llm_cache (used_at);
+"""
+
+
+def normalize_messages(messages):
+    # Whitespace differences never change a temperature=0 completion's meaning
+    return [
+        {"role": message["role"], "content": " ".join(message["content"].split())}
+        for message in messages
+    ]
+
+
+# Persistent cache of deterministic (temperature=0) completions, keyed on a hash of
+# the model and the normalized messages. Kept in a SQLite file so it survives
+# restarts and is shared by the workers on a host; entries expire after the TTL
+# and the least recently used ones are evicted past max_entries (checked every
+# EVICT_EVERY writes, so the table may briefly hold a few more).
+class LLMResponseCache:
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(messages, model, scope=""):
+        # scope holds whatever else the answer depends on, e.g. today's date for
+        # prompts with relative dates
+        payload = json.dumps(
+            {"model": model, "scope": scope, "messages": normalize_messages(messages)},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+            if row:
+                with conn:
+                    conn.execute(
+                        "UPDATE llm_cache SET used_at = ? WHERE key = ?", (time.time(), key)
+                    )
+        except sqlite3.Error as e:
+            print("LLM cache unavailable:", e)
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created_at, used_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now, now),
+                )
+                self.puts += 1
+                if (self.puts - 1) % EVICT_EVERY:
+                    return
+                conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl,))
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache "
+                    "ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error as e:
+            print("LLM cache unavailable:", e)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+        }
@@ -0,0 +1,267 @@
+import os
+import re
+from datetime import date, timedelta
+
+from catalog_index import fold
+
+# Local extractions at or above this confidence skip the LLM (above 1 disables them)
+LOCAL_EXTRACT_THRESHOLD = float(os.getenv("LOCAL_EXTRACT_THRESHOLD", 0.8))
+# Minimum trigram similarity between a span of the prompt and a catalog description
+LOCAL_MATCH_THRESHOLD = float(os.getenv("LOCAL_MATCH_THRESHOLD", 0.8))
+# Longer prompts are left to the LLM
+LOCAL_EXTRACT_MAX_WORDS = int(os.getenv("LOCAL_EXTRACT_MAX_WORDS", 40))
+
+# Words that carry no piece or date information in a request
+FILLER_WORDS = set(
+    """
+    a as o os um uma uns umas de do da dos das no na nos nas em e ou com para pra pro
+    por que se me eu nos voce vc ola oi bom boa tarde noite favor obrigado
+    preciso precisa precisamos precisaria quero queria gostaria vou vamos
+    usar utilizar reservar ter tem temos tera existe ha esta estao estara
+    disponivel disponiveis disponibilidade livre livres horario horarios hora horas
+    ferramenta ferramentas peca pecas equipamento equipamentos material materiais
+    manutencao qual quais quando algum alguma alguns algumas tambem
+    """.split()
+)
+
+WEEKDAYS = {
+    "segunda": 0,
+    "terca": 1,
+    "quarta": 2,
+    "quinta": 3,
+    "sexta": 4,
+    "sabado": 5,
+    "domingo": 6,
+}
+MONTHS = {
+    "janeiro": 1,
+    "fevereiro": 2,
+    "marco": 3,
+    "abril": 4,
+    "maio": 5,
+    "junho": 6,
+    "julho": 7,
+    "agosto": 8,
+    "setembro": 9,
+    "outubro": 10,
+    "novembro": 11,
+    "dezembro": 12,
+}
+# Units after a fraction like "1/2 pol", which is a size rather than a date
+UNIT_WORDS = {"pol", "polegada", "polegadas", "mm", "cm", "m", "in"}
+# Words a day/month date may follow; any other word is taken as part of a name
+DATE_WORDS = {"dia", "ate", "desde", "feira", *WEEKDAYS}
+NUMBER_WORDS = {
+    "um": 1,
+    "uma": 1,
+    "dois": 2,
+    "duas": 2,
+    "tres": 3,
+    "quatro": 4,
+    "cinco": 5,
+    "seis": 6,
+    "sete": 7,
+    "oito": 8,
+    "nove": 9,
+    "dez": 10,
+}
+
+# Dates written with separators are kept as one token; everything else is split
+# into words the way pg_trgm does
+TOKEN_RE = re.compile(r"\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}(?:/\d{2,4})?|[^\W_]+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(fold(text))
+
+
+def _number(token):
+    if token.isdigit():
+        return int(token)
+    return NUMBER_WORDS.get(token)
+
+
+def _future(build, today):
+    # The first date built from (year) that is not in the past
+    for year in (today.year, today.year + 1):
+        try:
+            candidate = build(year)
+        except ValueError:
+            continue
+        if candidate >= today:
+            return candidate
+    return None
+
+
+def _next_day_of_month(day, today):
+    # "dia N" means this month, or the next one when that day has passed
+    month_start = today.replace(day=1)
+    for _ in range(2):
+        try:
+            candidate = month_start.replace(day=day)
+            if candidate >= today:
+                return candidate
+        except ValueError:
+            pass
+        month_start = (month_start + timedelta(days=32)).replace(day=1)
+    return None
+
+
+def _is_size(tokens, i):
+    # "Chave 1/2" or "broca 3/8 pol": a fraction naming a size, not a day/month
+    previous = tokens[i - 1] if i else None
+    if tokens[i + 1 : i + 2] and tokens[i + 1] in UNIT_WORDS:
+        return True
+    return (
+        previous is not None
+        and previous.isalpha()
+        and previous not in FILLER_WORDS
+        and previous not in DATE_WORDS
+    )
+
+
+def _date_at(tokens, i, today):
+    # Returns (date, number of tokens consumed) for a date expression at tokens[i]
+    token = tokens[i]
+    following = tokens[i + 1 : i + 5]
+
+    if token == "hoje":
+        return today, 1
+    if token == "amanha":
+        return today + timedelta(days=1), 1
+    if token == "depois" and following[:2] == ["de", "amanha"]:
+        return today + timedelta(days=2), 3
+
+    if token in ("proxima", "proximo") and following and following[0] in WEEKDAYS:
+        target, used = _date_at(tokens, i + 1, today)
+        if target == today:
+            target += timedelta(days=7)
+        return target, used + 1
+    if token in WEEKDAYS:
+        used = 2 if following[:1] == ["feira"] else 1
+        days = (WEEKDAYS[token] - today.weekday()) % 7
+        if tokens[i + used : i + used + 2] == ["que", "vem"]:
+            used += 2
+            days = days or 7
+        return today + timedelta(days=days), used
+
+    if token in ("daqui", "em") and len(following) >= 2:
+        offset = 1 if token == "daqui" and following[0] == "a" else 0
+        count = _number(following[offset]) if offset < len(following) else None
+        if count is not None and following[offset + 1 : offset + 2] in (["dia"], ["dias"]):
+            return today + timedelta(days=count), offset + 3
+
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", token):
+        try:
+            return date.fromisoformat(token), 1
+        except ValueError:
+            return None, 0
+    if "/" in token:
+        parts = [int(part) for part in token.split("/")]
+        if len(parts) == 2 and _is_size(tokens, i):
+            return None, 0
+        if len(parts) == 3:
+            year = parts[2] + 2000 if parts[2] < 100 else parts[2]
+            try:
+                return date(year, parts[1], parts[0]), 1
+            except ValueError:
+                return None, 0
+        return _future(lambda year: date(year, parts[1], parts[0]), today), 1
+
+    # "dia 5", "5 de novembro", "dia 5 de novembro de 2024"
+    start = i + 1 if token == "dia" else i
+    if not tokens[start : start + 1] or not tokens[start].isdigit():
+        return None, 0
+    day = int(tokens[start])
+    end = start + 1
+    if tokens[end : end + 1] == ["de"] and tokens[end + 1 : end + 2] and (
+        tokens[end + 1] in MONTHS
+    ):
+        month = MONTHS[tokens[end + 1]]
+        end += 2
+        if tokens[end : end + 1] == ["de"] and re.fullmatch(
+            r"\d{4}", "".join(tokens[end + 1 : end + 2])
+        ):
+            try:
+                return date(int(tokens[end + 1]), month, day), end + 2 - i
+            except ValueError:
+                return None, 0
+        return _future(lambda year: date(year, month, day), today), end - i
+    if token == "dia":
+        return _next_day_of_month(day, today), end - i
+    return None, 0
+
+
+def find_dates(tokens, today):
+    # Returns [(date, start, end)] for every date expression in the tokens
+    found = []
+    i = 0
+    while i < len(tokens):
+        value, used = _date_at(tokens, i, today)
+        if used:
+            found.append((value, i, i + used))
+            i += used
+        else:
+            i += 1
+    return found
+
+
+def find_pieces(tokens, blocked, index, threshold=LOCAL_MATCH_THRESHOLD):
+    # Scores every span of the prompt that could name a piece (it cannot start or
+    # end on a filler word or cross a date) and keeps the best non-overlapping ones
+    max_words = index.max_words + 1
+    spans = []
+    for start in range(len(tokens)):
+        if start in blocked or tokens[start] in FILLER_WORDS:
+            continue
+        for end in range(start + 1, min(start + max_words, len(tokens)) + 1):
+            if end - 1 in blocked:
+                break
+            if tokens[end - 1] in FILLER_WORDS:
+                continue
+            text = " ".join(tokens[start:end])
+            for piece, score in index.search(text, 1):
+                if score >= threshold:
+                    spans.append((score, end - start, start, end, piece))
+
+    chosen = []
+    used = set()
+    saps = set()
+    for score, _, start, end, piece in sorted(spans, key=lambda s: (-s[0], -s[1], s[2])):
+        if used.intersection(range(start, end)) or piece["sap"] in saps:
+            continue
+        chosen.append((start, end, piece, score))
+        used.update(range(start, end))
+        saps.add(piece["sap"])
+    chosen.sort()
+    return chosen
+
+
+def extract_locally(prompt, index, today=None):
+    # Parses requests that name catalog pieces and dates literally. Returns the
+    # same pieces/date as the LLM extractor plus a confidence: the weakest piece
+    # match, scaled by the share of meaningful words that were understood.
+    today = today or date.today()
+    result = {"pieces": [], "date": None, "confidence": 0.0}
+    tokens = tokenize(prompt)
+    if not tokens or len(tokens) > LOCAL_EXTRACT_MAX_WORDS:
+        return result
+
+    dates = find_dates(tokens, today)
+    if len({value for value, _, _ in dates}) > 1 or any(v is None for v, _, _ in dates):
+        return result
+    blocked = {i for _, start, end in dates for i in range(start, end)}
+    pieces = find_pieces(tokens, blocked, index)
+
+    covered = blocked | {i for start, end, _, _ in pieces for i in range(start, end)}
+    content = [i for i, token in enumerate(tokens) if token not in FILLER_WORDS]
+    if not pieces and not dates:
+        return result
+
+    understood = sum(1 for i in content if i in covered)
+    coverage = understood / len(content) if content else 1.0
+    match = min((score for _, _, _, score in pieces), default=1.0)
+    result["pieces"] = [piece["descricao"] for _, _, piece, _ in pieces]
+    result["date"] = dates[0][0].isoformat() if dates else None
+    result["confidence"] = round(match * coverage, 3)
+    return result
@@ -0,0 +1,153 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+
+from passages import split_into_passages
+
+MANUALS_DIR = os.getenv("MANUALS_DIR", "manuals")
+MANUALS_CACHE_DIR = os.getenv("MANUALS_CACHE_DIR", "corpus_cache")
+MANUALS_EXTRACT_WORKERS = int(os.getenv("MANUALS_EXTRACT_WORKERS", os.cpu_count() or 1))
+MANUALS_WATCH_INTERVAL = float(os.getenv("MANUALS_WATCH_INTERVAL", 30))
+
+
+def extract_text_from_pdf(pdf_path):
+    chunks = []
+    with open(pdf_path, "rb") as file:
+        reader = PyPDF2.PdfReader(file)
+        for page_num, page in enumerate(reader.pages):
+            text = page.extract_text()
+            if text:
+                chunks.append({"text": text, "page": page_num + 1})
+    return chunks
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# A directory of manual PDFs. Each scan hashes the files, extracts text only for
+# documents whose content changed (in a process pool, with results kept on disk
+# by content hash) and returns passages tagged with their document.
+class ManualCorpus:
+    def __init__(self, directory=MANUALS_DIR, cache_dir=MANUALS_CACHE_DIR, extra_files=()):
+        self.directory = directory
+        self.cache_dir = cache_dir
+        self.extra_files = list(extra_files)
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def paths(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, "**", "*.pdf"), recursive=True))
+        paths += [path for path in self.extra_files if os.path.exists(path)]
+        return paths
+
+    def _doc_id(self, path):
+        # Relative to the manuals directory, so a/manual.pdf and b/manual.pdf differ;
+        # extra files outside it go by their name
+        relative = os.path.relpath(path, self.directory)
+        if relative.startswith(os.pardir):
+            relative = os.path.basename(path)
+        return os.path.splitext(relative)[0].replace(os.sep, "/")
+
+    def _cache_path(self, sha):
+        return os.path.join(self.cache_dir, f"{sha}.json")
+
+    def _load_pages(self, sha):
+        try:
+            with open(self._cache_path(sha), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _save_pages(self, sha, pages):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self._cache_path(sha) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(pages, file)
+        os.replace(tmp_path, self._cache_path(sha))
+
+    def scan(self):
+        # Returns True when any document was added, changed or removed
+        with self.lock:
+            documents = {}
+            to_extract = []
+            for path in self.paths():
+                previous = self.documents.get(path)
+                try:
+                    stat = os.stat(path)
+                    if previous and (previous["mtime"], previous["size"]) == (stat.st_mtime, stat.st_size):
+                        documents[path] = previous
+                        continue
+                    sha = file_hash(path)
+                except FileNotFoundError:
+                    # Deleted since it was listed: left out of this scan
+                    continue
+                if previous and previous["sha"] == sha:
+                    documents[path] = dict(previous, mtime=stat.st_mtime, size=stat.st_size)
+                    continue
+                document = {
+                    "doc_id": self._doc_id(path),
+                    "sha": sha,
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size,
+                    "pages": self._load_pages(sha),
+                }
+                if document["pages"] is None:
+                    to_extract.append(path)
+                documents[path] = document
+
+            # PyPDF2 extraction is CPU-bound, so spread documents over processes
+            if len(to_extract) > 1 and MANUALS_EXTRACT_WORKERS > 1:
+                with ProcessPoolExecutor(max_workers=MANUALS_EXTRACT_WORKERS) as executor:
+                    extracted = list(executor.map(extract_text_from_pdf, to_extract))
+            else:
+                extracted = [extract_text_from_pdf(path) for path in to_extract]
+            for path, pages in zip(to_extract, extracted):
+                documents[path]["pages"] = pages
+                self._save_pages(documents[path]["sha"], pages)
+
+            changed = {p: d["sha"] for p, d in documents.items()} != {
+                p: d["sha"] for p, d in self.documents.items()
+            }
+            if changed:
+                print(
+                    f"Manual corpus: {len(documents)} documents, {len(to_extract)} extracted"
+                )
+            self.documents = documents
+            return changed
+
+    def passages(self):
+        passages = []
+        with self.lock:
+            for path in sorted(self.documents):
+                document = self.documents[path]
+                if "passages" not in document:
+                    document["passages"] = [
+                        dict(passage, doc=document["doc_id"])
+                        for passage in split_into_passages(document["pages"])
+                    ]
+                passages.extend(document["passages"])
+        return passages
+
+    def watch(self, on_change, interval=MANUALS_WATCH_INTERVAL):
+        def run():
+            stop = threading.Event()
+            while not stop.wait(interval):
+                try:
+                    if self.scan():
+                        on_change()
+                except Exception as e:
+                    print("Error while rescanning manuals:", e)
+
+        thread = threading.Thread(target=run, name="manual-corpus-watch", daemon=True)
+        thread.start()
+        return thread
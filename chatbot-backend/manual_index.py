@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+
+from chunk_store import ChunkStore, chunks_path, load_or_build_chunks
+from embedding_batches import embed_texts
+from lexical_index import LexicalIndex, lexical_path, load_or_build_lexical
+from vector_index import (
+    MANUAL_INDEX_DIR,
+    MANUAL_INDEX_TYPE,
+    ManualRetriever,
+    index_path,
+    load_or_build_index,
+)
+
+# Seconds between attempts when building the index at startup fails
+MANUAL_INDEX_RETRY_INTERVAL = float(os.getenv("MANUAL_INDEX_RETRY_INTERVAL", 60))
+# How often forked workers check for a newer index published by the master
+MANUAL_INDEX_POLL_INTERVAL = float(os.getenv("MANUAL_INDEX_POLL_INTERVAL", 2))
+
+# Names the persisted index and passages of the latest successful build
+CURRENT_PATH = os.path.join(MANUAL_INDEX_DIR, "manual-current.json")
+
+
+# Builds the searchable manual corpus and holds the live version of it. `current`
+# is replaced as a whole ({"chunks", "retriever", "lexical", "version"}) so readers
+# never see chunks from one build paired with the indexes of another. start()
+# builds it on a background thread so the server can take requests meanwhile;
+# `status` tracks the progress of the build in flight. Each build is published on disk, and follow()
+# lets other processes (forked workers) memory-map it instead of building their own.
+class ManualIndex:
+    def __init__(self, client, corpus, embedding_cache, answer_cache, model):
+        self.client = client
+        self.corpus = corpus
+        self.embedding_cache = embedding_cache
+        self.answer_cache = answer_cache
+        self.model = model
+        self.current = None
+        self.lock = threading.Lock()
+        self.status = {
+            "state": "pending",
+            "passages": 0,
+            "embedded": 0,
+            "to_embed": 0,
+            "error": None,
+            "ready_at": None,
+        }
+        self.started_at = time.time()
+
+    @property
+    def ready(self):
+        return self.current is not None
+
+    def _update(self, **fields):
+        # Replaced as a whole so readers on other threads see a consistent status
+        self.status = dict(self.status, **fields)
+
+    def progress(self):
+        return dict(
+            self.status,
+            ready=self.ready,
+            version=self.current["version"] if self.current else None,
+            uptime=round(time.time() - self.started_at, 1),
+        )
+
+    def create_embeddings(self, chunks):
+        keys = [self.embedding_cache.key(chunk["text"]) for chunk in chunks]
+
+        # Only embed chunks whose text (for this model) has never been seen before
+        missing = []
+        seen = set()
+        for i, key in enumerate(keys):
+            if key not in self.embedding_cache and key not in seen:
+                missing.append(i)
+                seen.add(key)
+
+        if missing:
+            self._update(state="embedding", embedded=0, to_embed=len(missing))
+            new_vectors = embed_texts(
+                self.client,
+                [chunks[i]["text"] for i in missing],
+                self.model,
+                on_progress=lambda done, total: self._update(embedded=done),
+            )
+            self.embedding_cache.add(
+                [keys[i] for i in missing], [chunks[i] for i in missing], new_vectors
+            )
+        print(
+            f"Embedding cache: {len(missing)} embedded, {len(chunks) - len(missing)} reused"
+        )
+        self._update(state="indexing")
+        return self.embedding_cache.get(keys)
+
+    def build(self):
+        with self.lock:
+            try:
+                chunks = self.corpus.passages()
+                if not chunks:
+                    raise RuntimeError("Nenhum manual encontrado para indexar.")
+                self._update(
+                    state="indexing", passages=len(chunks), embedded=0, to_embed=0
+                )
+                version = hashlib.sha256(
+                    "".join(
+                        self.embedding_cache.key(chunk["text"]) for chunk in chunks
+                    ).encode("utf-8")
+                ).hexdigest()
+                retriever = load_or_build_index(
+                    version, lambda: self.create_embeddings(chunks)
+                )
+                chunks = load_or_build_chunks(version, chunks)
+                lexical = load_or_build_lexical(version, chunks)
+                self._install(chunks, retriever, lexical, version)
+                self._publish(version)
+            except Exception as e:
+                # A failed rebuild keeps serving the previous version, if any
+                self._update(state="failed", error=str(e))
+                raise
+
+    def _install(self, chunks, retriever, lexical, version):
+        self.current = {
+            "chunks": chunks,
+            "retriever": retriever,
+            "lexical": lexical,
+            "version": version,
+        }
+        self.answer_cache.set_version(version)
+        self._update(state="ready", error=None, ready_at=time.time())
+
+    def _publish(self, version):
+        try:
+            tmp_path = CURRENT_PATH + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump({"version": version, "kind": MANUAL_INDEX_TYPE}, file)
+            os.replace(tmp_path, CURRENT_PATH)
+        except OSError as e:
+            print("Could not publish the manual index:", e)
+
+    def load_published(self):
+        # Memory-maps the latest published build if it is newer than the current one
+        try:
+            with open(CURRENT_PATH, "r", encoding="utf-8") as file:
+                published = json.load(file)
+        except (OSError, ValueError):
+            return False
+        version = published["version"]
+        if self.current and self.current["version"] == version:
+            return False
+        retriever = ManualRetriever.load(index_path(version, published["kind"]))
+        chunks = ChunkStore.load(chunks_path(version))
+        try:
+            lexical = LexicalIndex.load(lexical_path(version))
+        except OSError:
+            # Published by a build that predates the keyword index
+            lexical = LexicalIndex.from_passages(chunks)
+        self._install(chunks, retriever, lexical, version)
+        print(f"Loaded published manual index {version[:16]} ({len(chunks)} passages)")
+        return True
+
+    def follow(self, interval=MANUAL_INDEX_POLL_INTERVAL):
+        # For workers forked from the process that builds the index: they never
+        # embed or build, they pick up each build the builder publishes
+        if not self.ready:
+            self._update(state="waiting")
+
+        def run():
+            while True:
+                try:
+                    self.load_published()
+                except Exception as e:
+                    # The files may be replaced under us; the next poll retries
+                    print("Could not load the published manual index:", e)
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="manual-index-follow", daemon=True)
+        thread.start()
+        return thread
+
+    def start(self, watch_interval=0):
+        # Scans and indexes the manuals in the background, retrying until the first
+        # build succeeds, then optionally watches the corpus for changes
+        def run():
+            while True:
+                try:
+                    self._update(state="scanning")
+                    self.corpus.scan()
+                    self.build()
+                    break
+                except Exception:
+                    traceback.print_exc()
+                    time.sleep(MANUAL_INDEX_RETRY_INTERVAL)
+            if watch_interval > 0:
+                self.corpus.watch(self.build, watch_interval)
+
+        thread = threading.Thread(target=run, name="manual-index-build", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,211 @@
+import bisect
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from files import atomic_write
+
+# Each process writes its metrics here, so /metrics served by any gunicorn worker
+# reports the whole host (empty: only the process answering the scrape)
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+# Seconds between writes of a process's metrics, i.e. how stale the other workers'
+# numbers in a scrape may be
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+# Per-stage durations in a Server-Timing response header (0 hides them from clients)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+
+# Histogram bucket bounds in seconds, from a local lookup to a slow completion
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRICS = {
+    "tracbot_request_seconds": (
+        "histogram",
+        "Time until the response starts, by route and status",
+    ),
+    "tracbot_stage_seconds": ("histogram", "Time spent in each stage of a request"),
+    "tracbot_cache_lookups_total": ("counter", "Cache lookups by cache and result"),
+    "tracbot_llm_tokens_total": ("counter", "OpenAI tokens by model and kind"),
+    "tracbot_model_seconds": ("histogram", "Chat completion latency by route and model"),
+    "tracbot_model_calls_total": (
+        "counter",
+        "Chat completions by route, model and outcome (escalated ones went on)",
+    ),
+}
+
+
+def _labels(labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Stage timers, cache counters and token counts, exposed in the Prometheus text
+# format. Histograms and counters are keyed by (metric, sorted labels); a stage
+# timed during a request is also kept for that request's Server-Timing header.
+# Updates take a lock for a few dict operations, cheap next to what is timed.
+class Metrics:
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.timings = contextvars.ContextVar("stage_timings", default=None)
+        self._reset()
+        # A forked gunicorn worker starts counting from zero, not from the master's
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.last_flush = time.monotonic()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            entry = self.histograms.get(key)
+            if entry is None:
+                # Per-bucket counts (the last one is +Inf), sum and count
+                entry = self.histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            entry[0][bucket] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    def inc(self, name, amount=1, **labels):
+        if not amount:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def record_stage(self, name, seconds):
+        self.observe("tracbot_stage_seconds", seconds, stage=name)
+        timings = self.timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - started)
+
+    def cache(self, name, result, amount=1):
+        self.inc("tracbot_cache_lookups_total", amount, cache=name, result=result)
+
+    def tokens(self, model, usage):
+        # usage of an OpenAI response; streams only report it when asked to
+        if usage is None:
+            return
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        self.inc("tracbot_llm_tokens_total", prompt, model=model, kind="prompt")
+        self.inc("tracbot_llm_tokens_total", completion, model=model, kind="completion")
+
+    def start_request(self):
+        self.timings.set({})
+        return time.perf_counter()
+
+    def finish_request(self, route, status, started):
+        # Returns the Server-Timing header value of the request, or None
+        elapsed = time.perf_counter() - started
+        self.observe("tracbot_request_seconds", elapsed, route=route, status=status)
+        timings = self.timings.get() or {}
+        self.timings.set(None)
+        if time.monotonic() - self.last_flush > self.flush_interval:
+            self.flush()
+        if not SERVER_TIMING:
+            return None
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+        entries.append(f"total;dur={elapsed * 1000:.1f}")
+        return ", ".join(entries)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": [
+                    [name, labels, counts[:], total, count]
+                    for (name, labels), (counts, total, count) in self.histograms.items()
+                ],
+                "counters": [
+                    [name, labels, value]
+                    for (name, labels), value in self.counters.items()
+                ],
+            }
+
+    def _path(self):
+        return os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.directory:
+            return
+        data = json.dumps(self.snapshot()).encode("utf-8")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            atomic_write(self._path(), lambda file: file.write(data))
+        except OSError as e:
+            print("Could not write metrics:", e)
+
+    def _snapshots(self):
+        # This process's live numbers, plus the last ones written by the others
+        snapshots = [self.snapshot()]
+        if not self.directory:
+            return snapshots
+        own = self._path()
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            if path == own:
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                pass
+        return snapshots
+
+    def render(self):
+        histograms, counters = {}, {}
+        for snapshot in self._snapshots():
+            for name, labels, counts, total, count in snapshot["histograms"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+
+        lines = []
+        for metric, (kind, description) in METRICS.items():
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{metric}{{{_labels(labels)}}} {_number(value)}")
+            for (name, labels), (counts, total, count) in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    bucket_labels = _labels(labels + (("le", bound),))
+                    lines.append(f"{metric}_bucket{{{bucket_labels}}} {cumulative}")
+                lines.append(f"{metric}_sum{{{_labels(labels)}}} {_number(total)}")
+                lines.append(f"{metric}_count{{{_labels(labels)}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def clear_metrics_dir(directory=METRICS_DIR):
+    # Drops the numbers of a previous server run (gunicorn.conf.py, on start)
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        os.remove(path)
+
+
+metrics = Metrics()
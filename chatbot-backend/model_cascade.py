@@ -0,0 +1,167 @@
+import json
+import os
+import re
+import threading
+import time
+from datetime import date
+
+from metrics import metrics
+from piece_resolver import PIECE_SIMILARITY_THRESHOLD
+
+# Replies scoring below this go to the next model of the route
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", 0.5))
+
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def route_models(route, default):
+    # Chat models of a route, cheapest first: <ROUTE>_MODELS="gpt-4o-mini,gpt-4-turbo"
+    value = os.getenv(f"{route.upper()}_MODELS", default)
+    return [model.strip() for model in value.split(",") if model.strip()]
+
+
+def parse_extraction(reply):
+    # {"pieces": [str], "date": "YYYY-MM-DD" or None} from an extraction reply;
+    # raises ValueError when the reply does not hold one
+    match = re.search(r"\{.*\}", reply or "", re.DOTALL)
+    if not match:
+        raise ValueError("no JSON object in the reply")
+    data = json.loads(re.sub(r"\s+", " ", match.group(0)))
+    if not isinstance(data, dict):
+        raise ValueError("the reply is not a JSON object")
+    pieces = data.get("pieces") or []
+    if not isinstance(pieces, list) or not all(
+        isinstance(piece, str) and piece.strip() for piece in pieces
+    ):
+        raise ValueError(f"pieces is not a list of names: {pieces!r}")
+    date_str = data.get("date") or None
+    if date_str is not None:
+        if not isinstance(date_str, str) or not ISO_DATE.fullmatch(date_str):
+            raise ValueError(f"date is not ISO: {date_str!r}")
+        date.fromisoformat(date_str)
+    return {"pieces": [piece.strip() for piece in pieces], "date": date_str}
+
+
+def extraction_confidence(data, index):
+    # Share of the extracted pieces the catalog recognizes: a cheap model misreading
+    # the request tends to name tools we do not have
+    if not data["pieces"]:
+        return 1.0
+    results = index.resolve(data["pieces"], PIECE_SIMILARITY_THRESHOLD, 1)
+    return sum(1 for result in results if result["match"]) / len(results)
+
+
+# Model selection per route. Validated routes (extraction) try their models cheapest
+# first and move on when a reply does not parse or scores below min_confidence; the
+# last model's reply is kept either way. Free-text routes (answers) have nothing to
+# validate, so the caller picks the cheap model for easy questions up front. Every
+# call goes into a usage ledger of calls, outcomes, tokens and latency per model.
+class ModelCascade:
+    def __init__(self, routes, min_confidence=CASCADE_MIN_CONFIDENCE):
+        # Fail at startup rather than on every request of a route with nothing to call
+        for route, models in routes.items():
+            if not models:
+                raise ValueError(
+                    f"No models for the {route} route: set {route.upper()}_MODELS"
+                )
+        self.routes = routes
+        self.min_confidence = min_confidence
+        self.lock = threading.Lock()
+        self.usage = {}
+
+    def models(self, route):
+        return self.routes[route]
+
+    def pick(self, route, easy=False):
+        models = self.routes[route]
+        return models[0] if easy else models[-1]
+
+    def record(self, route, model, seconds, usage, outcome="accepted"):
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        with self.lock:
+            entry = self.usage.setdefault(
+                (route, model),
+                {
+                    "calls": 0,
+                    "outcomes": {},
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "seconds": 0.0,
+                },
+            )
+            entry["calls"] += 1
+            entry["outcomes"][outcome] = entry["outcomes"].get(outcome, 0) + 1
+            entry["prompt_tokens"] += prompt
+            entry["completion_tokens"] += completion
+            entry["seconds"] += seconds
+        metrics.tokens(model, usage)
+        metrics.observe("tracbot_model_seconds", seconds, route=route, model=model)
+        metrics.inc("tracbot_model_calls_total", route=route, model=model, outcome=outcome)
+
+    def _judge(self, route, model, started, response, parse, confidence, last):
+        # Returns (outcome, parsed) for one attempt and records it
+        reply = response.choices[0].message.content
+        try:
+            parsed = parse(reply)
+        except ValueError as e:
+            print(f"Invalid {route} reply from {model}:", e)
+            outcome, parsed = "invalid", None
+        else:
+            score = confidence(parsed) if confidence else 1.0
+            outcome = "accepted"
+            if score < self.min_confidence and not last:
+                print(f"Low confidence {route} reply from {model}: {score:.2f}")
+                outcome = "low_confidence"
+        if outcome != "accepted" and not last:
+            outcome = f"{outcome}_escalated"
+        self.record(route, model, time.perf_counter() - started, response.usage, outcome)
+        return outcome, parsed
+
+    def complete(self, client, route, messages, parse, confidence=None, **kwargs):
+        # Returns (model, reply, parsed); parsed is None if even the last model's
+        # reply does not parse
+        models = self.routes[route]
+        for i, model in enumerate(models):
+            started = time.perf_counter()
+            with metrics.stage("llm"):
+                response = client.chat.completions.create(
+                    model=model, messages=messages, **kwargs
+                )
+            outcome, parsed = self._judge(
+                route, model, started, response, parse, confidence, i == len(models) - 1
+            )
+            if outcome in ("accepted", "invalid"):
+                return model, response.choices[0].message.content, parsed
+
+    async def complete_async(
+        self, client, route, messages, parse, confidence=None, **kwargs
+    ):
+        # Same as complete, with an AsyncOpenAI client
+        models = self.routes[route]
+        for i, model in enumerate(models):
+            started = time.perf_counter()
+            with metrics.stage("llm"):
+                response = await client.chat.completions.create(
+                    model=model, messages=messages, **kwargs
+                )
+            outcome, parsed = self._judge(
+                route, model, started, response, parse, confidence, i == len(models) - 1
+            )
+            if outcome in ("accepted", "invalid"):
+                return model, response.choices[0].message.content, parsed
+
+    def ledger(self):
+        with self.lock:
+            return {
+                route: {
+                    model: dict(
+                        entry,
+                        outcomes=dict(entry["outcomes"]),
+                        seconds=round(entry["seconds"], 3),
+                    )
+                    for (name, model), entry in self.usage.items()
+                    if name == route
+                }
+                for route in self.routes
+            }
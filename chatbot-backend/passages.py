@@ -0,0 +1,163 @@
+import os
+import re
+
+from tokens import estimate_tokens
+
+PASSAGE_TOKENS = int(os.getenv("PASSAGE_TOKENS", 300))
+PASSAGE_OVERLAP_TOKENS = int(os.getenv("PASSAGE_OVERLAP_TOKENS", 60))
+MANUAL_CONTEXT_TOKENS = int(os.getenv("MANUAL_CONTEXT_TOKENS", 2000))
+
+# "3.2 Lubrificação", "4) Segurança", "CAPÍTULO 2 - INSTALAÇÃO"
+NUMBERED_HEADING = re.compile(r"^\d+(\.\d+)*[.)]?\s+\S")
+
+
+def is_heading(line):
+    line = line.strip()
+    if not line or len(line) > 80 or line.endswith((".", ",", ";")):
+        return False
+    if NUMBERED_HEADING.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    return len(letters) >= 4 and line.upper() == line
+
+
+def _split_long_line(text, start, max_tokens):
+    # Break a line that alone exceeds the passage budget at word boundaries
+    spans = []
+    span_start = None
+    span_end = None
+    span_tokens = 0
+    for match in re.finditer(r"\S+", text):
+        tokens = estimate_tokens(match.group(0) + " ")
+        if span_start is not None and span_tokens + tokens > max_tokens:
+            spans.append((start + span_start, text[span_start:span_end]))
+            span_start = None
+            span_tokens = 0
+        if span_start is None:
+            span_start = match.start()
+        span_end = match.end()
+        span_tokens += tokens
+    if span_start is not None:
+        spans.append((start + span_start, text[span_start:span_end]))
+    return spans
+
+
+def _document_lines(pages, max_tokens):
+    # Flatten pages into (page, start, text, tokens) lines, where start is the offset
+    # of the line in the document formed by joining page texts with "\n"
+    lines = []
+    page_start = 0
+    for page in pages:
+        text = page["text"]
+        for match in re.finditer(r"[^\n]+", text):
+            line = match.group(0)
+            if not line.strip():
+                continue
+            start = page_start + match.start()
+            if estimate_tokens(line) > max_tokens:
+                for span_start, span in _split_long_line(line, start, max_tokens):
+                    lines.append((page["page"], span_start, span, estimate_tokens(span)))
+            else:
+                lines.append((page["page"], start, line, estimate_tokens(line)))
+        page_start += len(text) + 1
+    return lines
+
+
+def split_into_passages(
+    pages, max_tokens=PASSAGE_TOKENS, overlap_tokens=PASSAGE_OVERLAP_TOKENS
+):
+    # Split extracted pages into overlapping passages that never cross a section
+    # heading. Passages may span pages and carry the section heading as context.
+    passages = []
+    section = None
+    current = []
+
+    def emit():
+        first, last = current[0], current[-1]
+        if first is last and first[2].strip() == section:
+            return  # heading with no body
+        body = "\n".join(line[2] for line in current)
+        text = body if section is None or first[2] == section else f"{section}\n{body}"
+        passages.append(
+            {
+                "text": text,
+                "page": first[0],
+                "page_end": last[0],
+                "section": section,
+                "start": first[1],
+                "end": last[1] + len(last[2]),
+            }
+        )
+
+    for line in _document_lines(pages, max_tokens):
+        if is_heading(line[2]):
+            if current:
+                emit()
+            section = line[2].strip()
+            current = [line]
+            continue
+
+        if current and sum(l[3] for l in current) + line[3] > max_tokens:
+            emit()
+            # Carry the tail of the previous passage over as overlap
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current[1:]):
+                if overlap_size + previous[3] > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += previous[3]
+            current = overlap
+        current.append(line)
+
+    if current:
+        emit()
+    return passages
+
+
+def _overlap(a, b):
+    if a.get("doc") != b.get("doc"):
+        return 0
+    return max(0, min(a["end"], b["end"]) - max(a["start"], b["start"]))
+
+
+def pack_context(candidates, budget_tokens=MANUAL_CONTEXT_TOKENS):
+    # Fill the token budget with candidates in score order, skipping passages that
+    # mostly repeat text already selected. Returns passages in document order.
+    selected = []
+    remaining = budget_tokens
+    for passage in candidates:
+        length = max(passage["end"] - passage["start"], 1)
+        if any(_overlap(passage, chosen) * 2 > length for chosen in selected):
+            continue
+        tokens = estimate_tokens(passage["text"])
+        if tokens > remaining:
+            continue
+        selected.append(passage)
+        remaining -= tokens
+    return sorted(selected, key=lambda passage: (passage.get("doc") or "", passage["start"]))
+
+
+def page_label(passage):
+    if passage["page_end"] != passage["page"]:
+        label = f"Páginas {passage['page']}-{passage['page_end']}"
+    else:
+        label = f"Página {passage['page']}"
+    if passage.get("doc"):
+        return f"Manual {passage['doc']}, {label.lower()}"
+    return label
+
+
+def format_references(passages):
+    # "Manual X, páginas 1, 2; Manual Y, página 5"
+    pages_by_doc = {}
+    for passage in passages:
+        pages = pages_by_doc.setdefault(passage.get("doc"), set())
+        pages.update(range(passage["page"], passage["page_end"] + 1))
+
+    references = []
+    for doc, pages in pages_by_doc.items():
+        label = "páginas" if len(pages) > 1 else "página"
+        pages = ", ".join(str(page) for page in sorted(pages))
+        references.append(f"Manual {doc}, {label} {pages}" if doc else f"{label} {pages}")
+    return "; ".join(references)
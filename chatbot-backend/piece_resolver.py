@@ -0,0 +1,71 @@
+import os
+
+PIECE_SIMILARITY_THRESHOLD = float(os.getenv("PIECE_SIMILARITY_THRESHOLD", 0.75))
+PIECE_CANDIDATES = int(os.getenv("PIECE_CANDIDATES", 3))
+
+# One statement for all descriptions: each input row is joined laterally against the
+# catalog, similarity is computed once per (input, piece) pair, and the top
+# candidates come back ordered by input position
+RESOLVE_PIECES_SQL = """
+    SELECT q.ord, c.sap, c.categoria, c.descricao, c.sim_score
+    FROM unnest(%s::text[]) WITH ORDINALITY AS q(descricao, ord)
+    LEFT JOIN LATERAL (
+        SELECT p.sap, p.categoria, p.descricao,
+               similarity(unaccent(UPPER(p.descricao)), unaccent(q.descricao)) AS sim_score
+        FROM pieces p
+        ORDER BY sim_score DESC, p.sap
+        LIMIT %s
+    ) c ON c.sim_score > 0
+    ORDER BY q.ord, c.sim_score DESC;
+"""
+RESOLVE_PIECES_ASYNC_SQL = RESOLVE_PIECES_SQL.replace("%s::text[]", "$1::text[]").replace(
+    "LIMIT %s", "LIMIT $2"
+)
+
+
+def _collect(descriptions, rows, threshold):
+    # One result per description, in input order:
+    # {"input", "match" (piece dict or None), "score", "candidates"}
+    results = [
+        {"input": desc, "match": None, "score": 0.0, "candidates": []}
+        for desc in descriptions
+    ]
+    for ord_, sap, categoria, descricao, score in rows:
+        if sap is None:
+            continue
+        result = results[ord_ - 1]
+        result["candidates"].append(
+            {"sap": sap, "categoria": categoria, "descricao": descricao, "score": score}
+        )
+        if result["match"] is None and score >= threshold:
+            result["match"] = {"sap": sap, "categoria": categoria, "descricao": descricao}
+            result["score"] = score
+    return results
+
+
+def resolve_pieces(
+    cur,
+    descriptions,
+    threshold=PIECE_SIMILARITY_THRESHOLD,
+    candidates=PIECE_CANDIDATES,
+):
+    if not descriptions:
+        return []
+    cur.execute(
+        RESOLVE_PIECES_SQL, ([desc.upper() for desc in descriptions], candidates)
+    )
+    return _collect(descriptions, cur.fetchall(), threshold)
+
+
+async def resolve_pieces_async(
+    pg_pool,
+    descriptions,
+    threshold=PIECE_SIMILARITY_THRESHOLD,
+    candidates=PIECE_CANDIDATES,
+):
+    if not descriptions:
+        return []
+    rows = await pg_pool.fetch(
+        RESOLVE_PIECES_ASYNC_SQL, [desc.upper() for desc in descriptions], candidates
+    )
+    return _collect(descriptions, [tuple(row) for row in rows], threshold)
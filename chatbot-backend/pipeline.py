@@ -0,0 +1,940 @@
+# Request handling shared by the serving modes. app.py and app2.py (Flask) drive a
+# Pipeline, app_async.py (Quart) an AsyncPipeline; both return (payload, status,
+# headers) for JSON responses and yield Server-Sent Events for streams, so the app
+# files only translate HTTP. The steps that do no I/O live in BasePipeline and the
+# module functions, and are written once for both.
+import asyncio
+import json
+import os
+import time
+import traceback
+from datetime import date, timedelta
+
+import dateparser
+import numpy as np
+
+from availability import WINDOW_HORIZON_DAYS, WINDOW_LIMIT
+from lexical_index import fuse
+from local_extractor import LOCAL_EXTRACT_THRESHOLD, extract_locally
+from metrics import metrics
+from model_cascade import extraction_confidence, parse_extraction
+from passages import format_references, pack_context, page_label
+from piece_resolver import (
+    PIECE_CANDIDATES,
+    PIECE_SIMILARITY_THRESHOLD,
+    resolve_pieces,
+    resolve_pieces_async,
+)
+from streaming import sse_event
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+# Number of passages retrieved before packing them into the answer context
+MANUAL_SEARCH_K = int(os.getenv("MANUAL_SEARCH_K", 12))
+
+NOTHING_FOUND = {"message": "Nenhuma peça ou data identificada no prompt."}
+
+
+def error_payload(e):
+    return {"error": f"Erro ao processar a consulta: {str(e)}"}
+
+
+def main_request(data):
+    # Returns (prompt, conversation_id, error payload or None) of a /main request
+    data = data or {}
+    prompt = data.get("prompt", "")
+    conversation_id = data.get("conversation_id", None)
+    if not prompt:
+        return prompt, conversation_id, {"error": "Prompt não fornecido."}
+    if not conversation_id:
+        return prompt, conversation_id, {"error": "conversation_id não fornecido."}
+    return prompt, conversation_id, None
+
+
+def window_request(data):
+    # Validated /janelas parameters; raises ValueError with the message for a 400
+    data = data or {}
+    saps = data.get("saps") or []
+    descriptions = data.get("pieces") or []
+    if not isinstance(saps, list) or not isinstance(descriptions, list):
+        raise ValueError("'saps' e 'pieces' devem ser listas.")
+    if not saps and not descriptions:
+        raise ValueError("Informe 'saps' ou 'pieces'.")
+
+    try:
+        duration = int(data.get("duration", 1))
+        start_date = (
+            date.fromisoformat(data["start_date"])
+            if data.get("start_date")
+            else date.today()
+        )
+        horizon_days = min(int(data.get("horizon_days", WINDOW_HORIZON_DAYS)), 366)
+        limit = int(data.get("limit", WINDOW_LIMIT))
+    except (TypeError, ValueError):
+        raise ValueError("Parâmetros inválidos.") from None
+    if duration < 1 or limit < 1 or horizon_days < 1:
+        raise ValueError("'duration', 'limit' e 'horizon_days' devem ser ao menos 1.")
+    return {
+        "saps": list(saps),
+        "descriptions": descriptions,
+        "duration": duration,
+        "start_date": start_date,
+        "horizon_days": horizon_days,
+        "limit": limit,
+    }
+
+
+def extraction_messages(prompt, conversation):
+    return [
+        {
+            "role": "system",
+            "content": (
+                "Você é um assistente que ajuda a identificar peças e datas mencionadas em um texto. "
+                "Mantenha o contexto da conversa ao interpretar o pedido do usuário. "
+                "Retorne apenas um JSON válido com as peças e a data em formato ISO (AAAA-MM-DD), resolvendo datas relativas como 'hoje' ou 'amanhã' para datas absolutas, sem texto adicional. "
+                f"Hoje é {date.today().isoformat()}. "
+                'Exemplo: {"pieces": ["peça1", "peça2"], "date": "2024-10-29"}'
+            ),
+        },
+        *conversation.messages(),
+        {"role": "user", "content": prompt},
+    ]
+
+
+def parse_date(date_str):
+    # Parse the date string into a datetime.date object, defaulting to today if none provided
+    if date_str:
+        with metrics.stage("dateparser"):
+            parsed_date = dateparser.parse(
+                date_str, settings={"PREFER_DATES_FROM": "future"}
+            )
+        if parsed_date:
+            return parsed_date.date()
+    return date.today()
+
+
+def matched_pieces(results):
+    # (catalog pieces, descriptions they matched) of piece resolver results
+    pieces, matched_descriptions = [], []
+    for result in results:
+        if result["match"]:
+            pieces.append(result["match"])
+            matched_descriptions.append(result["input"])
+    return pieces, matched_descriptions
+
+
+def unmatched(descriptions, matched_descriptions):
+    return [desc for desc in descriptions if desc not in matched_descriptions]
+
+
+def mixed_payload(parts, parts_status, manual, manual_status):
+    # Both answers in one response; a half that failed is reported next to the
+    # other instead of replacing it
+    if parts_status != 200 and manual_status != 200:
+        return parts, parts_status
+    response = dict(parts) if parts_status == 200 else {}
+    if parts_status != 200:
+        response["parts_error"] = parts.get("error")
+    if manual_status == 200:
+        response["answer"] = manual["answer"]
+    else:
+        response["manual_error"] = manual.get("error")
+    return response, 200
+
+
+def answer_footer(pages):
+    return f"\n\nReferências: {pages}."
+
+
+# The I/O-free half of a pipeline: component wiring, routing, status payloads and
+# the bookkeeping around extractions and answers
+class BasePipeline:
+    def __init__(
+        self,
+        client,
+        answer_cache,
+        llm_cache,
+        intent_router,
+        model_cascade,
+        piece_catalog,
+        availability_engine,
+        conversation_store,
+        manual_index,
+    ):
+        self.client = client
+        self.answer_cache = answer_cache
+        self.llm_cache = llm_cache
+        self.intent_router = intent_router
+        self.model_cascade = model_cascade
+        self.piece_catalog = piece_catalog
+        self.availability_engine = availability_engine
+        self.conversation_store = conversation_store
+        self.manual_index = manual_index
+
+    def classify(self, prompt):
+        # Route locally between the manual, the parts availability or both
+        with metrics.stage("intent"):
+            return self.intent_router.classify(prompt)["intent"]
+
+    def health(self):
+        # Liveness: the process is up, whether or not the manual index is ready
+        return {
+            "status": "ok",
+            "manual_index": self.manual_index.progress(),
+            "llm_cache": self.llm_cache.stats(),
+            "intent_router": self.intent_router.stats(),
+            "models": self.model_cascade.ledger(),
+        }
+
+    def readiness(self):
+        # Readiness: every route, including manual questions, can be served
+        progress = self.manual_index.progress()
+        payload = {"ready": progress["ready"], "manual_index": progress}
+        return payload, 200 if progress["ready"] else 503
+
+    def stream(self, prompt):
+        # Returns (event generator function, None), or (None, response) when the
+        # prompt cannot be served yet. Manual answers arrive as "token" events
+        # followed by "done", parts queries as a single "result" event and mixed
+        # ones as both, in that order
+        intent = self.classify(prompt)
+        if intent != "parts" and not self.manual_index.ready:
+            return None, self.indexing_response()
+        stream = {
+            "manual": self.stream_manual,
+            "parts": self.stream_consulta,
+            "mixed": self.stream_mixed,
+        }
+        return stream[intent], None
+
+    def indexing_response(self):
+        return (
+            {
+                "status": "indexing",
+                "message": "O manual ainda está sendo indexado. Tente novamente em instantes.",
+                "manual_index": self.manual_index.progress(),
+            },
+            503,
+            {"Retry-After": "10"},
+        )
+
+    def _local_extraction(self, prompt, index):
+        # Requests that name catalog pieces and dates literally are parsed locally
+        with metrics.stage("local_extract"):
+            extraction = extract_locally(prompt, index)
+        if extraction["confidence"] < LOCAL_EXTRACT_THRESHOLD:
+            return None
+        return {"pieces": extraction["pieces"], "date": extraction["date"]}
+
+    @staticmethod
+    def _accept(prompt, conversation, data, reply):
+        conversation.record(prompt, reply)
+        conversation.remember(data["pieces"], data["date"])
+        return data["pieces"], data["date"], conversation
+
+    def _extraction_request(self, prompt, conversation):
+        # temperature=0 makes the reply a function of the messages, the models and
+        # (for relative dates) today's date, so identical requests are served from cache
+        messages = extraction_messages(prompt, conversation)
+        models = ",".join(self.model_cascade.models("extract"))
+        cache_key = self.llm_cache.key(messages, models, date.today().isoformat())
+        return messages, cache_key
+
+    @staticmethod
+    def _confidence(index):
+        # Without the catalog only replies that do not parse escalate
+        if index is None:
+            return None
+        return lambda data: extraction_confidence(data, index)
+
+    @staticmethod
+    def _availability(pieces_info, descriptions, matched, parsed_date, hours):
+        return {
+            "found_pieces": pieces_info,
+            "unmatched_pieces": unmatched(descriptions, matched),
+            "common_hours": hours,
+            "date": parsed_date.isoformat(),
+        }
+
+    def _similar_hit(self, question, embedding):
+        cached = self.answer_cache.get_similar(question, embedding)
+        if not cached:
+            return None
+        metrics.cache("answer", "similar")
+        # The alias keeps the original's age, so it expires with it
+        self.answer_cache.put(
+            question,
+            embedding,
+            cached["answer"],
+            cached["pages"],
+            created=cached["created"],
+        )
+        return cached["answer"]
+
+    @staticmethod
+    def _answer_state(question, chunks, ranked, embedding, decisive):
+        metrics.cache("answer", "miss")
+        candidates = [chunks[i] for i, _ in ranked]
+        relevant_chunks = pack_context(candidates)
+
+        context = "\n\n".join(
+            [f"{page_label(chunk)}: {chunk['text']}" for chunk in relevant_chunks]
+        )
+        messages = [
+            {
+                "role": "system",
+                "content": "Você é um assistente que responde perguntas com base no seguinte manual.",
+            },
+            {"role": "system", "content": context},
+            {"role": "user", "content": question},
+        ]
+        return {
+            "messages": messages,
+            "pages": format_references(relevant_chunks),
+            "embedding": embedding,
+            # Questions pinned down by a rare code are lookups the cheap model handles
+            "easy": decisive,
+        }
+
+    @staticmethod
+    def _stream_delta(chunk, answer, started):
+        # Text of one streamed chunk; the first one is stripped of leading blanks
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            return ""
+        delta = chunk.choices[0].delta.content
+        if not answer:
+            delta = delta.lstrip()
+            metrics.record_stage("answer_first_token", time.perf_counter() - started)
+        return delta
+
+    def _finish_stream(self, question, state, model, started, usage, answer):
+        metrics.record_stage("answer", time.perf_counter() - started)
+        self.model_cascade.record("answer", model, time.perf_counter() - started, usage)
+        footer = answer_footer(state["pages"])
+        self.answer_cache.put(
+            question, state["embedding"], answer.strip() + footer, state["pages"]
+        )
+        return footer
+
+
+# Thread-per-request pipeline over the OpenAI client and the pooled psycopg2
+# connections of get_connection
+class Pipeline(BasePipeline):
+    def __init__(self, client, get_connection, **components):
+        super().__init__(client, **components)
+        self.get_connection = get_connection
+
+    def main(self, prompt, conversation_id):
+        intent = self.classify(prompt)
+        if intent == "parts":
+            return (*self.consulta(prompt, conversation_id), {})
+        if not self.manual_index.ready:
+            return self.indexing_response()
+        if intent == "manual":
+            return (*self.consulta_manual(prompt, conversation_id), {})
+        return (*self.consulta_mista(prompt, conversation_id), {})
+
+    def stream_manual(self, prompt, conversation_id, record=True):
+        try:
+            current = self.manual_index.current
+            answer = ""
+            for delta in self.answer_question_stream(
+                prompt, current["retriever"], current["chunks"], current["lexical"]
+            ):
+                answer += delta
+                yield sse_event("token", {"text": delta})
+
+            if record:
+                conversation = self.conversation_store.get(conversation_id)
+                conversation.record(prompt, answer)
+                self.conversation_store.save(conversation_id, conversation)
+            yield sse_event("done", {"answer": answer})
+
+        except Exception as e:
+            traceback.print_exc()
+            yield sse_event("error", error_payload(e))
+
+    def stream_consulta(self, prompt, conversation_id):
+        payload, status = self.consulta(prompt, conversation_id)
+        yield sse_event("result" if status == 200 else "error", payload)
+
+    def stream_mixed(self, prompt, conversation_id):
+        # The manual answer streams first, then the availability of the tools; either
+        # may be an "error" event without stopping the other. The extraction records
+        # the turn, so the manual answer does not record it a second time.
+        yield from self.stream_manual(prompt, conversation_id, record=False)
+        yield from self.stream_consulta(prompt, conversation_id)
+
+    def consulta(self, prompt, conversation_id):
+        try:
+            conversation = self.conversation_store.get(conversation_id)
+            descriptions, date_str, conversation = self.extract_pieces(
+                prompt, conversation
+            )
+            self.conversation_store.save(conversation_id, conversation)
+
+            if not descriptions and not date_str:
+                return NOTHING_FOUND, 200
+            if not descriptions:
+                # Follow-ups like "e amanhã?" keep the pieces of the earlier turns
+                descriptions = conversation.pieces
+
+            pieces_info, matched = self.get_pieces_info(descriptions)
+            saps = [piece["sap"] for piece in pieces_info]
+            # Likewise "e a serra circular?" keeps the date of the earlier turns
+            parsed_date = parse_date(date_str or conversation.date)
+            hours = self.get_common_availability(saps, parsed_date)
+
+            response = self._availability(
+                pieces_info, descriptions, matched, parsed_date, hours
+            )
+            if saps and not hours:
+                # Offer the first free hour of each of the next days that have one,
+                # instead of a retry per day
+                response["next_windows"] = self.get_common_windows(
+                    saps, 1, parsed_date + timedelta(days=1), limit=3, per_day=True
+                )
+            return response, 200
+
+        except Exception as e:
+            traceback.print_exc()
+            return error_payload(e), 500
+
+    def consulta_mista(self, prompt, conversation_id):
+        # The turn is recorded once, by the extraction
+        parts, parts_status = self.consulta(prompt, conversation_id)
+        manual, manual_status = self.consulta_manual(
+            prompt, conversation_id, record=False
+        )
+        return mixed_payload(parts, parts_status, manual, manual_status)
+
+    def consulta_manual(self, prompt, conversation_id, record=True):
+        try:
+            current = self.manual_index.current
+            answer = self.answer_question(
+                prompt, current["retriever"], current["chunks"], current["lexical"]
+            )
+
+            # Save the prompt and answer to conversation history
+            if record:
+                conversation = self.conversation_store.get(conversation_id)
+                conversation.record(prompt, answer)
+                self.conversation_store.save(conversation_id, conversation)
+
+            return {"answer": answer}, 200
+
+        except Exception as e:
+            traceback.print_exc()
+            return error_payload(e), 500
+
+    def janelas(self, data):
+        # Earliest windows where all requested tools are free for `duration` hours
+        try:
+            params = window_request(data)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        descriptions = params["descriptions"]
+        pieces_info, matched = (
+            self.get_pieces_info(descriptions) if descriptions else ([], [])
+        )
+        saps = params["saps"] + [piece["sap"] for piece in pieces_info]
+        windows = self.get_common_windows(
+            saps,
+            params["duration"],
+            params["start_date"],
+            params["horizon_days"],
+            params["limit"],
+        )
+        response = {
+            "windows": windows,
+            "found_pieces": pieces_info,
+            "unmatched_pieces": unmatched(descriptions, matched),
+            "duration": params["duration"],
+        }
+        return response, 200
+
+    def extract_pieces(self, prompt, conversation):
+        try:
+            # Without the catalog the request goes straight to the model
+            index = None
+            try:
+                index = self.piece_catalog.get_index()
+                data = self._local_extraction(prompt, index)
+            except Exception as e:
+                print("Local extraction unavailable, asking the model:", e)
+                index = data = None
+            if data:
+                reply = json.dumps(data, ensure_ascii=False)
+                return self._accept(prompt, conversation, data, reply)
+
+            messages, cache_key = self._extraction_request(prompt, conversation)
+            cached = self.llm_cache.get(cache_key)
+            metrics.cache("llm", "hit" if cached else "miss")
+            if cached:
+                return self._accept(prompt, conversation, cached, cached["reply"])
+
+            # The cheap model first; replies without a valid pieces/date JSON, or
+            # naming tools the catalog does not know, go to the next model
+            model, reply, data = self.model_cascade.complete(
+                self.client,
+                "extract",
+                messages,
+                parse_extraction,
+                self._confidence(index),
+                temperature=0,
+            )
+            if data is None:
+                conversation.record(prompt, reply)
+                return [], None, conversation
+            self.llm_cache.put(cache_key, dict(data, reply=reply))
+            return self._accept(prompt, conversation, data, reply)
+
+        except Exception as e:
+            traceback.print_exc()
+            return [], None, conversation
+
+    def get_pieces_info(self, descriptions):
+        try:
+            results = None
+            try:
+                with metrics.stage("resolve_pieces"):
+                    results = self.piece_catalog.get_index().resolve(
+                        descriptions, PIECE_SIMILARITY_THRESHOLD, PIECE_CANDIDATES
+                    )
+            except Exception as e:
+                print("Piece catalog unavailable, falling back to Postgres:", e)
+
+            if results is None:
+                with metrics.stage("postgres"):
+                    with self.get_connection() as conn, conn.cursor() as cur:
+                        results = resolve_pieces(cur, descriptions)
+            return matched_pieces(results)
+
+        except Exception as e:
+            traceback.print_exc()
+            return [], []
+
+    def get_common_availability(self, saps, target_date=None):
+        try:
+            return self.availability_engine.common_hours(
+                saps, target_date or date.today()
+            )
+        except Exception as e:
+            traceback.print_exc()
+            return []
+
+    def get_common_windows(
+        self,
+        saps,
+        duration,
+        start_date,
+        horizon_days=WINDOW_HORIZON_DAYS,
+        limit=WINDOW_LIMIT,
+        per_day=False,
+    ):
+        try:
+            return self.availability_engine.earliest_windows(
+                saps, duration, start_date, horizon_days, limit, per_day
+            )
+        except Exception as e:
+            traceback.print_exc()
+            return []
+
+    def prepare_answer(self, question, retriever, chunks, lexical, k=MANUAL_SEARCH_K):
+        # Returns (answer, None) on a cache hit, otherwise (None, state) with the
+        # prompt messages and what is needed to finish and cache the answer
+        cached = self.answer_cache.get(question)
+        if cached:
+            metrics.cache("answer", "hit")
+            return cached["answer"], None
+
+        # Passages sharing the question's words, codes and model numbers
+        with metrics.stage("bm25"):
+            lexical_hits, decisive = lexical.search(question, k)
+        if decisive:
+            # A rare code pins the passage down; no need to embed the question
+            metrics.cache("lexical_fast_path", "hit")
+            embedding = None
+            ranked = lexical_hits
+        else:
+            metrics.cache("lexical_fast_path", "miss")
+            with metrics.stage("embedding"):
+                response = self.client.embeddings.create(
+                    input=question, model=EMBEDDING_MODEL
+                )
+            metrics.tokens(EMBEDDING_MODEL, response.usage)
+            embedding = np.array(response.data[0].embedding).astype("float32")
+
+            similar = self._similar_hit(question, embedding)
+            if similar:
+                return similar, None
+
+            with metrics.stage("faiss"):
+                vector_hits = retriever.search(embedding, k)
+            ranked = fuse([lexical_hits, vector_hits], k)
+        return None, self._answer_state(question, chunks, ranked, embedding, decisive)
+
+    def answer_question(self, question, retriever, chunks, lexical, k=MANUAL_SEARCH_K):
+        cached_answer, state = self.prepare_answer(question, retriever, chunks, lexical, k)
+        if cached_answer:
+            return cached_answer
+
+        model = self.model_cascade.pick("answer", easy=state["easy"])
+        started = time.perf_counter()
+        with metrics.stage("answer"):
+            response = self.client.chat.completions.create(
+                model=model, messages=state["messages"], temperature=0
+            )
+        self.model_cascade.record(
+            "answer", model, time.perf_counter() - started, response.usage
+        )
+
+        answer = response.choices[0].message.content.strip()
+        answer += answer_footer(state["pages"])
+        self.answer_cache.put(question, state["embedding"], answer, state["pages"])
+        return answer
+
+    def answer_question_stream(
+        self, question, retriever, chunks, lexical, k=MANUAL_SEARCH_K
+    ):
+        # Yields the answer as tokens arrive, ending with the references footer
+        cached_answer, state = self.prepare_answer(question, retriever, chunks, lexical, k)
+        if cached_answer:
+            yield cached_answer
+            return
+
+        model = self.model_cascade.pick("answer", easy=state["easy"])
+        started = time.perf_counter()
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=state["messages"],
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+        answer = ""
+        usage = None
+        for chunk in stream:
+            # The last chunk has no choices, only the token usage
+            usage = chunk.usage or usage
+            delta = self._stream_delta(chunk, answer, started)
+            answer += delta
+            if delta:
+                yield delta
+        yield self._finish_stream(question, state, model, started, usage, answer)
+
+
+# Coroutine pipeline over an AsyncOpenAI client and an asyncpg pool, so a request
+# waiting on the LLM or the database does not hold an OS thread
+class AsyncPipeline(BasePipeline):
+    def __init__(self, client, pg_pool, **components):
+        super().__init__(client, **components)
+        self.pg_pool = pg_pool
+
+    async def main(self, prompt, conversation_id):
+        intent = self.classify(prompt)
+        if intent == "parts":
+            return (*await self.consulta(prompt, conversation_id), {})
+        if not self.manual_index.ready:
+            return self.indexing_response()
+        if intent == "manual":
+            return (*await self.consulta_manual(prompt, conversation_id), {})
+        return (*await self.consulta_mista(prompt, conversation_id), {})
+
+    async def stream_manual(self, prompt, conversation_id, record=True):
+        try:
+            current = self.manual_index.current
+            answer = ""
+            async for delta in self.answer_question_stream(
+                prompt, current["retriever"], current["chunks"], current["lexical"]
+            ):
+                answer += delta
+                yield sse_event("token", {"text": delta})
+
+            if record:
+                store = self.conversation_store
+                conversation = await store.get_async(conversation_id, self.pg_pool)
+                conversation.record(prompt, answer)
+                await store.save_async(conversation_id, conversation, self.pg_pool)
+            yield sse_event("done", {"answer": answer})
+
+        except Exception as e:
+            traceback.print_exc()
+            yield sse_event("error", error_payload(e))
+
+    async def stream_consulta(self, prompt, conversation_id):
+        payload, status = await self.consulta(prompt, conversation_id)
+        yield sse_event("result" if status == 200 else "error", payload)
+
+    async def stream_mixed(self, prompt, conversation_id):
+        # Same order and recording as Pipeline.stream_mixed
+        async for event in self.stream_manual(prompt, conversation_id, record=False):
+            yield event
+        async for event in self.stream_consulta(prompt, conversation_id):
+            yield event
+
+    async def consulta(self, prompt, conversation_id):
+        try:
+            store = self.conversation_store
+            conversation = await store.get_async(conversation_id, self.pg_pool)
+            descriptions, date_str, conversation = await self.extract_pieces(
+                prompt, conversation
+            )
+            await store.save_async(conversation_id, conversation, self.pg_pool)
+
+            if not descriptions and not date_str:
+                return NOTHING_FOUND, 200
+            if not descriptions:
+                # Follow-ups like "e amanhã?" keep the pieces of the earlier turns
+                descriptions = conversation.pieces
+
+            # Date parsing (CPU-bound dateparser) and piece lookup are independent;
+            # follow-ups like "e a serra circular?" keep the date of the earlier turns
+            parsed_date, (pieces_info, matched) = await asyncio.gather(
+                asyncio.to_thread(parse_date, date_str or conversation.date),
+                self.get_pieces_info(descriptions),
+            )
+            saps = [piece["sap"] for piece in pieces_info]
+            hours = await self.get_common_availability(saps, parsed_date)
+
+            response = self._availability(
+                pieces_info, descriptions, matched, parsed_date, hours
+            )
+            if saps and not hours:
+                response["next_windows"] = await self.get_common_windows(
+                    saps, 1, parsed_date + timedelta(days=1), limit=3, per_day=True
+                )
+            return response, 200
+
+        except Exception as e:
+            traceback.print_exc()
+            return error_payload(e), 500
+
+    async def consulta_mista(self, prompt, conversation_id):
+        # The halves are independent, so they run concurrently
+        (parts, parts_status), (manual, manual_status) = await asyncio.gather(
+            self.consulta(prompt, conversation_id),
+            self.consulta_manual(prompt, conversation_id, record=False),
+        )
+        return mixed_payload(parts, parts_status, manual, manual_status)
+
+    async def consulta_manual(self, prompt, conversation_id, record=True):
+        try:
+            current = self.manual_index.current
+            answer = await self.answer_question(
+                prompt, current["retriever"], current["chunks"], current["lexical"]
+            )
+
+            # Save the prompt and answer to conversation history
+            if record:
+                store = self.conversation_store
+                conversation = await store.get_async(conversation_id, self.pg_pool)
+                conversation.record(prompt, answer)
+                await store.save_async(conversation_id, conversation, self.pg_pool)
+
+            return {"answer": answer}, 200
+
+        except Exception as e:
+            traceback.print_exc()
+            return error_payload(e), 500
+
+    async def janelas(self, data):
+        try:
+            params = window_request(data)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        descriptions = params["descriptions"]
+        pieces_info, matched = (
+            await self.get_pieces_info(descriptions) if descriptions else ([], [])
+        )
+        saps = params["saps"] + [piece["sap"] for piece in pieces_info]
+        windows = await self.get_common_windows(
+            saps,
+            params["duration"],
+            params["start_date"],
+            params["horizon_days"],
+            params["limit"],
+        )
+        response = {
+            "windows": windows,
+            "found_pieces": pieces_info,
+            "unmatched_pieces": unmatched(descriptions, matched),
+            "duration": params["duration"],
+        }
+        return response, 200
+
+    async def extract_pieces(self, prompt, conversation):
+        try:
+            index = None
+            try:
+                index = await self.piece_catalog.get_index_async(self.pg_pool)
+                data = self._local_extraction(prompt, index)
+            except Exception as e:
+                print("Local extraction unavailable, asking the model:", e)
+                index = data = None
+            if data:
+                reply = json.dumps(data, ensure_ascii=False)
+                return self._accept(prompt, conversation, data, reply)
+
+            messages, cache_key = self._extraction_request(prompt, conversation)
+            # The SQLite cache blocks, so it is read and written off the event loop
+            cached = await asyncio.to_thread(self.llm_cache.get, cache_key)
+            metrics.cache("llm", "hit" if cached else "miss")
+            if cached:
+                return self._accept(prompt, conversation, cached, cached["reply"])
+
+            model, reply, data = await self.model_cascade.complete_async(
+                self.client,
+                "extract",
+                messages,
+                parse_extraction,
+                self._confidence(index),
+                temperature=0,
+            )
+            if data is None:
+                conversation.record(prompt, reply)
+                return [], None, conversation
+            await asyncio.to_thread(
+                self.llm_cache.put, cache_key, dict(data, reply=reply)
+            )
+            return self._accept(prompt, conversation, data, reply)
+
+        except Exception as e:
+            traceback.print_exc()
+            return [], None, conversation
+
+    async def get_pieces_info(self, descriptions):
+        try:
+            results = None
+            try:
+                with metrics.stage("resolve_pieces"):
+                    index = await self.piece_catalog.get_index_async(self.pg_pool)
+                    results = index.resolve(
+                        descriptions, PIECE_SIMILARITY_THRESHOLD, PIECE_CANDIDATES
+                    )
+            except Exception as e:
+                print("Piece catalog unavailable, falling back to Postgres:", e)
+
+            if results is None:
+                with metrics.stage("postgres"):
+                    results = await resolve_pieces_async(self.pg_pool, descriptions)
+            return matched_pieces(results)
+
+        except Exception as e:
+            traceback.print_exc()
+            return [], []
+
+    async def get_common_availability(self, saps, target_date=None):
+        try:
+            return await self.availability_engine.common_hours_async(
+                saps, target_date or date.today(), self.pg_pool
+            )
+        except Exception as e:
+            traceback.print_exc()
+            return []
+
+    async def get_common_windows(
+        self,
+        saps,
+        duration,
+        start_date,
+        horizon_days=WINDOW_HORIZON_DAYS,
+        limit=WINDOW_LIMIT,
+        per_day=False,
+    ):
+        try:
+            return await self.availability_engine.earliest_windows_async(
+                saps, duration, start_date, self.pg_pool, horizon_days, limit, per_day
+            )
+        except Exception as e:
+            traceback.print_exc()
+            return []
+
+    async def prepare_answer(
+        self, question, retriever, chunks, lexical, k=MANUAL_SEARCH_K
+    ):
+        cached = self.answer_cache.get(question)
+        if cached:
+            metrics.cache("answer", "hit")
+            return cached["answer"], None
+
+        with metrics.stage("bm25"):
+            lexical_hits, decisive = lexical.search(question, k)
+        if decisive:
+            metrics.cache("lexical_fast_path", "hit")
+            embedding = None
+            ranked = lexical_hits
+        else:
+            metrics.cache("lexical_fast_path", "miss")
+            with metrics.stage("embedding"):
+                response = await self.client.embeddings.create(
+                    input=question, model=EMBEDDING_MODEL
+                )
+            metrics.tokens(EMBEDDING_MODEL, response.usage)
+            embedding = np.array(response.data[0].embedding).astype("float32")
+
+            # Comparing against every cached question is a matrix product
+            similar = await asyncio.to_thread(self._similar_hit, question, embedding)
+            if similar:
+                return similar, None
+
+            with metrics.stage("faiss"):
+                vector_hits = await asyncio.to_thread(retriever.search, embedding, k)
+            ranked = fuse([lexical_hits, vector_hits], k)
+        return None, self._answer_state(question, chunks, ranked, embedding, decisive)
+
+    async def answer_question(
+        self, question, retriever, chunks, lexical, k=MANUAL_SEARCH_K
+    ):
+        cached_answer, state = await self.prepare_answer(
+            question, retriever, chunks, lexical, k
+        )
+        if cached_answer:
+            return cached_answer
+
+        model = self.model_cascade.pick("answer", easy=state["easy"])
+        started = time.perf_counter()
+        with metrics.stage("answer"):
+            response = await self.client.chat.completions.create(
+                model=model, messages=state["messages"], temperature=0
+            )
+        self.model_cascade.record(
+            "answer", model, time.perf_counter() - started, response.usage
+        )
+
+        answer = response.choices[0].message.content.strip()
+        answer += answer_footer(state["pages"])
+        self.answer_cache.put(question, state["embedding"], answer, state["pages"])
+        return answer
+
+    async def answer_question_stream(
+        self, question, retriever, chunks, lexical, k=MANUAL_SEARCH_K
+    ):
+        cached_answer, state = await self.prepare_answer(
+            question, retriever, chunks, lexical, k
+        )
+        if cached_answer:
+            yield cached_answer
+            return
+
+        model = self.model_cascade.pick("answer", easy=state["easy"])
+        started = time.perf_counter()
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=state["messages"],
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+        answer = ""
+        usage = None
+        async for chunk in stream:
+            usage = chunk.usage or usage
+            delta = self._stream_delta(chunk, answer, started)
+            answer += delta
+            if delta:
+                yield delta
+        yield self._finish_stream(question, state, model, started, usage, answer)
@@ -0,0 +1,84 @@
+import threading
+
+# Tables, function and triggers the backend relies on beyond pieces and
+# availability, as in db.sql. docker-entrypoint-initdb only runs db.sql on an empty
+# volume, so databases created before these were added get them on first use. The
+# advisory lock keeps workers starting together from racing on the DDL.
+SCHEMA_SQL = """
+SELECT pg_advisory_xact_lock(723101);
+
+CREATE TABLE IF NOT EXISTS conversations (
+  id VARCHAR PRIMARY KEY,
+  state TEXT NOT NULL,
+  updated_at DOUBLE PRECISION NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at);
+
+CREATE TABLE IF NOT EXISTS catalog_versions (
+  name VARCHAR PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalog_versions (name, version) VALUES ('pieces', 0), ('availability', 0)
+ON CONFLICT (name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION notify_table_change() RETURNS trigger AS $$
+DECLARE
+  new_version BIGINT;
+BEGIN
+  UPDATE catalog_versions SET version = version + 1
+  WHERE name = TG_TABLE_NAME
+  RETURNING version INTO new_version;
+  PERFORM pg_notify(TG_TABLE_NAME || '_changed', COALESCE(new_version, 0)::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_trigger WHERE tgname = 'pieces_changed' AND tgrelid = 'pieces'::regclass
+  ) THEN
+    CREATE TRIGGER pieces_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON pieces
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change();
+  END IF;
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_trigger
+    WHERE tgname = 'availability_changed' AND tgrelid = 'availability'::regclass
+  ) THEN
+    CREATE TRIGGER availability_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON availability
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change();
+  END IF;
+END;
+$$;
+"""
+
+_ready = False
+_lock = threading.Lock()
+
+
+def ensure_schema(get_connection):
+    # Runs SCHEMA_SQL once per process, before the first query that needs it
+    global _ready
+    if _ready:
+        return
+    with _lock:
+        if not _ready:
+            with get_connection() as conn, conn.cursor() as cur:
+                cur.execute(SCHEMA_SQL)
+            _ready = True
+
+
+async def ensure_schema_async(pg_pool):
+    # Same as ensure_schema, over an asyncpg pool; concurrent first requests wait
+    # on the advisory lock and find everything in place
+    global _ready
+    if _ready:
+        return
+    async with pg_pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(SCHEMA_SQL)
+    _ready = True
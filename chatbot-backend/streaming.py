@@ -0,0 +1,8 @@
+import json
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event, data):
+    # One Server-Sent Event with a JSON payload
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
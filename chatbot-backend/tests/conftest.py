@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend modules are imported by name, as the apps run from this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
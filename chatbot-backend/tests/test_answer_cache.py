@@ -0,0 +1,41 @@
+import numpy as np
+
+from answer_cache import SemanticAnswerCache, numbered_terms
+
+# Two questions with almost the same embedding
+EMBEDDING = np.array([1.0, 0.0, 0.0], dtype="float32")
+NEARBY = np.array([1.0, 0.01, 0.0], dtype="float32")
+
+
+def test_numbered_terms_join_codes_and_keep_numbers():
+    assert numbered_terms("Qual o torque do parafuso M-12 em 10 segundos?") == {
+        "m12",
+        "10",
+    }
+    assert numbered_terms("Como trocar o rolamento?") == frozenset()
+
+
+def test_similar_question_with_another_code_is_a_miss():
+    cache = SemanticAnswerCache()
+    cache.put("Qual o torque do parafuso M12?", EMBEDDING, "50 Nm", "página 3")
+
+    assert cache.get_similar("Qual o torque do parafuso M16?", NEARBY) is None
+
+
+def test_similar_question_with_the_same_code_is_a_hit():
+    cache = SemanticAnswerCache()
+    cache.put("Qual o torque do parafuso M12?", EMBEDDING, "50 Nm", "página 3")
+
+    hit = cache.get_similar("Qual é o torque do parafuso M12?", NEARBY)
+
+    assert hit["answer"] == "50 Nm"
+
+
+def test_best_match_with_the_same_code_wins_over_a_closer_one():
+    cache = SemanticAnswerCache()
+    cache.put("Torque do parafuso M16?", NEARBY, "80 Nm", "página 4")
+    cache.put("Torque do parafuso M12?", np.array([1.0, 0.05, 0.0]), "50 Nm", "página 3")
+
+    hit = cache.get_similar("Qual o torque do M12?", NEARBY)
+
+    assert hit["answer"] == "50 Nm"
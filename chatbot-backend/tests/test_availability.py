@@ -0,0 +1,153 @@
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from availability import AvailabilityEngine, common_mask, mask_hours, window_starts
+
+DAY = date(2026, 10, 19)
+# The day before DAY, so no hour of DAY has started yet
+BEFORE = datetime(2026, 10, 18, 12, 0)
+
+
+def hours_mask(*hours):
+    mask = 0
+    for hour in hours:
+        mask |= 1 << hour
+    return mask
+
+
+# Stands in for the pooled connection: answers FREE_MASKS_SQL from a dict of
+# {date: {sap: mask}} and counts the queries
+class FakeDatabase:
+    def __init__(self, masks):
+        self.masks = masks
+        self.queries = 0
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, sql, params):
+        self.queries += 1
+        (days,) = params
+        self.rows = [
+            (day, sap, mask)
+            for day in days
+            for sap, mask in self.masks.get(day, {}).items()
+        ]
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_mask_hours_lists_the_set_bits():
+    assert mask_hours(hours_mask(0, 7, 8, 23)) == [0, 7, 8, 23]
+    assert mask_hours(0) == []
+
+
+def test_common_mask_is_the_and_of_every_sap():
+    masks = {"A": hours_mask(8, 9, 10), "B": hours_mask(9, 10, 11)}
+
+    assert common_mask(masks, ["A", "B"]) == hours_mask(9, 10)
+    # A SAP without availability that day blocks every hour
+    assert common_mask(masks, ["A", "C"]) == 0
+    assert common_mask(masks, []) == 0
+
+
+def test_window_starts_need_every_hour_of_the_duration():
+    mask = hours_mask(8, 9, 10, 13, 14)
+
+    assert window_starts(mask, 1) == [8, 9, 10, 13, 14]
+    assert window_starts(mask, 2) == [8, 9, 13]
+    assert window_starts(mask, 3) == [8]
+    assert window_starts(mask, 4) == []
+
+
+def engine(masks):
+    database = FakeDatabase(masks)
+    return AvailabilityEngine(database.connection), database
+
+
+def test_windows_today_start_after_the_current_hour():
+    availability, _ = engine({DAY: {"A": hours_mask(8, 9, 10, 14, 15)}})
+
+    windows = availability.earliest_windows(
+        ["A"], 1, DAY, horizon_days=1, now=datetime(2026, 10, 19, 9, 30)
+    )
+
+    assert [w["start"] for w in windows] == [10, 14, 15]
+
+
+def test_days_before_today_have_no_windows():
+    availability, _ = engine({DAY: {"A": hours_mask(8, 9)}})
+
+    windows = availability.earliest_windows(
+        ["A"], 1, DAY, horizon_days=1, now=datetime(2026, 10, 20, 7, 0)
+    )
+
+    assert windows == []
+
+
+def test_windows_are_earliest_first_across_days():
+    next_day = DAY + timedelta(days=1)
+    availability, _ = engine(
+        {
+            DAY: {"A": hours_mask(8, 9, 10), "B": hours_mask(9, 10)},
+            next_day: {"A": hours_mask(7, 8), "B": hours_mask(7, 8)},
+        }
+    )
+
+    windows = availability.earliest_windows(
+        ["A", "B"], 2, DAY, horizon_days=2, now=BEFORE
+    )
+
+    assert windows == [
+        {"date": "2026-10-19", "start": 9, "end": 11},
+        {"date": "2026-10-20", "start": 7, "end": 9},
+    ]
+
+
+def test_limit_and_per_day():
+    masks = {DAY + timedelta(days=i): {"A": hours_mask(8, 9, 10)} for i in range(3)}
+    availability, _ = engine(masks)
+
+    limited = availability.earliest_windows(
+        ["A"], 1, DAY, horizon_days=3, limit=2, now=BEFORE
+    )
+    first_of_each_day = availability.earliest_windows(
+        ["A"], 1, DAY, horizon_days=3, per_day=True, now=BEFORE
+    )
+
+    assert [(w["date"], w["start"]) for w in limited] == [
+        ("2026-10-19", 8),
+        ("2026-10-19", 9),
+    ]
+    assert [(w["date"], w["start"]) for w in first_of_each_day] == [
+        ("2026-10-19", 8),
+        ("2026-10-20", 8),
+        ("2026-10-21", 8),
+    ]
+
+
+def test_horizon_is_loaded_in_one_query_and_then_cached():
+    availability, database = engine({DAY: {"A": hours_mask(8)}})
+
+    availability.earliest_windows(["A"], 1, DAY, horizon_days=7, now=BEFORE)
+    availability.earliest_windows(["A"], 1, DAY, horizon_days=7, now=BEFORE)
+    assert database.queries == 1
+
+    # Cached dates are dropped on availability_changed
+    availability.on_change("2")
+    availability.common_hours(["A"], DAY)
+    assert database.queries == 2
+
+
+def test_no_saps_or_duration_finds_nothing():
+    availability, database = engine({DAY: {"A": hours_mask(8)}})
+
+    assert availability.earliest_windows([], 1, DAY, now=BEFORE) == []
+    assert availability.earliest_windows(["A"], 0, DAY, now=BEFORE) == []
+    assert database.queries == 0
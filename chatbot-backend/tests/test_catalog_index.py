@@ -0,0 +1,58 @@
+import pytest
+
+from catalog_index import CatalogIndex, similarity, trigrams
+
+ROWS = [
+    ("MAT001", "Ferramentas de Corte", "Serra Circular"),
+    ("MAT907", "Ferramentas Manuais", "Serra Manual"),
+    ("EQP201", "Equipamentos de Solda", "Máquina de Solda MIG"),
+    ("MAT203", "Equipamentos de Solda", "Tocha de Solda TIG"),
+]
+
+
+def test_trigrams_match_show_trgm():
+    # SELECT show_trgm('cat') -> {"  c"," ca","at ","cat"}
+    assert trigrams("cat") == {"  c", " ca", "cat", "at "}
+    # Words are split on anything but letters and digits, each padded on its own
+    assert trigrams("foo|bar") == trigrams("foo") | trigrams("bar")
+
+
+def test_similarity_matches_pg_trgm():
+    # SELECT similarity('word', 'two words') -> 0.36363637
+    assert similarity("word", "two words") == pytest.approx(0.36363637)
+    assert similarity("abc", "xyz") == 0.0
+    assert similarity("", "") == 0.0
+
+
+def test_similarity_ignores_case_and_accents_like_unaccent_upper():
+    assert similarity("MÁQUINA DE SOLDA MIG", "maquina de solda mig") == 1.0
+
+
+def test_search_scores_equal_similarity():
+    index = CatalogIndex(ROWS)
+    for text in ("serra circular", "maquina solda", "tocha tig"):
+        for piece, score in index.search(text, limit=len(ROWS)):
+            assert score == pytest.approx(similarity(text, piece["descricao"]))
+
+
+def test_search_orders_by_score_then_sap():
+    # Both descriptions score the same against "chave", like ORDER BY sim_score
+    # DESC, p.sap
+    index = CatalogIndex(
+        [
+            ("MAT906", "Ferramentas Manuais", "Chave 13mm"),
+            ("MAT905", "Ferramentas Manuais", "Chave 12mm"),
+        ]
+    )
+    saps = [piece["sap"] for piece, _ in index.search("chave", limit=2)]
+    assert saps == ["MAT905", "MAT906"]
+
+
+def test_resolve_applies_the_threshold_to_the_best_candidate():
+    index = CatalogIndex(ROWS)
+    matched, unmatched = index.resolve(["serra circular", "furadeira"], 0.75)
+
+    assert matched["match"]["sap"] == "MAT001"
+    assert matched["score"] == 1.0
+    assert unmatched["match"] is None
+    assert len(matched["candidates"]) <= 3
@@ -0,0 +1,88 @@
+import pytest
+
+from lexical_index import LexicalIndex, analyze, fuse, is_code
+
+PASSAGES = [
+    {"text": "O erro E-04 indica falha no sensor de temperatura do motor."},
+    {"text": "Troque o rolamento 6205-2RS a cada 2000 horas de uso."},
+    {"text": "O motor deve ser lubrificado mensalmente com graxa."},
+    {"text": "Verifique o sensor de temperatura antes de ligar o motor."},
+    {"text": "Limpe o filtro de ar semanalmente."},
+]
+
+
+def test_compound_codes_are_joined_and_split():
+    assert analyze("Erro E-04 no rolamento 6205-2RS de 5mm") == [
+        "erro",
+        "e04",
+        "04",
+        "rolamento",
+        "62052rs",
+        "6205",
+        "2rs",
+        "5mm",
+    ]
+    # However the code is written, it meets the indexed term
+    assert "e04" in analyze("E04") and "e04" in analyze("e.04")
+
+
+def test_codes_need_a_letter_and_a_digit_and_are_not_measures():
+    assert all(is_code(term) for term in ("e04", "62052rs", "xj200"))
+    assert not any(is_code(term) for term in ("motor", "6205", "e4", "5mm", "220v"))
+
+
+def test_bm25_ranks_the_passages_containing_the_terms():
+    index = LexicalIndex.from_passages(PASSAGES)
+
+    hits, _ = index.search("como lubrificar o motor com graxa", 3)
+
+    assert hits[0][0] == 2
+    assert {i for i, _ in hits} <= {0, 2, 3}
+    assert [score for _, score in hits] == sorted(
+        (score for _, score in hits), reverse=True
+    )
+    assert index.search("qual a cor do painel", 3) == ([], False)
+
+
+def test_a_rare_code_covering_the_question_is_decisive():
+    index = LexicalIndex.from_passages(PASSAGES)
+
+    hits, decisive = index.search("o que significa o erro E04?", 3)
+
+    assert hits[0][0] == 0
+    assert decisive
+
+
+def test_no_code_or_low_coverage_is_not_decisive():
+    index = LexicalIndex.from_passages(PASSAGES)
+
+    # Plain words only
+    assert not index.search("sensor de temperatura do motor", 3)[1]
+    # The code is found, but most of the question is about something else
+    assert not index.search("erro E04 bomba hidráulica pressão válvula", 3)[1]
+
+
+def test_a_common_code_is_not_decisive():
+    passages = [{"text": f"Código E-04 na etapa {i}."} for i in range(5)]
+
+    _, decisive = LexicalIndex.from_passages(passages).search("erro E04", 3)
+
+    assert not decisive
+
+
+def test_saved_index_searches_the_same(tmp_path):
+    index = LexicalIndex.from_passages(PASSAGES)
+    prefix = str(tmp_path / "manual-lexical")
+
+    index.save(prefix)
+    loaded = LexicalIndex.load(prefix)
+
+    assert len(loaded) == len(PASSAGES)
+    assert loaded.search("erro E04", 3) == index.search("erro E04", 3)
+
+
+def test_fuse_adds_reciprocal_ranks():
+    fused = fuse([[(1, 9.0), (2, 5.0)], [(2, 0.9), (3, 0.5)]], 2)
+
+    assert [i for i, _ in fused] == [2, 1]
+    assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
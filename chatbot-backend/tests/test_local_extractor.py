@@ -0,0 +1,92 @@
+from datetime import date
+
+from catalog_index import CatalogIndex
+from local_extractor import extract_locally, find_dates, tokenize
+
+TODAY = date(2026, 10, 18)
+
+CATALOG = CatalogIndex(
+    [
+        (1001, "Ferramenta", "Chave 1/2"),
+        (1002, "Ferramenta", "Serra Circular"),
+        (1003, "Ferramenta", "Broca 3/8"),
+    ]
+)
+
+
+def dates_in(text):
+    return [value for value, _, _ in find_dates(tokenize(text), TODAY)]
+
+
+def test_fraction_after_a_piece_name_is_not_a_date():
+    assert dates_in("chave 1/2") == []
+    result = extract_locally("Chave 1/2", CATALOG, TODAY)
+    assert result["pieces"] == ["Chave 1/2"]
+    assert result["date"] is None
+
+
+def test_fraction_before_a_unit_is_not_a_date():
+    assert dates_in("preciso de 3/8 pol") == []
+
+
+def test_day_month_after_a_filler_or_date_word_is_a_date():
+    assert dates_in("para 5/11") == [date(2026, 11, 5)]
+    assert dates_in("dia 5/11") == [date(2026, 11, 5)]
+    assert dates_in("ate 5/11") == [date(2026, 11, 5)]
+
+
+def test_size_and_date_in_one_request():
+    result = extract_locally("preciso da chave 1/2 amanhã", CATALOG, TODAY)
+    assert result["pieces"] == ["Chave 1/2"]
+    assert result["date"] == "2026-10-19"
+
+
+def test_relative_days():
+    assert dates_in("hoje") == [TODAY]
+    assert dates_in("amanhã") == [date(2026, 10, 19)]
+    assert dates_in("depois de amanhã") == [date(2026, 10, 20)]
+    assert dates_in("daqui a 3 dias") == [date(2026, 10, 21)]
+    assert dates_in("daqui a tres dias") == [date(2026, 10, 21)]
+
+
+def test_weekdays_are_the_next_one_on_or_after_today():
+    # TODAY is a Sunday
+    assert dates_in("segunda") == [date(2026, 10, 19)]
+    assert dates_in("sexta-feira") == [date(2026, 10, 23)]
+    assert dates_in("domingo") == [TODAY]
+    assert dates_in("próximo domingo") == [date(2026, 10, 25)]
+    assert dates_in("domingo que vem") == [date(2026, 10, 25)]
+
+
+def test_day_of_month_rolls_over_to_the_next_month():
+    assert dates_in("dia 20") == [date(2026, 10, 20)]
+    assert dates_in("dia 3") == [date(2026, 11, 3)]
+    assert dates_in("5 de novembro") == [date(2026, 11, 5)]
+    assert dates_in("5 de janeiro") == [date(2027, 1, 5)]
+
+
+def test_explicit_dates():
+    assert dates_in("2026-12-01") == [date(2026, 12, 1)]
+    assert dates_in("01/12/2026") == [date(2026, 12, 1)]
+    assert dates_in("5 de novembro de 2027") == [date(2027, 11, 5)]
+
+
+def test_pieces_and_date_are_extracted_with_full_confidence():
+    result = extract_locally("serra circular e broca 3/8 amanhã", CATALOG, TODAY)
+    assert result == {
+        "pieces": ["Serra Circular", "Broca 3/8"],
+        "date": "2026-10-19",
+        "confidence": 1.0,
+    }
+
+
+def test_words_left_unexplained_lower_the_confidence():
+    result = extract_locally("serra circular para o torno amanhã", CATALOG, TODAY)
+    assert result["pieces"] == ["Serra Circular"]
+    assert result["confidence"] == 0.75
+
+
+def test_ambiguous_or_invalid_dates_are_left_to_the_llm():
+    for prompt in ("serra circular hoje ou amanhã", "serra circular dia 31 de fevereiro"):
+        result = extract_locally(prompt, CATALOG, TODAY)
+        assert result["confidence"] == 0.0
@@ -0,0 +1,117 @@
+from passages import (
+    format_references,
+    is_heading,
+    pack_context,
+    page_label,
+    split_into_passages,
+)
+from tokens import estimate_tokens
+
+PAGES = [
+    {
+        "page": 1,
+        "text": "Manual do Operador\n1 INTRODUÇÃO\nEste manual descreve a máquina.\n"
+        "2. Lubrificação\nLubrifique o eixo.\n",
+    },
+    {"page": 2, "text": "Use graxa de lítio.\nSEGURANÇA\nUse luvas."},
+]
+LINE = "Verifique o nível de óleo do redutor."
+
+
+def test_headings():
+    assert is_heading("3.2 Lubrificação")
+    assert is_heading("4) Segurança")
+    assert is_heading("CAPÍTULO 2 - INSTALAÇÃO")
+    # Sentences, short acronyms and long lines are body text
+    assert not is_heading("Lubrifique o eixo.")
+    assert not is_heading("NR-12")
+    assert not is_heading("1 " + "palavra " * 12)
+    assert not is_heading("")
+
+
+def test_passages_never_cross_a_heading():
+    passages = split_into_passages(PAGES)
+
+    assert [p["section"] for p in passages] == [
+        None,
+        "1 INTRODUÇÃO",
+        "2. Lubrificação",
+        "SEGURANÇA",
+    ]
+    # A section may continue on the next page
+    assert passages[2]["text"] == "2. Lubrificação\nLubrifique o eixo.\nUse graxa de lítio."
+    assert (passages[2]["page"], passages[2]["page_end"]) == (1, 2)
+
+
+def test_offsets_point_into_the_joined_pages():
+    document = "\n".join(page["text"] for page in PAGES)
+
+    for passage in split_into_passages(PAGES):
+        # Blank lines are left out of the passage text
+        span = document[passage["start"] : passage["end"]]
+        assert [line for line in span.split("\n") if line] == passage["text"].split("\n")
+
+
+def test_long_sections_overlap_and_repeat_the_heading():
+    line_tokens = estimate_tokens(LINE)
+    pages = [{"page": 1, "text": "5 MANUTENÇÃO\n" + "\n".join([LINE] * 10)}]
+
+    passages = split_into_passages(
+        pages, max_tokens=3 * line_tokens, overlap_tokens=line_tokens
+    )
+
+    assert len(passages) > 1
+    for previous, passage in zip(passages, passages[1:]):
+        assert passage["text"].startswith("5 MANUTENÇÃO\n")
+        # The last line of a passage is the first line of the next one
+        assert passage["start"] == previous["end"] - len(LINE)
+
+
+def test_heading_without_body_is_dropped():
+    pages = [{"page": 1, "text": "1 INTRODUÇÃO\n2 SEGURANÇA\nUse luvas."}]
+
+    passages = split_into_passages(pages)
+
+    assert [p["text"] for p in passages] == ["2 SEGURANÇA\nUse luvas."]
+
+
+def passage(start, end, text, doc=None, page=1):
+    return {
+        "start": start,
+        "end": end,
+        "text": text,
+        "page": page,
+        "page_end": page,
+        "doc": doc,
+    }
+
+
+def test_pack_context_skips_repeats_and_returns_document_order():
+    best = passage(100, 200, "b" * 100)
+    repeat = passage(110, 210, "c" * 100)
+    other_doc = passage(110, 210, "d" * 100, doc="B")
+    earlier = passage(0, 100, "a" * 100)
+
+    packed = pack_context([best, repeat, other_doc, earlier], budget_tokens=1000)
+
+    assert packed == [earlier, best, other_doc]
+
+
+def test_pack_context_keeps_to_the_budget():
+    long = passage(0, 400, LINE * 10)
+    short = passage(500, 540, LINE)
+
+    packed = pack_context([long, short], budget_tokens=estimate_tokens(LINE) + 1)
+
+    assert packed == [short]
+
+
+def test_page_labels_and_references():
+    spread = dict(passage(0, 10, "x", doc="A"), page=3, page_end=4)
+
+    assert page_label(passage(0, 10, "x", page=2)) == "Página 2"
+    assert page_label(spread) == "Manual A, páginas 3-4"
+    assert (
+        format_references([spread, passage(0, 10, "x", doc="B", page=7)])
+        == "Manual A, páginas 3, 4; Manual B, página 7"
+    )
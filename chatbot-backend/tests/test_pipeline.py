@@ -0,0 +1,84 @@
+import asyncio
+from datetime import date, timedelta
+
+from catalog_index import CatalogIndex
+from conversation_store import MemoryConversationStore
+from pipeline import AsyncPipeline, Pipeline
+
+CATALOG = CatalogIndex(
+    [
+        (1001, "Ferramenta", "Serra Circular"),
+        (1002, "Ferramenta", "Furadeira de Impacto"),
+    ]
+)
+
+
+class StaticCatalog:
+    def get_index(self):
+        return CATALOG
+
+    async def get_index_async(self, pg_pool):
+        return CATALOG
+
+
+# Every SAP is free from 8h to 12h; records the dates asked for
+class RecordingAvailability:
+    def __init__(self):
+        self.dates = []
+
+    def common_hours(self, saps, day):
+        self.dates.append(day)
+        return [8, 9, 10, 11]
+
+    async def common_hours_async(self, saps, day, pg_pool):
+        return self.common_hours(saps, day)
+
+
+def components(availability):
+    # The prompts below are parsed locally, so nothing reaches the model or caches
+    return dict(
+        answer_cache=None,
+        llm_cache=None,
+        intent_router=None,
+        model_cascade=None,
+        piece_catalog=StaticCatalog(),
+        availability_engine=availability,
+        conversation_store=MemoryConversationStore(),
+        manual_index=None,
+    )
+
+
+def test_follow_up_without_date_keeps_the_conversation_date():
+    availability = RecordingAvailability()
+    pipeline = Pipeline(None, None, **components(availability))
+    tomorrow = date.today() + timedelta(days=1)
+
+    first, _ = pipeline.consulta("Furadeira de Impacto amanhã", "c1")
+    second, _ = pipeline.consulta("e a serra circular?", "c1")
+
+    assert first["date"] == second["date"] == tomorrow.isoformat()
+    assert second["found_pieces"][0]["descricao"] == "Serra Circular"
+    assert availability.dates == [tomorrow, tomorrow]
+
+
+def test_first_turn_without_date_asks_for_today():
+    availability = RecordingAvailability()
+    pipeline = Pipeline(None, None, **components(availability))
+
+    response, _ = pipeline.consulta("serra circular", "c1")
+
+    assert response["date"] == date.today().isoformat()
+
+
+def test_async_follow_up_without_date_keeps_the_conversation_date():
+    availability = RecordingAvailability()
+    pipeline = AsyncPipeline(None, None, **components(availability))
+    tomorrow = date.today() + timedelta(days=1)
+
+    async def conversation():
+        await pipeline.consulta("Furadeira de Impacto amanhã", "c1")
+        return await pipeline.consulta("e a serra circular?", "c1")
+
+    response, _ = asyncio.run(conversation())
+
+    assert response["date"] == tomorrow.isoformat()
@@ -0,0 +1,14 @@
+# Token counting used to size embedding batches and prompt budgets. Uses tiktoken when
+# it is installed and falls back to the ~4 characters per token rule of thumb.
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def estimate_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
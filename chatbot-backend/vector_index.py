@@ -0,0 +1,107 @@
+import glob
+import math
+import os
+
+import faiss
+import numpy as np
+
+# flat: exact search, hnsw: graph index, ivfpq: compressed inverted lists
+MANUAL_INDEX_TYPE = os.getenv("MANUAL_INDEX_TYPE", "flat")
+MANUAL_INDEX_DIR = os.getenv("MANUAL_INDEX_DIR", "index_cache")
+HNSW_M = int(os.getenv("HNSW_M", 32))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+IVF_NLIST = int(os.getenv("IVF_NLIST", 1024))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))
+PQ_M = int(os.getenv("PQ_M", 64))
+
+
+def _pq_subquantizers(dimension, m):
+    # PQ needs the dimension to be a multiple of the number of sub-quantizers
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def build_index(vectors, kind=MANUAL_INDEX_TYPE):
+    n, dimension = vectors.shape
+    if kind == "ivfpq":
+        nlist = max(1, min(IVF_NLIST, int(math.sqrt(n))))
+        # k-means wants ~39 points per centroid, and PQ trains 256 codes per sub-space
+        if n < 39 * max(nlist, 256):
+            print(f"Only {n} vectors, too few to train IVF-PQ; using a flat index")
+            kind = "flat"
+        else:
+            quantizer = faiss.IndexFlatL2(dimension)
+            index = faiss.IndexIVFPQ(
+                quantizer, dimension, nlist, _pq_subquantizers(dimension, PQ_M), 8
+            )
+            index.train(vectors)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M)
+    elif kind == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    elif kind != "ivfpq":
+        raise ValueError(f"Unknown MANUAL_INDEX_TYPE: {kind}")
+    index.add(vectors)
+    return ManualRetriever(index)
+
+
+# Single retrieval interface over whichever FAISS index backs the manual
+class ManualRetriever:
+    def __init__(self, index):
+        self.index = index
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        elif isinstance(index, faiss.IndexIVF):
+            index.nprobe = IVF_NPROBE
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def search(self, vector, k):
+        query = np.asarray(vector, dtype="float32").reshape(1, -1)
+        distances, ids = self.index.search(query, k)
+        return [(int(i), float(d)) for i, d in zip(ids[0], distances[0]) if i >= 0]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        # Memory-map the index so forked workers share the same pages
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            index = faiss.read_index(path)
+        return cls(index)
+
+
+def index_path(version, kind=MANUAL_INDEX_TYPE):
+    return os.path.join(MANUAL_INDEX_DIR, f"manual-{kind}-{version[:16]}.faiss")
+
+
+def load_or_build_index(version, get_vectors, kind=MANUAL_INDEX_TYPE):
+    # Reuse the persisted index for this exact set of passages, otherwise build it
+    # from get_vectors() and persist it for the next start
+    path = index_path(version, kind)
+    if os.path.exists(path):
+        try:
+            retriever = ManualRetriever.load(path)
+            print(f"Loaded {kind} index with {len(retriever)} vectors from {path}")
+            return retriever
+        except RuntimeError as e:
+            print("Rebuilding unreadable index:", e)
+
+    retriever = build_index(get_vectors(), kind)
+    try:
+        retriever.save(path)
+        # Indexes for previous versions of the corpus are never loaded again
+        for stale in glob.glob(os.path.join(MANUAL_INDEX_DIR, f"manual-{kind}-*.faiss")):
+            if stale != path:
+                os.remove(stale)
+    except (OSError, RuntimeError) as e:
+        print("Could not persist index:", e)
+    return retriever
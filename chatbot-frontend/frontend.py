@@ -1,3 +1,4 @@
+import json
 import requests
 import uuid
 import streamlit as st
@@ -9,6 +10,10 @@ import base64
 # Load environment variables from .env file
 load_dotenv()
 
+BACKEND_URL = os.getenv(
+    "BACKEND_URL", "http://ec2-15-228-54-226.sa-east-1.compute.amazonaws.com:5001"
+)
+
 # Set Tractian blue color
 tractian_blue = "#3662e3"
 
@@ -23,6 +28,20 @@ def load_base64_image(txt_path):
         return file.read()
 
 
+# Parse the backend's Server-Sent Events into (event, data) pairs as they arrive
+def read_events(response):
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:") :].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:") :].strip())
+
+
 # Load base64 images
 favicon_base64 = load_base64_image(favicon_path)
 logo_base64 = load_base64_image(
@@ -84,29 +103,58 @@ if prompt := st.chat_input("Qual sua dúvida?"):
     # Prepare payload for the backend request
     payload = {"prompt": prompt, "conversation_id": conversation_id}
 
-    # Send request to the backend
+    # Send request to the backend; manual answers are streamed token by token
     response = requests.post(
-        "http://ec2-15-228-54-226.sa-east-1.compute.amazonaws.com:5001/main",
-        json=payload,
+        f"{BACKEND_URL}/main/stream", json=payload, stream=True
     )
 
+    response_data = None
+    answer_placeholder = None
+    streamed_answer = ""
+    stream_errors = []
     if response.status_code == 200:
-        # Parse the response JSON
-        response_data = response.json()
+        for event, data in read_events(response):
+            if event == "token":
+                # Render the answer as it grows instead of waiting for all of it
+                if answer_placeholder is None:
+                    answer_placeholder = st.chat_message("assistant").empty()
+                streamed_answer += data["text"]
+                answer_placeholder.markdown(streamed_answer + "▌")
+            elif event in ("done", "result"):
+                # Mixed questions send the manual answer ("done") and then the
+                # availability of the tools ("result")
+                response_data = dict(response_data or {}, **data)
+            elif event == "error":
+                # The backend failed after the stream started; in mixed questions
+                # either half may fail, so every reason is shown
+                stream_errors.append(data.get("message") or data.get("error"))
+
+    if streamed_answer and "answer" not in (response_data or {}):
+        # The manual answer stopped midway: keep what arrived, without the cursor
+        answer_placeholder.markdown(streamed_answer)
+        st.session_state.messages.append(
+            {"role": "assistant", "content": streamed_answer}
+        )
+        if not stream_errors:
+            stream_errors.append("Erro ao conectar com o backend.")
 
+    if response_data is not None:
         # Check if response contains an "answer" key (direct answer format)
         if "answer" in response_data:
             # Display the direct answer in the conversation
-            with st.chat_message("assistant"):
-                st.markdown(response_data["answer"])
+            if answer_placeholder is not None:
+                answer_placeholder.markdown(response_data["answer"])
+            else:
+                with st.chat_message("assistant"):
+                    st.markdown(response_data["answer"])
 
             # Save the direct answer to session
             st.session_state.messages.append(
                 {"role": "assistant", "content": response_data["answer"]}
             )
 
-        # Otherwise, check if it contains the structured format
-        elif all(
+        # Check if it contains the structured format (also sent with an answer)
+        if all(
             key in response_data
             for key in ["date", "common_hours", "found_pieces", "unmatched_pieces"]
         ):
@@ -125,6 +173,12 @@ if prompt := st.chat_input("Qual sua dúvida?"):
             else:
                 response_content += "**Horários disponíveis para essa manutenção**: Nenhum horário disponível<br>"
 
+                # Suggest the next dates where all the tools are free
+                if response_data.get("next_windows"):
+                    response_content += "**Próximos horários disponíveis:**<br>"
+                    for window in response_data["next_windows"]:
+                        response_content += f"- {window['date']}: {window['start']}h às {window['end']}h<br>"
+
             # Print found pieces
             if response_data["found_pieces"]:
                 response_content += "**Ferramentas disponíveis:**<br>"
@@ -150,7 +204,7 @@ if prompt := st.chat_input("Qual sua dúvida?"):
                 {"role": "assistant", "content": response_content}
             )
 
-        else:
+        elif "answer" not in response_data:
             # Display user-friendly error message if required keys are missing
             error_message = (
                 "Desculpe, seja mais claro no prompt. Pergunte sobre a disponibilidade de alguma ferramenta para alguma data ou sobre alguma informação referente ao manual.\n\n"
@@ -164,8 +218,27 @@ if prompt := st.chat_input("Qual sua dúvida?"):
                 {"role": "assistant", "content": error_message}
             )
 
-    else:
-        error_message = "Erro ao conectar com o backend."
+    if stream_errors and (response_data is not None or streamed_answer):
+        # Shown next to the half that did arrive
+        for error_message in stream_errors:
+            with st.chat_message("assistant"):
+                st.markdown(error_message)
+            st.session_state.messages.append(
+                {"role": "assistant", "content": error_message}
+            )
+
+    elif response_data is None and not streamed_answer:
+        error_message = (
+            "\n\n".join(stream_errors) or "Erro ao conectar com o backend."
+        )
+        # The backend answers manual questions only once the manual is indexed
+        if response.status_code == 503:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+            if body.get("status") == "indexing":
+                error_message = body["message"]
         with st.chat_message("assistant"):
             st.markdown(error_message)
 